@@ -0,0 +1,190 @@
+"""
+Micro-benchmarks for the pipeline's hot paths
+Reading generation, payload encoding/decoding and the SQLite insert path,
+reported as machine-readable JSON so runs can be compared for regressions
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+
+from common.payload_codec import decode_binary, decode_json, encode_binary, encode_json
+from common.rules import RULE_SETS
+from common.sensor_model import generate_rightech_data, generate_sensor_data, telemetry_messages
+from common.sinks import ConsoleSink, NullSink, RotatingFileSink
+from data_structure.air_quality_emulator import AirQualityEmulator
+from mqtt.sqlite_writer import BatchedWriter
+from mqtt.telemetry_store import RawTelemetryStore, ReadingStore
+
+
+def timed(name, func, iterations, unit="ops"):
+    """Run func(iterations) once and return a result record"""
+    started = time.perf_counter()
+    func(iterations)
+    seconds = time.perf_counter() - started
+    return {
+        "name": name,
+        "iterations": iterations,
+        "seconds": round(seconds, 6),
+        f"{unit}_per_sec": round(iterations / seconds, 1),
+        "us_per_op": round(seconds / iterations * 1e6, 3),
+    }
+
+
+def bench_generation(iterations):
+    rng = random.Random(1)
+
+    def mqtt_profile(n):
+        for _ in range(n):
+            generate_sensor_data("air_monitor_001", rng)
+
+    def rightech_profile(n):
+        for _ in range(n):
+            generate_rightech_data(rng)
+
+    return [timed("generate_sensor_data[mqtt]", mqtt_profile, iterations),
+            timed("generate_sensor_data[rightech]", rightech_profile, iterations)]
+
+
+def bench_encoding(iterations):
+    data = generate_sensor_data("air_monitor_001", random.Random(1))
+    json_payload, binary_payload = encode_json(data), encode_binary(data)
+
+    def loop(func, arg):
+        def run(n):
+            for _ in range(n):
+                func(arg)
+        return run
+
+    return [
+        timed("encode[per-topic]", loop(telemetry_messages, data), iterations),
+        timed("encode[json]", loop(encode_json, data), iterations),
+        timed("encode[binary]", loop(encode_binary, data), iterations),
+        timed("decode[json]", loop(decode_json, json_payload), iterations),
+        timed("decode[binary]", loop(decode_binary, binary_payload), iterations),
+    ]
+
+
+def bench_rules(iterations):
+    rules = RULE_SETS["thingsboard"]
+    values = (30.0, 55.0, 1050, 22.5, 50.2)
+
+    def classify(n):
+        for _ in range(n):
+            rules.classify(*values)
+
+    def windowed(n):
+        engine = rules.alert_engine()
+        devices = [f"air_monitor_{i:03d}" for i in range(1000)]
+        for i in range(n):
+            engine.update(devices[i % 1000], i * 1000, values)
+
+    return [timed("rules.classify", classify, iterations),
+            timed("rules.alerts[1000 devices]", windowed, iterations)]
+
+
+def bench_sinks(iterations, directory):
+    """Generation plus output per reading: the emulators' full console block vs sampled/headless sinks"""
+    render = AirQualityEmulator().render
+    devnull = open(os.devnull, "w", encoding="utf-8")
+
+    def through(make_sink):
+        def run(n):
+            sink = make_sink()
+            for _ in range(n):
+                sink.write(generate_sensor_data("air_monitor_001"))
+            sink.close()
+        return run
+
+    results = [
+        timed("sink[console full]", through(lambda: ConsoleSink(render, stream=devnull)), iterations),
+        timed("sink[console every 100th]", through(lambda: ConsoleSink(render, every=100, stream=devnull)),
+              iterations),
+        timed("sink[console summary 1s]", through(lambda: ConsoleSink(render, every=0, summary=1.0, stream=devnull)),
+              iterations),
+        timed("sink[ndjson file]", through(lambda: RotatingFileSink(os.path.join(directory, "readings.ndjson"))),
+              iterations),
+        timed("sink[quiet]", through(NullSink), iterations),
+    ]
+    devnull.close()
+    return results
+
+
+def bench_inserts(rows, directory):
+    results = []
+    raw_row = ("v1/devices/me/telemetry/pm25", "25.3", "2026-01-01T00:00:00.000000")
+
+    # The original path: one INSERT + commit per message
+    def per_row_commit(n):
+        conn = sqlite3.connect(os.path.join(directory, "per_row.db"))
+        conn.execute("CREATE TABLE telemetry (topic TEXT, value TEXT, received_at TEXT)")
+        for _ in range(n):
+            conn.execute("INSERT INTO telemetry VALUES (?, ?, ?)", raw_row)
+            conn.commit()
+        conn.close()
+
+    def batched(store_factory, make_row):
+        def run(n):
+            writer = BatchedWriter(store_factory()).start()
+            for i in range(n):
+                writer.put(make_row(i))
+            writer.close()
+        return run
+
+    results.append(timed("insert[per-row commit]", per_row_commit, min(rows, 2000), unit="rows"))
+    results.append(timed("insert[batched raw]", batched(
+        lambda: RawTelemetryStore(os.path.join(directory, "raw.db")), lambda i: raw_row), rows, unit="rows"))
+    results.append(timed("insert[batched typed]", batched(
+        lambda: ReadingStore(os.path.join(directory, "typed.db")),
+        lambda i: (f"air_monitor_{i % 100:03d}", 1_700_000_000_000 + i, 25.3, 40.1, 800, 22.5, 50.2, 0, 0)),
+        rows, unit="rows"))
+    return results
+
+
+def bench_batch_generator(rows):
+    try:
+        from common.sensor_batch import generate_batch
+    except ImportError:
+        return []  # numpy not installed
+    devices = 1000
+    return [timed("generate_batch[mqtt]", lambda n: generate_batch(devices, n // devices, 0),
+                  rows, unit="rows")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks (JSON output)")
+    parser.add_argument("--iterations", type=int, default=100000, help="Iterations for generation/codec loops")
+    parser.add_argument("--rows", type=int, default=200000, help="Rows for the insert benchmarks")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = (bench_generation(args.iterations) + bench_encoding(args.iterations)
+                   + bench_rules(args.iterations) + bench_sinks(args.iterations, directory)
+                   + bench_inserts(args.rows, directory) + bench_batch_generator(args.rows * 10))
+
+    report = {
+        "suite": "micro",
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
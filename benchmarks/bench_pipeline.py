@@ -0,0 +1,200 @@
+"""
+End-to-end pipeline benchmark
+fleet emulator -> mini_broker -> mqtt_subscriber_sqlite.py (--schema typed) -> SQLite
+Each component runs as its own process on a local port; the report covers
+publish rate, committed rows/sec, publish->commit latency percentiles and
+CPU / peak RSS per component, as JSON
+"""
+
+import os
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import json
+import platform
+import signal
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+MESSAGES_PER_READING = {"per-topic": 7, "json": 1, "binary": 1}
+FLEET_MARGIN = 30.0  # Seconds past --duration for the fleet to connect, drain acks and exit
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+class Component:
+    """A child process whose CPU time and peak RSS are collected with wait4()"""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.started = time.monotonic()
+        self.process = subprocess.Popen([sys.executable] + args, stdout=subprocess.DEVNULL)
+        self.usage = None
+        self.killed = False
+
+    def stop(self, sig=signal.SIGINT, timeout=30.0):
+        if self.usage is None and self.process.poll() is None:
+            self.process.send_signal(sig)
+        return self.wait(timeout)
+
+    def wait(self, timeout=None):
+        """Reap the process, killing it once `timeout` seconds have passed"""
+        if self.usage is not None:
+            return self.usage
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pid, _, rusage = os.wait4(self.process.pid, os.WNOHANG)
+            if pid:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                self.process.kill()
+                self.killed = True
+                deadline = None
+            time.sleep(0.05)
+        self.process.returncode = 0  # Reaped above; keep Popen from waiting again
+        wall = time.monotonic() - self.started
+        cpu = rusage.ru_utime + rusage.ru_stime
+        self.usage = {
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(100 * cpu / wall, 1) if wall else None,
+            "max_rss_mb": round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss is KiB on Linux
+        }
+        return self.usage
+
+
+def count_rows(db_path):
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT count(*) FROM readings").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+
+def wait_until_settled(db_path, expected, timeout=30.0):
+    """Wait until the committed row count reaches expected or stops growing"""
+    deadline = time.monotonic() + timeout
+    last, stable_since = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        rows = count_rows(db_path)
+        if rows >= expected:
+            return rows
+        if rows != last:
+            last, stable_since = rows, time.monotonic()
+        elif time.monotonic() - stable_since > 2.0:
+            return rows
+        time.sleep(0.2)
+    return last
+
+
+def run(args, directory):
+    port = free_port()
+    db_path = os.path.join(directory, "bench.db")
+    subscriber_stats = os.path.join(directory, "subscriber.json")
+    fleet_stats = os.path.join(directory, "fleet.json")
+
+    broker = Component("broker", [os.path.join(ROOT, "mqtt", "mini_broker.py"), "--port", str(port)])
+    wait_for_port(port)
+    subscriber = Component("subscriber", [
+        os.path.join(ROOT, "mqtt", "mqtt_subscriber_sqlite.py"),
+        "--broker", "127.0.0.1", "--port", str(port), "--db", db_path, "--schema", "typed",
+        "--batch-size", str(args.batch_size), "--flush-ms", str(args.flush_ms),
+        "--synchronous", args.synchronous, "--quiet", "--stats-json", subscriber_stats])
+    time.sleep(args.warmup)  # Let the subscriber connect and subscribe
+
+    fleet = Component("fleet", [
+        os.path.join(ROOT, "mqtt", "air_quality_fleet.py"),
+        "--broker", "127.0.0.1", "--port", str(port), "--devices", str(args.devices),
+        "--interval", str(args.interval), "--duration", str(args.duration),
+        "--connections", str(args.connections), "--payload", args.payload,
+        "--qos", str(args.qos), "--timestamp-ms", "--stats-json", fleet_stats])
+    fleet.wait(args.duration + FLEET_MARGIN)
+    if fleet.killed:
+        subscriber.stop()
+        broker.stop()
+        raise RuntimeError(f"Fleet still running {FLEET_MARGIN:.0f}s after --duration; killed")
+
+    with open(fleet_stats, encoding="utf-8") as file:
+        published = json.load(file)
+    expected = published["published"] // MESSAGES_PER_READING[args.payload]
+    committed = wait_until_settled(db_path, expected)
+
+    subscriber.stop()
+    broker.stop()
+    with open(subscriber_stats, encoding="utf-8") as file:
+        ingested = json.load(file)
+
+    return {
+        "suite": "pipeline",
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "publisher": {
+            "messages": published["published"],
+            "msgs_per_sec": round(published["msgs_per_sec"], 1),
+            "readings_expected": expected,
+        },
+        "subscriber": {
+            "rows_committed": committed,
+            "rows_per_sec": round(committed / published["elapsed"], 1) if published["elapsed"] else None,
+            "rows_lost": max(0, expected - committed),
+            "commits": ingested["commits"],
+            "dropped": ingested["dropped"],
+            "e2e_latency_ms": ingested["commit_latency_ms"],
+        },
+        "resources": {component.name: component.wait() for component in (broker, subscriber, fleet)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput/latency benchmark (JSON output)")
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between readings per device")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of publishing")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--payload", default="per-topic", choices=sorted(MESSAGES_PER_READING))
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--flush-ms", type=int, default=200)
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL", "EXTRA"])
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to wait for the subscriber")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = run(args, directory)
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Fixed-bucket latency histogram
+Buckets are allocated once (log-spaced bounds), so recording a value is a
+bisect plus an integer increment - cheap enough for per-message hot paths
+"""
+
+from bisect import bisect_left
+
+
+def log_buckets(low=0.0001, high=60.0, per_decade=10):
+    """Upper bounds from low to high with per_decade buckets per power of ten"""
+    bounds = []
+    value = low
+    factor = 10 ** (1 / per_decade)
+    while value < high:
+        bounds.append(round(value, 9))
+        value *= factor
+    bounds.append(high)
+    return bounds
+
+
+DEFAULT_BUCKETS = log_buckets()  # 0.1 ms .. 60 s
+
+
+class Histogram:
+    def __init__(self, bounds=None):
+        self.bounds = list(bounds or DEFAULT_BUCKETS)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot: above the highest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self, scale=1.0):
+        """count/mean/p50/p99/p999/max, values multiplied by scale (e.g. 1000 for ms)"""
+        def scaled(value):
+            return None if value is None else round(value * scale, 3)
+        return {
+            "count": self.count,
+            "mean": scaled(self.total / self.count) if self.count else None,
+            "p50": scaled(self.percentile(50)),
+            "p99": scaled(self.percentile(99)),
+            "p999": scaled(self.percentile(99.9)),
+            "max": scaled(self.max) if self.count else None,
+        }
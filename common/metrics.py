@@ -0,0 +1,369 @@
+"""
+Prometheus-format metrics endpoint
+Counters and histograms are created once at startup, so the hot path only
+bumps an integer (Counter.inc) or records into a fixed-bucket Histogram.
+Numbers the components already keep (writer rows, outbox depth, ack
+latency ...) are registered as callbacks and read at scrape time, which
+costs nothing per message. MetricsServer serves them from a daemon thread:
+
+    GET /metrics                                 Prometheus text format 0.0.4
+    GET /profile?action=start&interval_ms=5      start the sampling profiler (interval_ms > 0)
+    GET /profile?action=stop                     stop it, return collapsed stacks
+    GET /profile                                 collapsed stacks so far
+"""
+
+import math
+import os
+import sys
+import threading
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from common.histogram import Histogram, log_buckets
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INF_LABEL = 'le="+Inf"'
+FAST_BUCKETS = log_buckets(0.000001, 1.0, 3)  # 1 µs .. 1 s, for per-message timings
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return "+Inf" if value == float("inf") else repr(value)
+    return str(value)
+
+
+class Family:
+    """One metric name: its children by label values, or a callback producing them"""
+
+    def __init__(self, name, help_text, kind, label_names=(), factory=None, callback=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind  # counter, gauge or histogram
+        self.label_names = tuple(label_names)
+        self.children = {}  # label values -> Counter / Gauge / Histogram
+        self._factory = factory
+        self._callback = callback  # () -> value, or {label values: value} with labels
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child for these label values; look it up once and keep it, not per message"""
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, self._factory())
+        return child
+
+    def samples(self):
+        if self._callback is None:
+            return list(self.children.items())
+        value = self._callback()
+        if self.label_names:
+            return list(value.items())
+        return [((), value)]
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, sample in self.samples():
+            if sample is None:
+                continue
+            if self.kind != "histogram":
+                value = sample.value if isinstance(sample, (Counter, Gauge)) else sample
+                lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(sample.bounds, sample.counts):
+                cumulative += count
+                le = _format_labels(self.label_names, values, f'le="{bound!r}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, INF_LABEL)} {sample.count}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(sample.total))}")
+            lines.append(f"{self.name}_count{labels} {sample.count}")
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self._lock = threading.Lock()
+
+    def _add(self, family):
+        """Register a family. Registering the same name again is fine (a second
+        subscriber or writer in one process): counters and histograms are shared,
+        and a callback is replaced so it reads the newest component. Reusing a
+        name for a different kind of metric raises ValueError."""
+        with self._lock:
+            existing = self.families.get(family.name)
+            if existing is not None:
+                if ((existing.kind, existing.label_names, existing._callback is None)
+                        != (family.kind, family.label_names, family._callback is None)):
+                    raise ValueError(f"Metric {family.name} is already registered as a different metric")
+                if family._callback is None:
+                    return existing
+            self.families[family.name] = family
+        return family
+
+    def _child_or_family(self, family):
+        family = self._add(family)
+        return family.labels() if not family.label_names else family
+
+    def counter(self, name, help_text, labels=()):
+        """A Counter, or a Family to call .labels(...) on when label names are given"""
+        return self._child_or_family(Family(name, help_text, "counter", labels, Counter))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._child_or_family(Family(name, help_text, "gauge", labels, Gauge))
+
+    def histogram(self, name, help_text, bounds=FAST_BUCKETS, labels=()):
+        return self._child_or_family(Family(name, help_text, "histogram", labels, lambda: Histogram(bounds)))
+
+    def callback(self, name, help_text, kind, fn, labels=()):
+        """Metric read at scrape time: fn() returns a number or Histogram, or a
+        {label values: number} dict when label names are given"""
+        return self._add(Family(name, help_text, kind, labels, callback=fn))
+
+    def unregister(self, name):
+        with self._lock:
+            self.families.pop(name, None)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = list(self.families.values())
+        for family in families:
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class SamplingProfiler:
+    """Wall-clock sampler of every thread's Python stack.
+
+    While running, a thread wakes every interval and walks
+    sys._current_frames(); identical stacks are counted. report() returns
+    them in the collapsed "frame;frame;frame count" format that
+    flamegraph.pl and speedscope read. Off by default and free while off.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = _check_interval(interval)
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = _Tally()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return self
+        if interval is not None:
+            self.interval = _check_interval(interval)
+        self._stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        return self.report()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, limit=None):
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common(limit))
+
+
+def _check_interval(interval):
+    """Sampling interval in seconds; a zero, negative or NaN one would spin or never sample"""
+    if not (isinstance(interval, (int, float)) and math.isfinite(interval) and interval > 0):
+        raise ValueError(f"Profiler interval must be a positive number of seconds: {interval!r}")
+    return interval
+
+
+PROFILER = SamplingProfiler()
+
+
+class MetricsServer:
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9108, profiler=PROFILER):
+        self.registry = registry
+        self.host = host
+        self.port = port  # 0 picks a free port; the bound one is stored by start()
+        self.profiler = profiler
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/metrics":
+                    self._reply(200, server.registry.render(), CONTENT_TYPE)
+                elif url.path == "/profile" and server.profiler is not None:
+                    try:
+                        self._reply(200, server.profile(parse_qs(url.query)), "text/plain; charset=utf-8")
+                    except ValueError as e:
+                        self._reply(400, f"{e}\n", "text/plain; charset=utf-8")
+                else:
+                    self._reply(404, "Not found\n", "text/plain; charset=utf-8")
+
+            def _reply(self, status, text, content_type):
+                body = text.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would flood the console
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def profile(self, query):
+        action = query.get("action", [""])[0]
+        if action == "start":
+            try:
+                interval_ms = float(query.get("interval_ms", [self.profiler.interval * 1000])[0])
+            except ValueError:
+                raise ValueError(f"interval_ms must be a number: {query['interval_ms'][0]!r}") from None
+            self.profiler.start(_check_interval(interval_ms / 1000))
+            return f"profiler started, sampling every {self.profiler.interval * 1000:g} ms\n"
+        if action == "stop":
+            return self.profiler.stop()
+        state = "running" if self.profiler.running else "stopped"
+        return f"# profiler {state}, {self.profiler.samples} samples\n" + self.profiler.report()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.profiler is not None and self.profiler.running:
+            self.profiler.stop()
+
+
+def register_writer(writer, registry=REGISTRY):
+    """Expose a BatchedWriter's queue, counters and latencies"""
+    registry.callback("sqlite_writer_queue_depth", "Rows waiting for the writer thread", "gauge",
+                      writer.queue.qsize)
+    registry.callback("sqlite_writer_rows_written_total", "Rows committed", "counter",
+                      lambda: writer.rows_written)
+    registry.callback("sqlite_writer_commits_total", "Transactions committed", "counter",
+                      lambda: writer.commits)
+    registry.callback("sqlite_writer_dropped_total", "Rows dropped on a full queue", "counter",
+                      lambda: writer.dropped)
+    registry.callback("sqlite_writer_errors_total", "Batches lost to SQLite errors", "counter",
+                      lambda: writer.errors)
+    registry.callback("sqlite_writer_commit_seconds", "Insert + commit time per batch", "histogram",
+                      lambda: writer.commit_time)
+    if writer.latency_column is not None:
+        registry.callback("sqlite_writer_ingest_latency_seconds", "Reading timestamp to commit", "histogram",
+                          lambda: writer.latency)
+
+
+def register_outbox(outbox, registry=REGISTRY):
+    """Expose an Outbox and its Publisher: queue depth, spill, reconnects, ack latency"""
+    publisher = outbox.publisher
+    registry.callback("outbox_connected", "1 while the broker connection is up", "gauge",
+                      lambda: outbox.connected)
+    registry.callback("outbox_depth", "Messages waiting in memory and on disk", "gauge",
+                      lambda: outbox.depth)
+    registry.callback("outbox_spill_bytes", "Bytes of queued messages on disk", "gauge",
+                      lambda: outbox.log.bytes)
+    registry.callback("outbox_spilled_total", "Messages written to the disk log", "counter",
+                      lambda: outbox.spilled)
+    registry.callback("outbox_drained_total", "Messages delivered from the queue", "counter",
+                      lambda: outbox.drained)
+    registry.callback("outbox_dropped_total", "Messages dropped (spill limit or offline QoS 0)", "counter",
+                      lambda: outbox.dropped)
+    registry.callback("outbox_connects_total", "Successful (re)connects", "counter",
+                      lambda: outbox.reconnects)
+    registry.callback("outbox_failed_batches_total", "Batches not acknowledged in time", "counter",
+                      lambda: outbox.failed_batches)
+    registry.callback("mqtt_published_total", "Messages handed to paho", "counter",
+                      lambda: publisher.published)
+    registry.callback("mqtt_acked_total", "QoS 1 messages acknowledged", "counter",
+                      lambda: publisher.acked)
+    registry.callback("mqtt_publish_rejected_total", "Publishes refused (no window slot or client error)",
+                      "counter", lambda: publisher.rejected)
+    registry.callback("mqtt_inflight", "Messages sent and not yet acknowledged", "gauge",
+                      lambda: publisher.inflight)
+    registry.callback("mqtt_ack_latency_seconds", "QoS 1 publish to PUBACK", "histogram",
+                      lambda: publisher.ack_latency)
+    registry.callback("mqtt_publish_call_seconds", "Time inside Publisher.publish()", "histogram",
+                      lambda: publisher.call_latency)
+
+
+def start_metrics(port, host="127.0.0.1"):
+    """Start the endpoint on port (None: disabled, 0: any free port); returns the server or None"""
+    if port is None:
+        return None
+    server = MetricsServer(REGISTRY, host, port).start()
+    print(f"📈 Metrics on http://{server.host}:{server.port}/metrics (profiler: /profile?action=start)")
+    return server
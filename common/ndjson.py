@@ -0,0 +1,38 @@
+"""
+NDJSON reading records
+One record per line in the air_quality_data_structure.json layout plus
+"status" - the single formatter behind the NDJSON import/export tool, the
+emulators' rotating log files and the backfill generator, so all of them
+write (and air_quality_ndjson.py import reads back) the same thing.
+Timestamps are epoch seconds when that loses nothing and milliseconds for
+sub-second readings; the importer takes both.
+"""
+
+import json
+
+from common.sensor_model import STATUS_NAMES
+
+# Complete readings skip building a dict per line
+_LINE = ('{"device_id": %s, "timestamp": %d, "pm25": %r, "pm10": %r, "co2": %d, '
+         '"temperature": %r, "humidity": %r, "relay_state": %s, "status": "%s"}\n')
+
+
+def format_record(row, names=STATUS_NAMES, timestamp_ms=False):
+    """One NDJSON line for a typed row (device name, ts, pm25, pm10, co2, temperature, humidity, relay, status);
+    names maps status codes to names, timestamp_ms writes milliseconds for every record"""
+    device, ts, pm25, pm10, co2, temperature, humidity, relay, status = row
+    timestamp = ts // 1000 if not timestamp_ms and ts % 1000 == 0 else ts
+    if None in row:
+        # Incomplete readings: the slower generic path writes nulls
+        record = {"device_id": device, "timestamp": timestamp, "pm25": pm25, "pm10": pm10,
+                  "co2": None if co2 is None else int(co2), "temperature": temperature,
+                  "humidity": humidity, "relay_state": None if relay is None else bool(relay),
+                  "status": None if status is None else names[status]}
+        return json.dumps(record) + "\n"
+    return _LINE % (json.dumps(device), timestamp, pm25, pm10, co2, temperature, humidity,
+                    "true" if relay else "false", names[status])
+
+
+def ndjson_line(reading):
+    """One NDJSON line for a Reading"""
+    return format_record(reading.as_row(), reading.names)
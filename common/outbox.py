@@ -0,0 +1,458 @@
+"""
+Store-and-forward outbound queue for the emulators
+Messages go to an in-memory ring and are published by a drain thread that
+keeps the publisher's in-flight window full, removing each batch from the
+queue as its acks arrive. While the broker is unreachable (or the ring is
+full) they spill to an append-only segment log on disk, so readings
+survive outages and even restarts; after reconnecting the backlog is
+drained oldest first at a capped rate so it does not flood the broker
+(live traffic in the ring is not capped). Delivery is at-least-once: when
+a batch's acks time out, everything unacknowledged is sent again. Topics
+on the publisher's QoS 0 fast path skip the queue and are dropped while
+offline.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from common.publisher import Publisher
+
+# crc32, topic length, payload length, qos; crc covers everything after itself
+RECORD_HEADER = struct.Struct("<IHIB")
+SEGMENT_BYTES = 4 * 1024 * 1024
+ACK_POLL = 0.005  # Seconds between checks for acks while batches are in flight
+WINDOW_WAIT = 1.0  # Seconds the drain thread waits for a publisher window slot before backing off
+PREPEND_GAP = 1000  # Free segment numbers made below the head when prepending reaches 0
+
+
+class SegmentLog:
+    """Append-only log of (topic, payload, qos) records in numbered segment files.
+
+    The read position (segment, offset) is kept in a small cursor file.
+    Segments are deleted once fully consumed. A torn record at the end of
+    a segment (crash mid-write) ends that segment. Segment numbers stay
+    non-negative: prepending below segment 0 first renumbers the log.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("seg_") and name.endswith(".log.tmp"):
+                os.remove(os.path.join(directory, name))  # Rewrite interrupted before its rename
+        self.segments = sorted(int(name[4:-4]) for name in os.listdir(directory)
+                               if name.startswith("seg_") and name.endswith(".log"))
+        self.head_offset = self._load_cursor()
+        if self.segments and self.segments[0] < 0:
+            self._renumber(-self.segments[0])  # Written by versions that numbered prepends below 0
+        if self.segments:
+            self._truncate_torn(self.segments[-1])
+        self.bytes = sum(os.path.getsize(self._path(seq)) for seq in self.segments) - self.head_offset
+        self.records = sum(self._count(seq) for seq in self.segments)
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"seg_{seq:010d}.log")
+
+    def _cursor_path(self):
+        return os.path.join(self.directory, "cursor")
+
+    def _load_cursor(self):
+        try:
+            with open(self._cursor_path(), encoding="ascii") as file:
+                seq, offset = (int(value) for value in file.read().split())
+        except (FileNotFoundError, ValueError):
+            return 0
+        # Segments before the cursor were consumed but not yet deleted
+        for stale in [s for s in self.segments if s < seq]:
+            self._remove(stale)
+        return offset if self.segments and self.segments[0] == seq else 0
+
+    def _save_cursor(self):
+        temporary = self._cursor_path() + ".tmp"
+        with open(temporary, "w", encoding="ascii") as file:
+            file.write(f"{self.segments[0] if self.segments else 0} {self.head_offset}")
+        os.replace(temporary, self._cursor_path())
+
+    def _remove(self, seq):
+        self.segments.remove(seq)
+        try:
+            os.remove(self._path(seq))
+        except FileNotFoundError:
+            pass
+
+    def _truncate_torn(self, seq):
+        # Appends after a torn record would be unreadable, so cut it off first
+        offset = self.head_offset if seq == self.segments[0] else 0
+        for _, offset in self._records(seq, offset):
+            pass
+        if os.path.getsize(self._path(seq)) > offset:
+            os.truncate(self._path(seq), offset)
+
+    def _count(self, seq):
+        offset = self.head_offset if seq == self.segments[0] else 0
+        return sum(1 for _ in self._records(seq, offset))
+
+    def _records(self, seq, offset, limit=None):
+        """Yield (record, end offset) from one segment"""
+        with open(self._path(seq), "rb") as file:
+            file.seek(offset)
+            while limit is None or limit > 0:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                crc, topic_length, payload_length, qos = RECORD_HEADER.unpack(header)
+                body = file.read(topic_length + payload_length)
+                if len(body) < topic_length + payload_length or zlib.crc32(header[4:] + body) != crc:
+                    return  # Torn write
+                offset += RECORD_HEADER.size + len(body)
+                yield (body[:topic_length].decode(), body[topic_length:], qos), offset
+                if limit is not None:
+                    limit -= 1
+
+    @staticmethod
+    def _encode(topic, payload, qos):
+        topic = topic.encode()
+        fields = RECORD_HEADER.pack(0, len(topic), len(payload), qos)[4:] + topic + payload
+        return struct.pack("<I", zlib.crc32(fields)) + fields
+
+    def _write(self, path, data, mode):
+        with open(path, mode) as file:
+            file.write(data)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _rewrite(self, seq, data):
+        # Whole segments go through a temporary file: a crash leaves the old or the new one
+        temporary = self._path(seq) + ".tmp"
+        self._write(temporary, data, "wb")
+        os.replace(temporary, self._path(seq))
+
+    def _renumber(self, shift):
+        """Move every segment `shift` numbers up; the highest goes first, so an
+        interrupted renumbering still lists the segments in order"""
+        for seq in reversed(self.segments):
+            os.replace(self._path(seq), self._path(seq + shift))
+        self.segments = [seq + shift for seq in self.segments]
+        self._save_cursor()
+
+    def append(self, messages):
+        """Append (topic, payload, qos) records after everything already stored"""
+        data = b"".join(self._encode(*message) for message in messages)
+        if not self.segments or os.path.getsize(self._path(self.segments[-1])) >= self.segment_bytes:
+            self.segments.append(self.segments[-1] + 1 if self.segments else 0)
+        self._write(self._path(self.segments[-1]), data, "ab")
+        self.bytes += len(data)
+        self.records += len(messages)
+
+    def prepend(self, messages):
+        """Store records ahead of everything already stored (older messages spilled late)"""
+        if not messages:
+            return
+        data = b"".join(self._encode(*message) for message in messages)
+        if self.segments and self.head_offset:
+            # Drop the consumed prefix of the head segment so the new segment comes first
+            self._compact_head()
+        if self.segments and self.segments[0] == 0:
+            self._renumber(PREPEND_GAP)
+        seq = self.segments[0] - 1 if self.segments else 0
+        self._rewrite(seq, data)
+        self.segments.insert(0, seq)
+        self.head_offset = 0
+        self._save_cursor()
+        self.bytes += len(data)
+        self.records += len(messages)
+
+    def _compact_head(self):
+        seq = self.segments[0]
+        with open(self._path(seq), "rb") as file:
+            file.seek(self.head_offset)
+            rest = file.read()
+        # Cursor first: a crash before the rewrite re-sends the consumed prefix instead of
+        # applying the old offset to the shortened file
+        self.head_offset = 0
+        self._save_cursor()
+        self._rewrite(seq, rest)
+
+    def read(self, limit, after=None):
+        """Up to limit oldest records (or the ones following an earlier read's position
+        `after`) plus the position to commit() once they are delivered"""
+        if not self.segments:
+            return [], None
+        start, start_offset = (self.segments[0], self.head_offset) if after is None else (after[0], after[2])
+        for seq in self.segments:
+            if seq < start:
+                continue
+            offset = start_offset if seq == start else 0
+            batch = list(self._records(seq, offset, limit))
+            if batch:
+                return [record for record, _ in batch], (seq, offset, batch[-1][1], len(batch))
+        return [], None
+
+    def commit(self, position):
+        seq, _, end, count = position
+        # Skip fully consumed segments before this one
+        while self.segments and self.segments[0] != seq:
+            self._remove(self.segments[0])
+        self.head_offset = end
+        self.records -= count
+        if self.head_offset >= os.path.getsize(self._path(seq)) and seq != self.segments[-1]:
+            self._remove(seq)
+            self.head_offset = 0
+        elif self.records == 0:
+            # Empty: start over with fresh files
+            for remaining in list(self.segments):
+                self._remove(remaining)
+            self.head_offset = 0
+        self.bytes = sum(os.path.getsize(self._path(s)) for s in self.segments) - self.head_offset
+        self._save_cursor()
+
+
+class Outbox:
+    """Durable publish queue in front of a paho client.
+
+    The outbox owns connecting: it uses connect_async() with paho's
+    reconnect backoff and runs the network loop, so a broker that is down
+    at startup is retried instead of being fatal.
+    """
+
+    def __init__(self, client, directory, memory_capacity=10000, batch_size=100,
+                 max_rate=500.0, ack_timeout=10.0, max_spill_bytes=None,
+                 min_backoff=1, max_backoff=60, publisher=None):
+        self.client = client
+        self.publisher = publisher or Publisher(client)
+        self.log = SegmentLog(directory)
+        self.ring = deque()
+        self.memory_capacity = memory_capacity
+        self.batch_size = batch_size
+        self.max_rate = max_rate  # Messages per second while draining the on-disk backlog (None: no cap)
+        self.ack_timeout = ack_timeout
+        self.max_spill_bytes = max_spill_bytes
+        self.min_backoff, self.max_backoff = min_backoff, max_backoff
+        self.connected = False
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._drain, name="outbox-drain", daemon=True)
+        self.spilled = 0
+        self.drained = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.failed_batches = 0
+        self._rate_window = deque()  # (monotonic time, messages) of recent batches
+        # Drain thread only: batches sent but not yet acked, oldest first, as
+        # (infos, log position or None for the ring, messages, ack deadline)
+        self._inflight = deque()
+        self._inflight_count = 0
+        self._ring_sent = 0  # Ring messages (from the left) that are in flight
+        self._log_sent = None  # Log position of the newest in-flight backlog batch
+
+        client.reconnect_delay_set(min_backoff, max_backoff)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+
+    def start(self, host, port=1883, keepalive=60):
+        self.running = True
+        self.client.connect_async(host, port, keepalive)
+        self.client.loop_start()
+        self.thread.start()
+        return self
+
+    def _on_connect(self, client, userdata, flags, rc):
+        with self.condition:
+            self.connected = rc == 0
+            if self.connected:
+                self.reconnects += 1
+            self.condition.notify_all()
+
+    def _on_disconnect(self, client, userdata, rc):
+        with self.condition:
+            self.connected = False
+            self.condition.notify_all()
+
+    def publish(self, topic, payload, qos=1):
+        """Queue one message; never blocks on the network. Returns False if dropped."""
+        return not self.publish_many([(topic, payload)], qos)
+
+    def publish_many(self, messages, qos=1):
+        """Queue (topic, payload) messages together: one lock round and, while
+        offline, one disk append for all of them. Returns how many were dropped."""
+        records, dropped = [], 0
+        fast_path = self.publisher.is_fast_path if self.publisher.qos0_topics else None
+        for topic, payload in messages:
+            if isinstance(payload, str):
+                payload = payload.encode()
+            elif not isinstance(payload, bytes):
+                payload = str(payload).encode()  # Same text paho sends for numbers/bools
+            if fast_path is not None and fast_path(topic):
+                if self.connected:
+                    self.publisher.publish(topic, payload, 0)
+                else:
+                    self.dropped += 1
+                    dropped += 1
+                continue
+            records.append((topic, payload, qos))
+        if not records:
+            return dropped
+        with self.condition:
+            # Anything on disk is newer than the ring, so keep appending there
+            if (self.connected and not self.log.records
+                    and len(self.ring) + len(records) <= self.memory_capacity):
+                self.ring.extend(records)
+            elif self.max_spill_bytes is not None and self.log.bytes >= self.max_spill_bytes:
+                self.dropped += len(records)
+                return dropped + len(records)
+            else:
+                self.log.append(records)
+                self.spilled += len(records)
+            self.condition.notify_all()
+        return dropped
+
+    @property
+    def depth(self):
+        return len(self.ring) + self.log.records
+
+    def _next_batch(self, limit):
+        """(messages, position) of the oldest batch not yet sent; position is None for the ring.
+        The ring is always older than the log (new messages go to the log while it has any)."""
+        if self._ring_sent < len(self.ring):
+            end = min(self._ring_sent + limit, len(self.ring))
+            return [self.ring[i] for i in range(self._ring_sent, end)], None
+        return self.log.read(limit, self._log_sent)
+
+    def _drain(self):
+        next_backlog_at = time.monotonic()
+        while True:
+            with self.condition:
+                while self.running and not (self.connected and self.depth):
+                    if not self.connected:
+                        self._abandon()
+                        if self.ring:
+                            # Outage: make in-memory messages durable, keeping their order
+                            self.spilled += len(self.ring)
+                            self.log.prepend(list(self.ring))
+                            self.ring.clear()
+                    self.condition.wait(1.0)
+                if not self.running:
+                    return
+
+                self._commit_acked()
+                now = time.monotonic()
+                if self._inflight and now > self._inflight[0][3]:
+                    self.failed_batches += 1
+                    self._abandon()  # Still queued: sent again from the oldest unacked message
+                    continue
+                # Abandoned messages paho has not had acked yet still hold window slots
+                free = self.publisher.max_inflight - max(self._inflight_count, self.publisher.inflight)
+                backlog = self._ring_sent >= len(self.ring)
+                paced = backlog and self.max_rate and now < next_backlog_at
+                messages, position = self._next_batch(min(self.batch_size, free)) \
+                    if free > 0 and not paced else ([], None)
+                if not messages:
+                    # Wait for acks, new messages or the backlog's next turn
+                    timeout = ACK_POLL if self._inflight else 1.0
+                    if paced:
+                        timeout = min(timeout, next_backlog_at - now)
+                    self.condition.wait(timeout)
+                    continue
+                if position is None:
+                    self._ring_sent += len(messages)
+                else:
+                    self._log_sent = position
+
+            # Outside the lock: publish() may wait for a window slot, but only briefly. While
+            # paho still holds unacked messages from before an outage the window can stay
+            # full; the rest of the batch then stays queued (and on disk after close())
+            infos = []
+            for topic, payload, qos in messages:
+                info = self.publisher.publish(topic, payload, qos, window_timeout=WINDOW_WAIT)
+                infos.append(info)
+                if info is None or not self.running:
+                    break
+            with self.condition:
+                self._inflight.append((infos, position, len(messages), time.monotonic() + self.ack_timeout))
+                self._inflight_count += len(messages)
+                if len(infos) < len(messages) or any(info is None or info.rc for info in infos):
+                    self.failed_batches += 1
+                    self._abandon()  # Kept in the queue; resent once the link is back
+            if position is not None and self.max_rate:
+                next_backlog_at = max(next_backlog_at, time.monotonic() - 1.0) + len(messages) / self.max_rate
+
+    def _commit_acked(self):
+        """Remove fully acknowledged batches from the front of the queue (lock held)"""
+        delivered, position = 0, None
+        while self._inflight and all(info.is_published() for info in self._inflight[0][0]):
+            _, batch_position, count, _ = self._inflight.popleft()
+            self._inflight_count -= count
+            delivered += count
+            if batch_position is None:
+                for _ in range(count):
+                    self.ring.popleft()
+                self._ring_sent -= count
+            elif position is None:
+                position = batch_position
+            else:
+                # Consecutive backlog batches are committed (and the cursor saved) once
+                position = (batch_position[0], position[1], batch_position[2], position[3] + count)
+        if position is not None:
+            self.log.commit(position)
+            if self._log_sent is not None and self._log_sent[::2] == position[::2]:
+                self._log_sent = None  # Everything sent is committed: read from the head again
+        if delivered:
+            self.drained += delivered
+            self._rate_window.append((time.monotonic(), delivered))
+
+    def _abandon(self):
+        """Forget the in-flight batches; they are still queued and get sent again"""
+        self._inflight.clear()
+        self._inflight_count = 0
+        self._ring_sent = 0
+        self._log_sent = None
+
+    def drain_rate(self, window=5.0):
+        """Messages per second delivered over the last `window` seconds"""
+        horizon = time.monotonic() - window
+        with self.condition:
+            while self._rate_window and self._rate_window[0][0] < horizon:
+                self._rate_window.popleft()
+            return sum(count for _, count in self._rate_window) / window
+
+    def stats(self):
+        rate = self.drain_rate()
+        with self.condition:
+            return {
+                "connected": self.connected,
+                "depth": self.depth,
+                "memory_depth": len(self.ring),
+                "spill_records": self.log.records,
+                "spill_bytes": self.log.bytes,
+                "spilled": self.spilled,
+                "drained": self.drained,
+                "drain_rate": rate,
+                "dropped": self.dropped,
+                "reconnects": self.reconnects,
+                "failed_batches": self.failed_batches,
+                "publisher": self.publisher.stats(),
+            }
+
+    def close(self, timeout=10.0):
+        """Try to deliver the backlog for up to timeout seconds; keep the rest on disk"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.depth and self.connected and time.monotonic() < deadline:
+                self.condition.wait(0.1)
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        with self.condition:
+            if self.ring:
+                self.spilled += len(self.ring)
+                self.log.prepend(list(self.ring))
+                self.ring.clear()
+        self.client.disconnect()
+        self.client.loop_stop()
@@ -0,0 +1,126 @@
+"""
+Packed single-message payloads for one reading
+- "json":   one JSON object on v1/devices/<device>/telemetry
+- "binary": one fixed 18-byte little-endian record on v1/devices/<device>/packed
+  (a missing metric is stored as its field's sentinel, an unknown relay as a flag)
+Both carry a format version so the subscriber can reject what it cannot read.
+"per-topic" (the ThingsBoard/Rightech layout) stays the default everywhere.
+"""
+
+import json
+import struct
+
+from common.rules import MAX_STATUS_CODE
+from common.sensor_model import STATUS_CODES, to_epoch_ms
+
+PAYLOAD_FORMATS = ("per-topic", "json", "binary")
+CODEC_VERSION = 1
+
+JSON_TOPIC = "v1/devices/{device}/telemetry"
+BINARY_TOPIC = "v1/devices/{device}/packed"
+
+# version, flags, ts seconds, ts millis, pm25*10, pm10*10, co2, temperature*10, humidity*10
+RECORD = struct.Struct("<BBIHHHHhH")
+_RELAY = 0x01
+_STATUS_SHIFT = 1
+_STATUS_UNKNOWN = MAX_STATUS_CODE + 1  # Fills the 2-bit field
+_RELAY_UNKNOWN = 0x08
+_MISSING = 0xFFFF  # Unsigned metric fields
+_MISSING_SIGNED = 0x7FFF  # Temperature
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def _tenths(value, missing=_MISSING):
+    return missing if value is None else int(round(value * 10))
+
+
+def _from_tenths(value, missing=_MISSING):
+    return None if value == missing else value / 10
+
+
+# Same bytes json.dumps(..., separators=(",", ":")) gives for a complete reading,
+# without building a dict per message (str(float) is the JSON float text)
+_JSON_RECORD = ('{"v":%d,"ts":%s,"pm25":%s,"pm10":%s,"co2":%s,"temperature":%s,'
+                '"humidity":%s,"relay_state":%d,"status":"%s"}')
+
+
+def encode_json(reading):
+    values = (reading.ts, reading.pm25, reading.pm10, reading.co2, reading.temperature, reading.humidity)
+    if reading.status is not None and reading.relay is not None and None not in values:
+        return (_JSON_RECORD % ((CODEC_VERSION,) + values + (1 if reading.relay else 0, reading.status_name))).encode()
+    return json.dumps({
+        "v": CODEC_VERSION,
+        "ts": reading.ts,
+        "pm25": reading.pm25,
+        "pm10": reading.pm10,
+        "co2": reading.co2,
+        "temperature": reading.temperature,
+        "humidity": reading.humidity,
+        "relay_state": None if reading.relay is None else (1 if reading.relay else 0),
+        "status": reading.status_name,
+    }, separators=(",", ":")).encode()
+
+
+def encode_binary(reading):
+    ts = reading.ts
+    status = _STATUS_UNKNOWN if reading.status is None else reading.status
+    relay = _RELAY_UNKNOWN if reading.relay is None else (_RELAY if reading.relay else 0)
+    flags = relay | (status << _STATUS_SHIFT)
+    return RECORD.pack(CODEC_VERSION, flags, ts // 1000, ts % 1000,
+                       _tenths(reading.pm25), _tenths(reading.pm10),
+                       _MISSING if reading.co2 is None else int(reading.co2),
+                       _tenths(reading.temperature, _MISSING_SIGNED), _tenths(reading.humidity))
+
+
+def decode_json(payload):
+    """JSON reading -> (ts_ms, pm25, pm10, co2, temperature, humidity, relay, status_code)"""
+    try:
+        data = json.loads(payload)
+        version = data.get("v", CODEC_VERSION)
+        relay = data.get("relay_state")
+        decoded = (
+            to_epoch_ms(data["ts"]),
+            data.get("pm25"),
+            data.get("pm10"),
+            data.get("co2"),
+            data.get("temperature"),
+            data.get("humidity"),
+            None if relay is None else int(relay),
+            STATUS_CODES.get(data.get("status")),
+        )
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise PayloadError(f"Malformed JSON payload: {e}") from e
+    if version != CODEC_VERSION:
+        raise PayloadError(f"Unsupported JSON payload version {version}")
+    return decoded
+
+
+def decode_binary(payload):
+    """Binary record -> (ts_ms, pm25, pm10, co2, temperature, humidity, relay, status_code)"""
+    if len(payload) != RECORD.size or payload[0] != CODEC_VERSION:
+        raise PayloadError(f"Unsupported binary payload ({len(payload)} bytes, "
+                           f"version {payload[0] if payload else None})")
+    _, flags, seconds, millis, pm25, pm10, co2, temperature, humidity = RECORD.unpack(payload)
+    status = (flags >> _STATUS_SHIFT) & 0x03
+    return (
+        seconds * 1000 + millis,
+        _from_tenths(pm25),
+        _from_tenths(pm10),
+        None if co2 == _MISSING else co2,
+        _from_tenths(temperature, _MISSING_SIGNED),
+        _from_tenths(humidity),
+        None if flags & _RELAY_UNKNOWN else flags & _RELAY,
+        None if status == _STATUS_UNKNOWN else status,
+    )
+
+
+def packed_messages(reading, device="me", payload_format="json"):
+    """(topic, payload) list with a single message for one Reading"""
+    if payload_format == "json":
+        return [(JSON_TOPIC.format(device=device), encode_json(reading))]
+    if payload_format == "binary":
+        return [(BINARY_TOPIC.format(device=device), encode_binary(reading))]
+    raise ValueError(f"Unknown packed payload format: {payload_format}")
@@ -0,0 +1,118 @@
+"""
+Non-blocking publish pipeline over a paho client
+The network loop runs on paho's background thread (loop_start), so publish()
+only queues; PUBACKs are processed as they arrive. A bounded in-flight
+window keeps unacknowledged QoS 1 messages from piling up, every message's
+publish -> ack latency goes into a histogram, and topics matching the
+configured filters take a QoS 0 fast path.
+"""
+
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from common.histogram import Histogram
+
+
+class Publisher:
+    def __init__(self, client, max_inflight=100, qos0_topics=(), window_timeout=None):
+        self.client = client
+        self.max_inflight = max_inflight
+        self.qos0_topics = tuple(qos0_topics)  # Topic filters (+/# wildcards) sent at QoS 0
+        self.window_timeout = window_timeout  # Seconds to wait for a window slot; None = block
+        self._window = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._sent = {}  # mid -> (perf_counter at publish, qos)
+        self._early = {}  # mid -> perf_counter of an ack that beat publish() returning
+        self._fast_path = {}  # topic -> bool, cached filter matches
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self.ack_latency = Histogram()  # QoS 1: publish() -> PUBACK
+        self.write_latency = Histogram()  # QoS 0: publish() -> written to the socket
+        self.call_latency = Histogram()  # Time spent inside publish() itself
+
+        # paho's own window: messages beyond it wait in paho's queue, not on the wire
+        client.max_inflight_messages_set(max_inflight)
+        client.on_publish = self._on_publish
+
+    def start(self):
+        """Start paho's network thread (when the caller does not run the loop itself)"""
+        self.client.loop_start()
+        return self
+
+    def is_fast_path(self, topic):
+        fast = self._fast_path.get(topic)
+        if fast is None:
+            fast = self._fast_path[topic] = any(
+                mqtt.topic_matches_sub(topic_filter, topic) for topic_filter in self.qos0_topics)
+        return fast
+
+    def publish(self, topic, payload, qos=1, window_timeout=None):
+        """Queue one message; returns paho's MQTTMessageInfo, or None if no window slot freed up.
+        window_timeout overrides the publisher's own for this call."""
+        if qos and self.qos0_topics and self.is_fast_path(topic):
+            qos = 0
+        if window_timeout is None:
+            window_timeout = self.window_timeout
+        if qos and not self._window.acquire(timeout=window_timeout):
+            self.rejected += 1
+            return None
+        started = time.perf_counter()
+        info = self.client.publish(topic, payload, qos)
+        now = time.perf_counter()
+        self.call_latency.record(now - started)
+        # Offline QoS 1 messages stay in paho's queue and are sent on reconnect; QoS 0 ones are gone
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and not (qos and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            if qos:
+                self._window.release()
+            self.rejected += 1
+            return info
+        self.published += 1
+        with self._lock:
+            acked_at = self._early.pop(info.mid, None)
+            if acked_at is None:
+                self._sent[info.mid] = (started, qos)
+        if acked_at is not None:
+            self._completed(started, acked_at, qos)
+        return info
+
+    def _on_publish(self, client, userdata, mid):
+        acked_at = time.perf_counter()
+        with self._lock:
+            sent = self._sent.pop(mid, None)
+            if sent is None:
+                self._early[mid] = acked_at
+                return
+        self._completed(sent[0], acked_at, sent[1])
+
+    def _completed(self, started, acked_at, qos):
+        if qos:
+            self.acked += 1
+            self.ack_latency.record(acked_at - started)
+            self._window.release()
+        else:
+            self.write_latency.record(acked_at - started)
+
+    @property
+    def inflight(self):
+        return len(self._sent)
+
+    def wait_idle(self, timeout=10.0):
+        """Wait until every queued message has been acknowledged/written"""
+        deadline = time.monotonic() + timeout
+        while self._sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._sent
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "acked": self.acked,
+            "inflight": self.inflight,
+            "rejected": self.rejected,
+            "ack_latency_ms": self.ack_latency.summary(scale=1000),
+            "qos0_write_latency_ms": self.write_latency.summary(scale=1000),
+            "publish_call_ms": self.call_latency.summary(scale=1000),
+        }
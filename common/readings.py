@@ -0,0 +1,193 @@
+"""
+Compact reading types shared by the generators, codecs and subscriber
+- Reading: one reading in __slots__ (epoch-ms ts, numbers, status code).
+  Dict-style access (reading["pm25"], reading["status"], reading["datetime"])
+  keeps display code unchanged; strings are only built when asked for.
+- ReadingBatch: many readings as typed array columns, about 60 bytes a
+  reading, for holding long stretches of history or shipping chunks
+  between processes.
+"""
+
+import math
+from array import array
+from datetime import datetime
+
+from common.rules import RULE_SETS
+
+FIELDS = ("device_id", "ts", "pm25", "pm10", "co2", "temperature", "humidity", "relay", "status")
+METRIC_FIELDS = ("pm25", "pm10", "co2", "temperature", "humidity")
+DEFAULT_NAMES = RULE_SETS["thingsboard"].names  # Status code -> name (Rightech readings carry their own)
+
+
+class Reading:
+    __slots__ = FIELDS + ("names",)
+
+    def __init__(self, device_id, ts, pm25, pm10, co2, temperature, humidity, relay, status,
+                 names=DEFAULT_NAMES):
+        self.device_id = device_id
+        self.ts = ts  # Epoch milliseconds
+        self.pm25 = pm25
+        self.pm10 = pm10
+        self.co2 = co2
+        self.temperature = temperature
+        self.humidity = humidity
+        self.relay = relay  # 0/1, None if unknown
+        self.status = status  # Status code, None if unknown
+        self.names = names  # Shared tuple of the rule set's status names
+
+    @classmethod
+    def from_row(cls, row, names=DEFAULT_NAMES):
+        """From a typed store row (device, ts, pm25, pm10, co2, temperature, humidity, relay, status)"""
+        return cls(*row, names=names)
+
+    @classmethod
+    def from_decoded(cls, device_id, decoded, names=DEFAULT_NAMES):
+        """From a payload_codec decode_json()/decode_binary() tuple"""
+        return cls(device_id, *decoded, names=names)
+
+    def as_row(self):
+        return (self.device_id, self.ts, self.pm25, self.pm10, self.co2, self.temperature,
+                self.humidity, self.relay, self.status)
+
+    # Values in the layout of the old reading dicts, computed on access
+
+    @property
+    def timestamp(self):
+        """Epoch seconds"""
+        return self.ts // 1000
+
+    @property
+    def relay_state(self):
+        return None if self.relay is None else bool(self.relay)
+
+    @property
+    def status_name(self):
+        return None if self.status is None else self.names[self.status]
+
+    @property
+    def datetime(self):
+        return datetime.fromtimestamp(self.ts / 1000).isoformat()
+
+    def __getitem__(self, key):
+        getter = _KEYS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self)
+
+    def get(self, key, default=None):
+        getter = _KEYS.get(key)
+        return default if getter is None else getter(self)
+
+    def to_dict(self):
+        """The old 10-key reading dict (for JSON output and display)"""
+        return {key: getter(self) for key, getter in _KEYS.items() if key != "online"}
+
+    def __eq__(self, other):
+        if not isinstance(other, Reading):
+            return NotImplemented
+        return self.as_row() == other.as_row()
+
+    def __repr__(self):
+        return (f"Reading({self.device_id!r}, ts={self.ts}, pm25={self.pm25}, pm10={self.pm10}, "
+                f"co2={self.co2}, temperature={self.temperature}, humidity={self.humidity}, "
+                f"relay={self.relay}, status={self.status_name})")
+
+
+_KEYS = {
+    "device_id": lambda reading: reading.device_id,
+    "timestamp": lambda reading: reading.timestamp,
+    "datetime": lambda reading: reading.datetime,
+    "pm25": lambda reading: reading.pm25,
+    "pm10": lambda reading: reading.pm10,
+    "co2": lambda reading: reading.co2,
+    "temperature": lambda reading: reading.temperature,
+    "humidity": lambda reading: reading.humidity,
+    "relay_state": lambda reading: reading.relay_state,
+    "status": lambda reading: reading.status_name,
+    "online": lambda reading: True,  # Only online devices produce readings
+}
+
+
+class ReadingBatch:
+    """Readings as parallel typed arrays.
+
+    Devices are interned (the device column holds indexes into .devices);
+    missing metrics are stored as NaN and a missing relay/status as -1,
+    and come back as None from rows() and indexing.
+    """
+
+    __slots__ = ("names", "devices", "_device_index", "device", "ts") + METRIC_FIELDS + ("relay", "status")
+
+    def __init__(self, names=DEFAULT_NAMES):
+        self.names = names
+        self.devices = []
+        self._device_index = {}
+        self.device = array("I")
+        self.ts = array("q")
+        for field in METRIC_FIELDS:
+            setattr(self, field, array("d"))
+        self.relay = array("b")
+        self.status = array("b")
+
+    def __len__(self):
+        return len(self.ts)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns (device names not included)"""
+        return sum(column.itemsize * len(column) for column in
+                   (self.device, self.ts, self.pm25, self.pm10, self.co2, self.temperature,
+                    self.humidity, self.relay, self.status))
+
+    def append_row(self, row):
+        """Add one typed row (device, ts, pm25, pm10, co2, temperature, humidity, relay, status)"""
+        device, ts, pm25, pm10, co2, temperature, humidity, relay, status = row
+        index = self._device_index.get(device)
+        if index is None:
+            index = self._device_index[device] = len(self.devices)
+            self.devices.append(device)
+        nan = math.nan
+        self.device.append(index)
+        self.ts.append(ts)
+        self.pm25.append(nan if pm25 is None else pm25)
+        self.pm10.append(nan if pm10 is None else pm10)
+        self.co2.append(nan if co2 is None else co2)
+        self.temperature.append(nan if temperature is None else temperature)
+        self.humidity.append(nan if humidity is None else humidity)
+        self.relay.append(-1 if relay is None else relay)
+        self.status.append(-1 if status is None else status)
+
+    def append(self, reading):
+        self.append_row(reading.as_row())
+
+    def extend_rows(self, rows):
+        for row in rows:
+            self.append_row(row)
+
+    def row(self, i):
+        co2 = self.co2[i]
+        relay, status = self.relay[i], self.status[i]
+        return (self.devices[self.device[i]], self.ts[i], _none_if_nan(self.pm25[i]),
+                _none_if_nan(self.pm10[i]), None if co2 != co2 else (int(co2) if co2.is_integer() else co2),
+                _none_if_nan(self.temperature[i]), _none_if_nan(self.humidity[i]),
+                None if relay < 0 else relay, None if status < 0 else status)
+
+    def rows(self):
+        """Typed rows for the stores, built one at a time"""
+        for i in range(len(self.ts)):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+        return Reading.from_row(self.row(i), self.names)
+
+    def __iter__(self):
+        for i in range(len(self.ts)):
+            yield self[i]
+
+    def clear(self):
+        for name in ("device", "ts") + METRIC_FIELDS + ("relay", "status"):
+            setattr(self, name, array(getattr(self, name).typecode))
+
+
+def _none_if_nan(value):
+    return None if value != value else value
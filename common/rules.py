@@ -0,0 +1,206 @@
+"""
+Shared threshold rules for status, relay and alerts
+Rule sets are loaded from alert_rules.json (one per deployment profile) and
+compiled once into Python functions: classify() for one reading and
+classify_batch() for numpy columns (optional dependency). Windowed rules
+(mean over a time window, N consecutive samples) keep per-device state that
+is updated in O(1) amortized per reading.
+"""
+
+import json
+import operator
+import os
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # Only classify_batch() needs numpy
+    np = None
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alert_rules.json")
+RULE_METRICS = ("pm25", "pm10", "co2", "temperature", "humidity")  # Argument order of classify()
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+# Highest status code: payload_codec's binary record has a 2-bit status field and 3 means unknown
+MAX_STATUS_CODE = 2
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _condition_source(condition, vector):
+    metric, op, value = condition
+    if metric not in RULE_METRICS:
+        raise RuleError(f"Unknown metric in rule: {metric}")
+    if op not in OPERATORS:
+        raise RuleError(f"Unknown operator in rule: {op}")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RuleError(f"Threshold must be a number: {value!r}")
+    source = f"{metric} {op} {value!r}"
+    return f"({source})" if vector else source
+
+
+def _compile(name, source):
+    namespace = {"np": np}
+    exec(compile(source, f"<rules:{name}>", "exec"), namespace)
+    return namespace[name]
+
+
+class RuleSet:
+    """Status levels of one profile, compiled to classify(pm25, pm10, co2, temperature, humidity).
+
+    Levels are listed most severe first; status codes are 0 for "ok" and
+    count up with severity (OK/GOOD=0, WARNING=1, DANGER=2), matching
+    sensor_model.STATUS_CODES. The relay is on at the relay level and above.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        levels = config["levels"]
+        if not levels or len(levels) > MAX_STATUS_CODE:
+            raise RuleError(f"{name}: needs 1 to {MAX_STATUS_CODE} levels, got {len(levels)}")
+        self.names = {0: config.get("ok", "OK")}
+        self.codes = {self.names[0]: 0}
+        scalar_branches, vector_conditions, vector_codes = [], [], []
+        for index, level in enumerate(levels):
+            code = len(levels) - index
+            self.names[code] = level["status"]
+            self.codes[level["status"]] = code
+            if not level["any"]:
+                raise RuleError(f"{name}: level {level['status']} has no conditions")
+            scalar_branches.append(
+                f"    if {' or '.join(_condition_source(c, False) for c in level['any'])}:\n"
+                f"        return {code}\n")
+            vector_conditions.append(" | ".join(_condition_source(c, True) for c in level["any"]))
+            vector_codes.append(str(code))
+        self.relay_code = self.codes[config.get("relay", levels[0]["status"])]
+        self.windows = [compile_window(window) for window in config.get("windows", [])]
+
+        arguments = ", ".join(RULE_METRICS)
+        self.source = f"def classify({arguments}):\n{''.join(scalar_branches)}    return 0\n"
+        self.classify = _compile("classify", self.source)
+        self._classify_batch = _compile("classify_batch", (
+            f"def classify_batch({arguments}):\n"
+            f"    return np.select([{', '.join(vector_conditions)}], [{', '.join(vector_codes)}], 0)\n"))
+
+    def status(self, data):
+        """(status name, relay on) for a reading dict"""
+        code = self.classify(*(data[metric] for metric in RULE_METRICS))
+        return self.names[code], code >= self.relay_code
+
+    def classify_batch(self, columns):
+        """Status codes for numpy arrays keyed by metric name (same shape each)"""
+        if np is None:
+            raise RuntimeError("classify_batch() requires numpy")
+        return self._classify_batch(*(columns[metric] for metric in RULE_METRICS))
+
+    def alert_engine(self):
+        return AlertEngine(self.windows)
+
+
+class MeanWindowRule:
+    """Mean of a metric over the last window_ms compared with a threshold"""
+
+    def __init__(self, name, metric, window_ms, op, value):
+        self.name, self.index = name, RULE_METRICS.index(metric)
+        if isinstance(window_ms, bool) or not isinstance(window_ms, (int, float)) or not window_ms >= 1:
+            raise RuleError(f"{name}: mean_ms must be a number of at least 1: {window_ms!r}")
+        self.window_ms = int(window_ms)
+        self.test, self.threshold = OPERATORS[op], value
+
+    def new_state(self):
+        return [deque(), 0.0]  # (ts, value) samples in the window, their running sum
+
+    def update(self, state, ts, value):
+        samples = state[0]
+        samples.append((ts, value))
+        total = state[1] + value
+        horizon = ts - self.window_ms
+        while samples[0][0] <= horizon:
+            total -= samples.popleft()[1]
+        state[1] = total
+        mean = total / len(samples)
+        return self.test(mean, self.threshold), mean
+
+
+class ConsecutiveRule:
+    """Threshold that must hold for `count` samples in a row"""
+
+    def __init__(self, name, metric, count, op, value):
+        self.name, self.index = name, RULE_METRICS.index(metric)
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise RuleError(f"{name}: consecutive must be a positive integer: {count!r}")
+        self.count = count
+        self.test, self.threshold = OPERATORS[op], value
+
+    def new_state(self):
+        return [0]
+
+    def update(self, state, ts, value):
+        run = state[0] + 1 if self.test(value, self.threshold) else 0
+        state[0] = run
+        return run >= self.count, value
+
+
+def compile_window(config):
+    try:
+        if config["metric"] not in RULE_METRICS or config["op"] not in OPERATORS:
+            raise RuleError(f"Invalid windowed rule: {config}")
+        _condition_source((config["metric"], config["op"], config["value"]), False)  # Checks the threshold
+        if "mean_ms" in config:
+            return MeanWindowRule(config["name"], config["metric"], config["mean_ms"],
+                                  config["op"], config["value"])
+        if "consecutive" in config:
+            return ConsecutiveRule(config["name"], config["metric"], config["consecutive"],
+                                   config["op"], config["value"])
+    except KeyError as e:
+        raise RuleError(f"Windowed rule is missing {e}: {config}") from None
+    raise RuleError(f"Windowed rule needs mean_ms or consecutive: {config}")
+
+
+class AlertEngine:
+    """Per-device state for windowed rules; reports raise/clear transitions only"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.devices = {}  # device -> [rule state, ..., active flags]
+        self.updates = 0
+        self.raised = 0
+
+    def update(self, device, ts, values):
+        """Feed one reading; values are in RULE_METRICS order (None = missing).
+
+        Returns a list of (device, rule name, raised, value, ts) for rules
+        whose state changed, usually empty.
+        """
+        states = self.devices.get(device)
+        if states is None:
+            states = self.devices[device] = [[rule.new_state() for rule in self.rules],
+                                             [False] * len(self.rules)]
+        self.updates += 1
+        transitions = []
+        rule_states, active = states
+        for i, rule in enumerate(self.rules):
+            value = values[rule.index]
+            if value is None:
+                continue
+            firing, observed = rule.update(rule_states[i], ts, value)
+            if firing != active[i]:
+                active[i] = firing
+                self.raised += firing
+                transitions.append((device, rule.name, firing, observed, ts))
+        return transitions
+
+    def active(self):
+        """{device: [active rule names]} for devices with at least one active alert"""
+        return {device: [rule.name for rule, on in zip(self.rules, flags) if on]
+                for device, (_, flags) in self.devices.items() if any(flags)}
+
+
+def load_rule_sets(path=RULES_PATH):
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+    return {name: RuleSet(name, rule_set) for name, rule_set in config.items()}
+
+
+RULE_SETS = load_rule_sets()
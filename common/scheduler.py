@@ -0,0 +1,178 @@
+"""
+Deadline scheduler for periodic sampling loops
+Every task fires on a fixed grid of the monotonic clock (anchor + k * period),
+so the time spent reading, printing and publishing never pushes later
+readings back, and periods down to ~10 ms hold. Tasks live in one heap,
+so a single thread can drive many devices.
+
+Simulated sensor latency delays a tick without moving the grid: tick k
+runs at grid[k] + latency(), tick k+1 is still due at grid[k+1] + latency().
+A tick that finishes after the next grid point counts as an overrun; grid
+points missed entirely are skipped (and counted) instead of bursting.
+How late each tick started ("lateness", the jitter) and how long callbacks
+ran are kept in fixed-bucket histograms for p50/p99/p999.
+
+    scheduler = Scheduler()
+    scheduler.every(0.01, sample, count=1000, latency=random_latency(0.001, 0.004, 0.01))
+    scheduler.run(duration=60)
+    print(scheduler.stats())
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from common.histogram import Histogram, log_buckets
+
+TIMING_BUCKETS = log_buckets(0.000001, 60.0)  # 1 µs .. 60 s
+
+
+def random_latency(low, high, period, share=0.8):
+    """Callable drawing a simulated sensor delay from [low, high] seconds,
+    scaled down when needed so it stays under `share` of the period"""
+    scale = min(1.0, share * period / high)
+    low, high = low * scale, high * scale
+    return lambda: random.uniform(low, high)
+
+
+class Tick:
+    """What a task callback gets: which grid point fired and how late"""
+
+    __slots__ = ("task", "index", "deadline", "latency", "late", "last")
+
+    def __init__(self, task, index, deadline, latency, late, last):
+        self.task = task
+        self.index = index  # Grid point number, 0-based (skipped points included)
+        self.deadline = deadline  # Grid time (monotonic seconds)
+        self.latency = latency  # Simulated delay applied after the grid point
+        self.late = late  # Seconds between the intended start and the actual one
+        self.last = last  # No further tick will run (count or run duration reached)
+
+    def wall_time(self):
+        """Epoch seconds of this grid point (a timestamp that never repeats between ticks)"""
+        return self.task.wall_anchor + self.index * self.task.period
+
+    def until_next(self):
+        """Seconds from now until the next grid point"""
+        return self.deadline + self.task.period - self.task.scheduler.clock()
+
+
+class Task:
+    def __init__(self, scheduler, period, callback, anchor, count=None, latency=None, name=None):
+        self.scheduler = scheduler
+        self.period = period
+        self.callback = callback
+        self.anchor = anchor  # Monotonic time of grid point 0
+        self.wall_anchor = time.time() + anchor - scheduler.clock()  # Same point in epoch seconds
+        self.count = count  # Ticks to run, None for no limit
+        self.latency = latency
+        self.name = name or getattr(callback, "__name__", "task")
+        self.index = 0
+        self.ticks = 0
+        self.missed = 0
+        self.overruns = 0
+        self.lateness = Histogram(TIMING_BUCKETS)
+        self.busy = Histogram(TIMING_BUCKETS)
+        self.done = False
+
+    def deadline(self, index):
+        return self.anchor + index * self.period
+
+    def cancel(self):
+        self.done = True
+
+    def stats(self):
+        return {"ticks": self.ticks, "missed": self.missed, "overruns": self.overruns,
+                "lateness_ms": self.lateness.summary(1000), "busy_ms": self.busy.summary(1000)}
+
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic, spin=0.0):
+        self.clock = clock
+        self.spin = spin  # Busy-wait this many seconds before a deadline (for coarse OS timers)
+        self.tasks = []
+        self._heap = []  # (due, seq, task, latency)
+        self._seq = itertools.count()
+        self._stop = threading.Event()
+        self._end = None
+
+    def every(self, period, callback, count=None, latency=None, offset=0.0, name=None):
+        """Run callback(tick) every `period` seconds, starting `offset` seconds from now"""
+        if period <= 0:
+            raise ValueError("period must be positive")
+        task = Task(self, period, callback, self.clock() + offset, count, latency, name)
+        self.tasks.append(task)
+        self._push(task)
+        return task
+
+    def _push(self, task, latency=None):
+        if latency is None:
+            latency = task.latency() if task.latency else 0.0
+        heapq.heappush(self._heap, (task.deadline(task.index) + latency, next(self._seq), task, latency))
+
+    def stop(self):
+        """Make run() return before the next tick (safe from other threads and signal handlers)"""
+        self._stop.set()
+
+    def run(self, duration=None):
+        """Run ticks until every task is done, `duration` seconds have passed, or stop()"""
+        self._stop.clear()
+        self._end = None if duration is None else self.clock() + duration
+        heap = self._heap
+        while heap and not self._stop.is_set():
+            due, _, task, latency = heap[0]
+            if self._end is not None and due >= self._end:
+                break
+            self._wait(due)
+            if self._stop.is_set():
+                break
+            heapq.heappop(heap)
+            if task.done:
+                continue
+
+            started = self.clock()
+            late = max(started - due, 0.0)
+            task.lateness.record(late)
+            task.ticks += 1
+            last = task.count is not None and task.ticks >= task.count
+            next_deadline = task.deadline(task.index + 1)
+            if self._end is not None and next_deadline >= self._end:
+                last = True
+            task.callback(Tick(task, task.index, task.deadline(task.index), latency, late, last))
+            finished = self.clock()
+            task.busy.record(finished - started)
+
+            if last or task.done:
+                task.done = True
+                continue
+            task.index += 1
+            latency = task.latency() if task.latency else 0.0
+            if finished > next_deadline + latency:
+                task.overruns += 1
+                # Grid points a whole period behind are dropped; the latest one runs now
+                skipped = int((finished - next_deadline - latency) // task.period)
+                task.index += skipped
+                task.missed += skipped
+            self._push(task, latency)
+
+    def _wait(self, due):
+        remaining = due - self.clock() - self.spin
+        if remaining > 0:
+            self._stop.wait(remaining)
+        if self.spin:
+            while self.clock() < due and not self._stop.is_set():
+                pass
+
+    def stats(self):
+        """Per-task stats plus totals; lateness/busy percentiles in ms"""
+        lateness, busy = Histogram(TIMING_BUCKETS), Histogram(TIMING_BUCKETS)
+        for task in self.tasks:
+            lateness.merge(task.lateness)
+            busy.merge(task.busy)
+        return {"ticks": sum(task.ticks for task in self.tasks),
+                "missed": sum(task.missed for task in self.tasks),
+                "overruns": sum(task.overruns for task in self.tasks),
+                "lateness_ms": lateness.summary(1000), "busy_ms": busy.summary(1000),
+                "tasks": {task.name: task.stats() for task in self.tasks}}
@@ -0,0 +1,87 @@
+"""
+Vectorized batch version of the sensor model (requires numpy)
+Generates N devices x T timesteps of readings as columnar arrays with the
+same distributions, clamping ranges and relay/status rules as
+sensor_model.generate_sensor_data ("mqtt") and generate_rightech_data ("rightech")
+"""
+
+import time
+
+import numpy as np
+
+from common.rules import RULE_SETS
+
+COLUMNS = ("device", "ts", "pm25", "pm10", "co2", "temperature", "humidity", "relay", "status")
+ROWS_PER_CHUNK = 1_000_000
+
+def _mqtt_metrics(rng, shape):
+    pm25 = np.clip(25 + rng.uniform(-2, 2, shape) + rng.uniform(-5, 5, shape), 5, 100)
+    pm10 = pm25 + rng.uniform(10, 20, shape)
+    co2_base = np.where(rng.random(shape) > 0.7, 450.0, 800.0)
+    co2 = np.clip(co2_base + rng.uniform(-50, 100, shape), 400, 2000)
+    temperature = np.clip(22 + rng.uniform(-2, 2, shape), 18, 28)
+    humidity = np.clip(50 + rng.uniform(-10, 10, shape), 30, 70)
+
+    return pm25, pm10, co2, temperature, humidity
+
+
+def _rightech_metrics(rng, shape):
+    pm25 = np.clip(rng.normal(25, 10, shape), 5, 100)
+    pm10 = np.maximum(10, pm25 + rng.uniform(5, 25, shape))
+    co2 = np.clip(rng.normal(600, 150, shape), 400, 2000)
+    temperature = np.clip(rng.normal(24, 3, shape), 18, 32)
+    humidity = np.clip(rng.normal(50, 10, shape), 30, 80)
+
+    return pm25, pm10, co2, temperature, humidity
+
+
+# profile -> (metric generator, status/relay rule set)
+PROFILES = {"mqtt": (_mqtt_metrics, RULE_SETS["thingsboard"]),
+            "rightech": (_rightech_metrics, RULE_SETS["rightech"])}
+
+
+def generate_batch(n_devices, n_steps, start_ts, step=60, profile="mqtt", rng=None, first_device=0):
+    """Readings for n_devices x n_steps as a dict of (n_devices, n_steps) arrays.
+
+    ts is epoch milliseconds; device is the 0-based device index (offset by
+    first_device). Metrics are rounded the same way as the scalar generators
+    (0.1 for floats, truncated ppm for CO2); status uses STATUS_CODES.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    shape = (n_devices, n_steps)
+    metrics, rules = PROFILES[profile]
+    pm25, pm10, co2, temperature, humidity = metrics(rng, shape)
+    status = rules.classify_batch({"pm25": pm25, "pm10": pm10, "co2": co2,
+                                   "temperature": temperature, "humidity": humidity})
+    relay = status >= rules.relay_code
+
+    ts = (int(start_ts) + np.arange(n_steps, dtype=np.int64) * int(step)) * 1000
+    device = np.arange(first_device, first_device + n_devices, dtype=np.int32)
+    return {
+        "device": np.broadcast_to(device[:, None], shape),
+        "ts": np.broadcast_to(ts[None, :], shape),
+        "pm25": np.round(pm25, 1).astype(np.float32),
+        "pm10": np.round(pm10, 1).astype(np.float32),
+        "co2": co2.astype(np.int16),
+        "temperature": np.round(temperature, 1).astype(np.float32),
+        "humidity": np.round(humidity, 1).astype(np.float32),
+        "relay": relay.astype(np.uint8),
+        "status": status.astype(np.uint8),
+    }
+
+
+def iter_batches(n_devices, n_steps, start_ts=None, step=60, profile="mqtt", seed=None,
+                 rows_per_chunk=ROWS_PER_CHUNK):
+    """Yield generate_batch() chunks covering consecutive time windows.
+
+    Memory stays bounded by rows_per_chunk. The same seed and chunk size
+    always reproduce the same data. start_ts defaults to a window ending now.
+    """
+    if start_ts is None:
+        start_ts = (int(time.time()) // step - n_steps) * step
+    rng = np.random.default_rng(seed)
+    steps_per_chunk = max(1, rows_per_chunk // max(1, n_devices))
+    for first_step in range(0, n_steps, steps_per_chunk):
+        chunk_steps = min(steps_per_chunk, n_steps - first_step)
+        yield generate_batch(n_devices, chunk_steps, start_ts + first_step * step,
+                             step=step, profile=profile, rng=rng)
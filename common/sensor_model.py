@@ -0,0 +1,132 @@
+"""
+Shared sensor model for the air quality emulators
+One place for the random reading generators and the per-topic MQTT layouts,
+so the single-device emulators and the fleet runner publish identical data.
+Generators return common.readings.Reading objects.
+"""
+
+import json
+import random
+import time
+
+from common.readings import Reading
+from common.rules import RULE_SETS
+
+TELEMETRY_TOPIC = "v1/devices/{device}/telemetry/{metric}"
+ATTRIBUTES_TOPIC = "v1/devices/{device}/attributes"
+RIGHTECH_TOPIC_BASE = "base/state"
+
+# Status is stored/encoded as a small integer; Rightech's GOOD is the same level as OK
+STATUS_CODES = {"OK": 0, "GOOD": 0, "WARNING": 1, "DANGER": 2}
+STATUS_NAMES = {0: "OK", 1: "WARNING", 2: "DANGER"}
+
+TELEMETRY_METRICS = ("pm25", "pm10", "co2", "temperature", "humidity", "relay_state")
+RIGHTECH_METRICS = TELEMETRY_METRICS + ("status", "online")
+
+# Status/relay thresholds of each variant (see common/alert_rules.json)
+THINGSBOARD_RULES = RULE_SETS["thingsboard"]
+RIGHTECH_RULES = RULE_SETS["rightech"]
+
+
+def to_epoch_ms(timestamp):
+    """Normalize an emulator timestamp (seconds or milliseconds) to milliseconds"""
+    timestamp = int(timestamp)
+    return timestamp * 1000 if timestamp < 100_000_000_000 else timestamp
+
+
+def grid_timestamp(wall_time, period):
+    """Epoch ms for a reading scheduled at `wall_time` (epoch seconds): whole seconds like
+    the device clock, milliseconds when readings come faster than one per second"""
+    return int(wall_time * 1000) if period < 1 else int(wall_time) * 1000
+
+
+def generate_sensor_data(device_id, rng=random, ts=None):
+    """ESP32 + SDS011/MH-Z19B/DHT22 reading as published to ThingsBoard (mqtt/),
+    stamped `ts` (epoch ms) or the current whole second"""
+    # PM2.5: 5-100 (random with trend), PM10 10-20 higher
+    pm25_trend = rng.uniform(-2, 2)
+    pm25 = max(5, min(100, 25 + pm25_trend + rng.uniform(-5, 5)))
+    pm10 = pm25 + rng.uniform(10, 20)
+    # CO2: 400-2000 ppm (increases with "more people")
+    co2_base = 450 if rng.random() > 0.7 else 800
+    co2 = max(400, min(2000, co2_base + rng.uniform(-50, 100)))
+    # Temperature: 18-28°C, Humidity: 30-70%
+    temperature = max(18, min(28, 22 + rng.uniform(-2, 2)))
+    humidity = max(30, min(70, 50 + rng.uniform(-10, 10)))
+    status = THINGSBOARD_RULES.classify(pm25, pm10, co2, temperature, humidity)
+    relay = 1 if status >= THINGSBOARD_RULES.relay_code else 0
+
+    # Whole seconds, like the device clock
+    if ts is None:
+        ts = int(time.time()) * 1000
+    return Reading(device_id, ts, round(pm25, 1), round(pm10, 1), int(co2),
+                   round(temperature, 1), round(humidity, 1), relay, status, THINGSBOARD_RULES.names)
+
+
+def generate_rightech_data(rng=random, ts=None):
+    """Reading with the Rightech IoT Cloud variant's distributions (rightech/),
+    stamped `ts` (epoch ms) or now"""
+    # PM2.5: 5-100 µg/m³, usually 15-35, dangerous >35
+    pm25 = max(5, min(100, rng.gauss(25, 10)))
+    # PM10: usually 5-25 µg/m³ above PM2.5
+    pm10 = max(10, pm25 + rng.uniform(5, 25))
+    # CO2: 400-2000 ppm, usually 400-800, dangerous >1000
+    co2 = max(400, min(2000, rng.gauss(600, 150)))
+    # Temperature: 18-32°C, Humidity: 30-80%
+    temperature = max(18, min(32, rng.gauss(24, 3)))
+    humidity = max(30, min(80, rng.gauss(50, 10)))
+    # Relay drives the air purifier
+    status = RIGHTECH_RULES.classify(pm25, pm10, co2, temperature, humidity)
+    relay = 1 if status >= RIGHTECH_RULES.relay_code else 0
+
+    # Rightech uses milliseconds
+    if ts is None:
+        ts = int(time.time() * 1000)
+    return Reading(None, ts, round(pm25, 1), round(pm10, 1), int(co2),
+                   round(temperature, 1), round(humidity, 1), relay, status, RIGHTECH_RULES.names)
+
+
+def _payload(value):
+    # Same text paho produces for int/float/bool payloads
+    return str(value).encode()
+
+
+def telemetry_messages(reading, device="me"):
+    """(topic, payload) pairs for one Reading in the ThingsBoard per-topic layout"""
+    prefix = f"v1/devices/{device}/telemetry/"
+    # Whole-second timestamps go out in seconds, as the devices send them
+    ts = reading.ts
+    timestamp = ts // 1000 if ts % 1000 == 0 else ts
+    return [
+        (prefix + "pm25", _payload(reading.pm25)),
+        (prefix + "pm10", _payload(reading.pm10)),
+        (prefix + "co2", _payload(reading.co2)),
+        (prefix + "temperature", _payload(reading.temperature)),
+        (prefix + "humidity", _payload(reading.humidity)),
+        (prefix + "relay_state", b"1" if reading.relay else b"0"),
+        (ATTRIBUTES_TOPIC.format(device=device),
+         json.dumps({"timestamp": timestamp, "status": reading.status_name}).encode()),
+    ]
+
+
+def rightech_messages(reading, topic_base=RIGHTECH_TOPIC_BASE):
+    """(topic, payload) pairs for one Reading in the Rightech base/state/<sensor> layout"""
+    return [
+        (f"{topic_base}/pm25", _payload(reading.pm25)),
+        (f"{topic_base}/pm10", _payload(reading.pm10)),
+        (f"{topic_base}/co2", _payload(reading.co2)),
+        (f"{topic_base}/temperature", _payload(reading.temperature)),
+        (f"{topic_base}/humidity", _payload(reading.humidity)),
+        (f"{topic_base}/relay_state", b"1" if reading.relay else b"0"),
+        (f"{topic_base}/status", reading.status_name.encode()),
+        (f"{topic_base}/online", b"True"),
+    ]
+
+
+# profile name -> (generator(device_id, rng, ts=None), messages(data, device_id))
+PROFILES = {
+    "mqtt": (generate_sensor_data,
+             lambda data, device_id: telemetry_messages(data, device_id)),
+    "rightech": (lambda device_id, rng=random, ts=None: generate_rightech_data(rng, ts),
+                 lambda data, device_id: rightech_messages(data)),
+}
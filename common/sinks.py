@@ -0,0 +1,200 @@
+"""
+Output sinks for the emulators
+Where each generated reading goes, instead of printing ~15 formatted lines
+per reading:
+- NullSink: nothing (counts readings)
+- ConsoleSink: the full rendering for every Nth reading and/or a one-line
+  summary every few seconds; readings that are not shown are never formatted
+- RotatingFileSink: NDJSON lines (common/ndjson.py records) written in
+  large buffered chunks, rotated by size
+- MQTTSink: the reading's messages into an Outbox
+MultiSink fans out to several. add_sink_arguments()/build_sinks() give the
+emulators the same --output/--log-file options; --output quiet formats
+nothing per reading.
+"""
+
+import os
+import sys
+import time
+
+from common.ndjson import ndjson_line
+
+OUTPUT_MODES = ("full", "sampled", "summary", "quiet")
+
+
+class Sink:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, reading):
+        self.written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(Sink):
+    pass
+
+
+class ConsoleSink(Sink):
+    """render(reading) -> text for every `every`-th reading (1st, N+1th, ...; 0 for none),
+    plus a summary line every `summary` seconds (None for none)"""
+
+    def __init__(self, render, every=1, summary=None, stream=None):
+        super().__init__()
+        self.render = render
+        self.every = every
+        self.summary = summary
+        self.stream = stream or sys.stdout
+        self._countdown = 1
+        self._last = None
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def write(self, reading):
+        self.written += 1
+        if self.every:
+            self._countdown -= 1
+            if not self._countdown:
+                self._countdown = self.every
+                self.stream.write(self.render(reading))
+        if self.summary:
+            self._last = reading
+            self._window_count += 1
+            now = time.monotonic()
+            if now - self._window_start >= self.summary:
+                self._print_summary(now)
+
+    def _print_summary(self, now):
+        reading, elapsed = self._last, now - self._window_start
+        self.stream.write(f"📊 {self.written:,} readings ({self._window_count / elapsed:,.1f}/s) | "
+                          f"last {reading.device_id}: PM2.5 {reading.pm25} PM10 {reading.pm10} "
+                          f"CO2 {reading.co2} {reading.temperature}°C {reading.humidity}% "
+                          f"{reading.status_name}\n")
+        self._window_start, self._window_count = now, 0
+
+    def flush(self):
+        if self.summary and self._window_count:
+            self._print_summary(time.monotonic())
+        self.stream.flush()
+
+
+class RotatingFileSink(Sink):
+    """NDJSON log rotated to path.1 .. path.<backups> when it reaches max_bytes"""
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3, buffer_bytes=256 * 1024, line=ndjson_line):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_bytes = min(buffer_bytes, max_bytes) if max_bytes else buffer_bytes
+        self.line = line
+        self.rotations = 0
+        self._lines = []
+        self._buffered = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def write(self, reading):
+        self.written += 1
+        line = self.line(reading)
+        self._lines.append(line)
+        self._buffered += len(line)
+        if self._buffered >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            data = "".join(self._lines)
+            self._lines.clear()
+            self._buffered = 0
+            self._file.write(data)
+            self._size += len(data)
+        self._file.flush()
+        if self.max_bytes and self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = 0
+        self.rotations += 1
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class MQTTSink(Sink):
+    """Queues messages(reading) -> [(topic, payload), ...] on an Outbox, all of a reading's at once"""
+
+    def __init__(self, outbox, messages, qos=1):
+        super().__init__()
+        self.outbox = outbox
+        self.messages = messages
+        self.qos = qos
+        self.published = 0
+
+    def write(self, reading):
+        self.written += 1
+        messages = self.messages(reading)
+        self.published += len(messages) - self.outbox.publish_many(messages, self.qos)
+
+
+class MultiSink(Sink):
+    def __init__(self, sinks):
+        super().__init__()
+        self.sinks = list(sinks)
+
+    def write(self, reading):
+        self.written += 1
+        for sink in self.sinks:
+            sink.write(reading)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def add_sink_arguments(parser):
+    parser.add_argument("--output", default="full", choices=OUTPUT_MODES,
+                        help="Console: every reading, every --sample-every-th, a summary line "
+                             "every --summary-interval seconds, or nothing")
+    parser.add_argument("--sample-every", type=int, default=100, help="--output sampled: show every Nth reading")
+    parser.add_argument("--summary-interval", type=float, default=1.0, help="Seconds between summary lines")
+    parser.add_argument("--log-file", help="Also append every reading as NDJSON to this file (rotated)")
+    parser.add_argument("--log-max-mb", type=float, default=64.0, help="Rotate the log file at this size")
+    parser.add_argument("--log-backups", type=int, default=3, help="Rotated log files kept")
+
+
+def build_sinks(args, render, *sinks):
+    """The given sinks (e.g. an MQTTSink) plus the console/file sinks chosen by args, as one sink"""
+    sinks = list(sinks)
+    if args.output == "full":
+        sinks.append(ConsoleSink(render))
+    elif args.output == "sampled":
+        sinks.append(ConsoleSink(render, every=args.sample_every))
+    elif args.output == "summary":
+        sinks.append(ConsoleSink(render, every=0, summary=args.summary_interval))
+    if args.log_file:
+        sinks.append(RotatingFileSink(args.log_file, int(args.log_max_mb * 1024 * 1024), args.log_backups))
+    return MultiSink(sinks) if sinks else NullSink()
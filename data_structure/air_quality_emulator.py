@@ -4,70 +4,38 @@ Simulates ESP32 + SDS011, MH-Z19B, DHT22, Relay Module
 Generates random data and outputs to console (or simulates MQTT)
 """
 
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
 import json
-import time
-import random
 from datetime import datetime
 
+from common.scheduler import Scheduler, random_latency
+from common.sinks import ConsoleSink, add_sink_arguments, build_sinks
+from common.sensor_model import generate_sensor_data, grid_timestamp
+
 class AirQualityEmulator:
-    def __init__(self, device_id="air_monitor_001"):
+    def __init__(self, device_id="air_monitor_001", interval=3.0):
         self.device_id = device_id
         self.running = False
-        self.interval = 3  # Seconds between data readings
-        
-    def generate_sensor_data(self):
-        """Generate simulated sensor data"""
-        # PM2.5: 0-100 (random with trend increase/decrease)
-        pm25_trend = random.uniform(-2, 2)
-        pm25 = max(5, min(100, 25 + pm25_trend + random.uniform(-5, 5)))
-        
-        # PM10: similar to PM2.5 but 10-20% higher
-        pm10 = pm25 + random.uniform(10, 20)
-        
-        # CO2: 400-2000 ppm (increases with "more people")
-        co2_base = 450 if random.random() > 0.7 else 800
-        co2 = max(400, min(2000, co2_base + random.uniform(-50, 100)))
-        
-        # Temperature: 18-28°C
-        temperature = max(18, min(28, 22 + random.uniform(-2, 2)))
-        
-        # Humidity: 30-70%
-        humidity = max(30, min(70, 50 + random.uniform(-10, 10)))
-        
-        # Relay state: based on PM2.5 or PM10
-        relay_state = pm25 > 50 or pm10 > 63
+        self.interval = interval  # Seconds between data readings (grid period of the scheduler)
+        self.scheduler = Scheduler()
+        self.sink = ConsoleSink(self.render)  # See configure_output()
+        self.verbose = True  # Per-cycle progress lines
 
-        # Warning status: based on PM2.5 or PM10 or CO2
-        warning = pm25 > 35 or pm10 > 50 or co2 > 1000
-        
-        return {
-            "device_id": self.device_id,
-            "timestamp": int(time.time()),
-            "datetime": datetime.now().isoformat(),
-            "pm25": round(pm25, 1),
-            "pm10": round(pm10, 1),
-            "co2": int(co2),
-            "temperature": round(temperature, 1),
-            "humidity": round(humidity, 1),
-            "relay_state": relay_state,
-            "status": "DANGER" if relay_state else "WARNING" if warning else "OK"
-        }
+    def configure_output(self, args):
+        """Console/log sinks from add_sink_arguments() options"""
+        self.sink = build_sinks(args, self.render)
+        self.verbose = args.output == "full"
+
+    def generate_sensor_data(self, ts=None):
+        """Generate simulated sensor data (shared sensor model, see common/sensor_model.py)"""
+        return generate_sensor_data(self.device_id, ts=ts)
     
-    def display_data(self, data):
-        """Display data in console with formatted output"""
-        print(f"\n{'='*60}")
-        print(f"📊 AIR QUALITY DATA - {data['datetime']}")
-        print(f"{'='*60}")
-        print(f"🆔 Device:      {data['device_id']}")
-        print(f"⏰ Time:        {datetime.fromtimestamp(data['timestamp']).strftime('%H:%M:%S')}")
-        print(f"🌫️ PM2.5:       {data['pm25']} µg/m³ {'⚠️' if data['pm25'] > 35 else ''}")
-        print(f"💨 PM10:        {data['pm10']} µg/m³ {'⚠️' if data['pm10'] > 50 else ''}")
-        print(f"🌡️ CO2:         {data['co2']} ppm {'⚠️' if data['co2'] > 1000 else ''}")
-        print(f"🌡️ Temperature: {data['temperature']}°C")
-        print(f"💧 Humidity:    {data['humidity']}%")
-        print(f"🔌 Relay:       {'🟢 ON' if data['relay_state'] else '🔴 OFF'}")
-        print(f"📈 Status:      {data['status']}")
-        
+    def render(self, data):
+        """Console block for one reading (only built for readings the console sink shows)"""
         # Simulate MQTT sending
         mqtt_payload = json.dumps({
             "pm25": data['pm25'],
@@ -77,56 +45,82 @@ class AirQualityEmulator:
             "humidity": data['humidity'],
             "relay_state": data['relay_state']
         })
-        print(f"📡 Sending MQTT payload: {len(mqtt_payload)} bytes")
-        print(f"{'='*60}\n")
+        return (f"\n{'='*60}\n"
+                f"📊 AIR QUALITY DATA - {data['datetime']}\n"
+                f"{'='*60}\n"
+                f"🆔 Device:      {data['device_id']}\n"
+                f"⏰ Time:        {datetime.fromtimestamp(data['timestamp']).strftime('%H:%M:%S')}\n"
+                f"🌫️ PM2.5:       {data['pm25']} µg/m³ {'⚠️' if data['pm25'] > 35 else ''}\n"
+                f"💨 PM10:        {data['pm10']} µg/m³ {'⚠️' if data['pm10'] > 50 else ''}\n"
+                f"🌡️ CO2:         {data['co2']} ppm {'⚠️' if data['co2'] > 1000 else ''}\n"
+                f"🌡️ Temperature: {data['temperature']}°C\n"
+                f"💧 Humidity:    {data['humidity']}%\n"
+                f"🔌 Relay:       {'🟢 ON' if data['relay_state'] else '🔴 OFF'}\n"
+                f"📈 Status:      {data['status']}\n"
+                f"📡 Sending MQTT payload: {len(mqtt_payload)} bytes\n"
+                f"{'='*60}\n\n")
     
-    def run_simulation(self):
-        """Run simulation loop"""
+    def sample(self, tick):
+        """One scheduled reading; the sensor read delay was already applied by the scheduler"""
+        if self.verbose:
+            print(f"\n🔄 Cycle #{tick.index + 1} - Read sensors in {tick.latency:.2f}s"
+                  f"{f' (started {tick.late * 1000:.1f} ms late)' if tick.late > 0.001 else ''}")
+
+        # Generate data and hand it to the sinks (console rendering, log file); stamped with
+        # the grid time, so sub-second intervals give every reading its own ms
+        self.sink.write(self.generate_sensor_data(grid_timestamp(tick.wall_time(), self.interval)))
+
+        if tick.last:
+            print("✅ Simulation demo completed!")
+        elif self.verbose:
+            print(f"   ⏳ Next reading in {tick.until_next():.2f}s")
+
+    def run_simulation(self, cycles=3, duration=None):
+        """Read every `interval` seconds for `cycles` readings (None: no limit) or `duration` seconds"""
         print(f"🚀 STARTING IoT DEVICE SIMULATION: {self.device_id}")
         print(f"⏱️ Data reading interval: {self.interval} seconds")
         print(f"📡 Simulated MQTT connection to ThingsBoard...")
-        
+
         self.running = True
-        cycle = 0
-        
-        while self.running:
-            cycle += 1
-            print(f"\n🔄 Cycle #{cycle} - Reading sensor data...")
-            
-            # Simulate sensor reading time (0.5-2 seconds)
-            read_time = random.uniform(0.5, 2.0)
-            print(f"   ⏳ Reading sensors... ({read_time:.1f}s)")
-            time.sleep(read_time)
-            
-            # Generate and display data
-            data = self.generate_sensor_data()
-            self.display_data(data)
-            
-            # Simulate processing and sending data (0.2-0.5s)
-            process_time = random.uniform(0.2, 0.5)
-            print(f"   ⚙️ Processing and sending data... ({process_time:.1f}s)")
-            time.sleep(process_time)
-            
-            if cycle < 3:  # Run 3 demo cycles
-                print(f"   ⏳ Waiting {self.interval} seconds for next cycle...")
-                time.sleep(self.interval)
-            else:
-                print("✅ Simulation demo completed!")
-                break
-        
+        # Simulated sensor reading time: 0.5-2 s, shrunk for short intervals to fit the period
+        self.scheduler.every(self.interval, self.sample, count=cycles,
+                             latency=random_latency(0.5, 2.0, self.interval), name=self.device_id)
+        self.scheduler.run(duration)
         self.running = False
-    
+        self.sink.close()
+        self.report()
+
+    def report(self):
+        schedule = self.scheduler.stats()
+        if schedule["ticks"]:
+            late = schedule["lateness_ms"]
+            print(f"⏱️ Schedule: {schedule['ticks']} reading(s), {schedule['overruns']} overrun(s), "
+                  f"{schedule['missed']} missed | start jitter p50 {late['p50']} ms, "
+                  f"p99 {late['p99']} ms, max {late['max']} ms")
+
     def stop(self):
         """Stop simulation"""
         self.running = False
+        self.scheduler.stop()
+        self.sink.close()
         print("\n🛑 STOPPING IoT DEVICE SIMULATION")
+        self.report()
 
 # Run simulation
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Air quality monitor emulator (console)")
+    parser.add_argument("--device", default="air_monitor_001")
+    parser.add_argument("--interval", type=float, default=3.0, help="Seconds between readings (down to 0.01)")
+    parser.add_argument("--cycles", type=int, default=3, help="Readings to take; 0 runs until Ctrl+C or --duration")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    add_sink_arguments(parser)
+    args = parser.parse_args()
+
     try:
         # Initialize and run emulator
-        emulator = AirQualityEmulator("air_monitor_001")
-        emulator.run_simulation()
+        emulator = AirQualityEmulator(args.device, args.interval)
+        emulator.configure_output(args)
+        emulator.run_simulation(args.cycles or None, args.duration)
         
     except KeyboardInterrupt:
         print("\n⚠️  User interrupted program (Ctrl+C)")
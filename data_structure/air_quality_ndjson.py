@@ -0,0 +1,272 @@
+"""
+Streaming NDJSON import/export of air quality readings
+One record per line in the air_quality_data_structure.json layout (plus an
+optional "status"). Files are read and written line by line in bounded
+chunks, so memory stays flat for multi-GB dumps; ".gz" paths are
+(de)compressed on the fly. Invalid records are reported with their line
+number and skipped, never abort the run.
+
+    python air_quality_ndjson.py import dump.ndjson --db air_quality.db --workers 4
+    python air_quality_ndjson.py export dump.ndjson --db air_quality.db --start 2026-01-01 --end 2026-02-01
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import gzip
+import json
+import sqlite3
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from common.ndjson import format_record
+from common.readings import ReadingBatch
+from common.sensor_model import STATUS_CODES, to_epoch_ms
+from mqtt.partitioned_store import CATALOG_NAME, PartitionedStore, list_partitions
+from mqtt.rollups import RollupReadingStore
+from mqtt.telemetry_query import parse_time
+from mqtt.telemetry_store import ReadingStore
+
+STRUCTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "air_quality_data_structure.json")
+LINES_PER_CHUNK = 20000
+
+# Same bounds the interactive generate_air_quality_json.py asks for
+RANGES = {"pm25": (0, 999), "pm10": (0, 999), "co2": (0, 5000),
+          "temperature": (-40, 80), "humidity": (0, 100)}
+# May be null: export writes incomplete readings that way, ReadingBatch stores them as NaN/-1
+NULLABLE = set(RANGES) | {"relay_state"}
+
+_TYPE_CHECKS = {
+    "string": lambda value: isinstance(value, str),
+    "int": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "float": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+}
+
+
+def load_structure(path=STRUCTURE_PATH):
+    """[(field, type name, check)] from the record structure file"""
+    with open(path, encoding="utf-8") as file:
+        structure = json.load(file)
+    return [(field, type_name, _TYPE_CHECKS[type_name]) for field, type_name in structure.items()]
+
+
+STRUCTURE = load_structure()
+
+
+def validate(record):
+    """Typed store row for one decoded record; raises ValueError on invalid records"""
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+    for field, type_name, check in STRUCTURE:
+        if field not in record:
+            raise ValueError(f"missing field {field}")
+        value = record[field]
+        if value is None and field in NULLABLE:
+            continue
+        if not check(value):
+            raise ValueError(f"{field} must be {type_name}, got {value!r}")
+    for field, (low, high) in RANGES.items():
+        value = record[field]
+        if value is not None and not low <= value <= high:
+            raise ValueError(f"{field} out of range [{low}, {high}]: {value}")
+
+    status = record.get("status")
+    if status is not None:
+        # Checked as a string first: a list/object would make the lookup raise TypeError
+        if not isinstance(status, str) or status not in STATUS_CODES:
+            raise ValueError(f"unknown status {status!r}")
+        status = STATUS_CODES[status]
+    relay = record["relay_state"]
+    return (record["device_id"], to_epoch_ms(record["timestamp"]), record["pm25"], record["pm10"],
+            record["co2"], record["temperature"], record["humidity"],
+            None if relay is None else int(relay), status)
+
+
+def decode_lines(first_line, lines):
+    """(ReadingBatch, errors) for a chunk of raw lines; errors are (line number, message, line).
+
+    The columnar batch is what crosses the process boundary, which pickles
+    far smaller and faster than a list of row tuples.
+    """
+    rows, errors = ReadingBatch(), []
+    for number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            rows.append_row(validate(json.loads(line)))
+        except (ValueError, RecursionError) as e:  # JSONDecodeError/UnicodeDecodeError; absurdly nested JSON
+            errors.append((number, str(e), line.decode("utf-8", "replace").rstrip("\n")))
+    return rows, errors
+
+
+def open_file(path, mode):
+    """Binary-mode file, gzip-compressed when the name ends with .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode, buffering=1 << 20)
+
+
+def read_chunks(path, lines_per_chunk=LINES_PER_CHUNK):
+    """Yield (first line number, [raw lines]) without loading the file"""
+    with open_file(path, "rb") as file:
+        chunk, first = [], 1
+        for number, line in enumerate(file, 1):
+            chunk.append(line)
+            if len(chunk) >= lines_per_chunk:
+                yield first, chunk
+                chunk, first = [], number + 1
+        if chunk:
+            yield first, chunk
+
+
+def decoded_chunks(path, workers=0, lines_per_chunk=LINES_PER_CHUNK):
+    """decode_lines() results in file order, optionally decoded by a process pool.
+
+    At most 2 chunks per worker are in flight, so a fast reader never
+    queues the whole file in memory ahead of the decoders.
+    """
+    if workers <= 1:
+        for first, lines in read_chunks(path, lines_per_chunk):
+            yield decode_lines(first, lines)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for first, lines in read_chunks(path, lines_per_chunk):
+            pending.append(pool.apply_async(decode_lines, (first, lines)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def import_ndjson(path, store, workers=0, on_error=None, lines_per_chunk=LINES_PER_CHUNK):
+    """Insert every valid record into an opened store; returns (rows, errors).
+
+    One transaction per chunk. on_error(line number, message, line) is
+    called for each rejected record.
+    """
+    imported = rejected = 0
+    for rows, errors in decoded_chunks(path, workers, lines_per_chunk):
+        if rows:
+            store.write(rows.rows())
+            store.commit()
+            imported += len(rows)
+        rejected += len(errors)
+        if on_error:
+            for error in errors:
+                on_error(*error)
+    return imported, rejected
+
+
+_EXPORT_SQL = '''SELECT device_id, ts, pm25, pm10, co2, temperature, humidity, relay, status
+                 FROM readings WHERE ts >= ? AND ts < ?{device} ORDER BY device_id, ts'''
+
+def export_rows(conn, names, low, high, device_id=None):
+    """Stream (device name, ts, ...) rows of one typed database for [low, high)"""
+    params = (low, high) if device_id is None else (low, high, device_id)
+    cursor = conn.execute(_EXPORT_SQL.format(device="" if device_id is None else " AND device_id = ?"), params)
+    try:
+        for row in cursor:
+            yield (names[row[0]],) + row[1:]
+    finally:
+        cursor.close()
+
+
+def export_ndjson(path, sources, low, high, device=None, timestamp_ms=False):
+    """Write readings from (connection, {device_id: name}) sources; returns the row count"""
+    written = 0
+    with open_file(path, "wb") as file:
+        for conn, names in sources:
+            device_id = None
+            if device is not None:
+                device_id = next((key for key, name in names.items() if name == device), None)
+                if device_id is None:
+                    continue
+            lines = []
+            for row in export_rows(conn, names, low, high, device_id):
+                lines.append(format_record(row, timestamp_ms=timestamp_ms))
+                if len(lines) >= LINES_PER_CHUNK:
+                    file.write("".join(lines).encode())
+                    written += len(lines)
+                    lines = []
+            file.write("".join(lines).encode())
+            written += len(lines)
+    return written
+
+
+def _single_source(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    yield conn, dict(conn.execute("SELECT device_id, name FROM devices"))
+    conn.close()
+
+
+def _partition_sources(directory, low, high):
+    catalog = sqlite3.connect(f"file:{os.path.join(directory, CATALOG_NAME)}?mode=ro", uri=True)
+    names = dict(catalog.execute("SELECT device_id, name FROM devices"))
+    partitions = list_partitions(catalog, low, high)
+    catalog.close()
+    for _, _, path, _ in partitions:
+        conn = sqlite3.connect(f"file:{os.path.join(directory, path)}?mode=ro", uri=True)
+        yield conn, names
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk NDJSON import/export of air quality readings")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help="NDJSON file (.gz for gzip)")
+    parser.add_argument("--db", default="air_quality.db", help="Typed SQLite store")
+    parser.add_argument("--partition-dir", help="Use a partitioned store directory instead of --db")
+    parser.add_argument("--rollups", action="store_true", help="import: maintain rollup tables")
+    parser.add_argument("--workers", type=int, default=0, help="import: decode processes (0 = inline)")
+    parser.add_argument("--errors", help="import: write rejected lines here as NDJSON")
+    parser.add_argument("--quiet", action="store_true", help="import: do not print each rejected line")
+    parser.add_argument("--device", help="export: only this device")
+    parser.add_argument("--start", help="export: from this time (ISO or epoch s/ms)")
+    parser.add_argument("--end", help="export: before this time (ISO or epoch s/ms)")
+    parser.add_argument("--timestamp-ms", action="store_true", help="export: millisecond timestamps for every record (sub-second ones always are)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "import":
+        if args.partition_dir:
+            store = PartitionedStore(args.partition_dir, None, rollups=args.rollups).open()
+        else:
+            store = (RollupReadingStore if args.rollups else ReadingStore)(args.db).open()
+        error_file = open(args.errors, "w", encoding="utf-8") if args.errors else None
+
+        def on_error(number, message, line):
+            if not args.quiet:
+                print(f"⚠️ Line {number}: {message}")
+            if error_file:
+                error_file.write(json.dumps({"line": number, "error": message, "record": line}) + "\n")
+
+        try:
+            imported, rejected = import_ndjson(args.file, store, args.workers, on_error)
+        finally:
+            store.close()
+            if error_file:
+                error_file.close()
+        elapsed = time.perf_counter() - started
+        print(f"✅ Imported {imported:,} records ({imported / elapsed:,.0f}/s), rejected {rejected:,}")
+    else:
+        source_path = os.path.join(args.partition_dir, CATALOG_NAME) if args.partition_dir else args.db
+        if not os.path.exists(source_path):
+            parser.error(f"{source_path} does not exist")
+        low = parse_time(args.start)
+        high = parse_time(args.end)
+        low = low if low is not None else -2 ** 62
+        high = high if high is not None else 2 ** 62
+        sources = (_partition_sources(args.partition_dir, low, high) if args.partition_dir
+                   else _single_source(args.db))
+        written = export_ndjson(args.file, sources, low, high, args.device, args.timestamp_ms)
+        elapsed = time.perf_counter() - started
+        print(f"✅ Exported {written:,} records ({written / elapsed:,.0f}/s) to {args.file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,123 +4,163 @@ Simulates ESP32 + SDS011, MH-Z19B, DHT22, Relay Module
 Publishes random data to MQTT broker
 """
 
-import json
-import time
-import random
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
 import paho.mqtt.client as mqtt
 from datetime import datetime
 
+from common.metrics import register_outbox, start_metrics
+from common.outbox import Outbox
+from common.payload_codec import PAYLOAD_FORMATS, packed_messages
+from common.publisher import Publisher
+from common.scheduler import Scheduler, random_latency
+from common.sinks import ConsoleSink, MQTTSink, MultiSink, add_sink_arguments, build_sinks
+from common.sensor_model import generate_sensor_data, grid_timestamp, telemetry_messages
+
 class AirQualityEmulator:
-    def __init__(self, device_id="air_monitor_001", broker="localhost", port=1883):
+    def __init__(self, device_id="air_monitor_001", broker="localhost", port=1883,
+                 payload_format="per-topic", spool_dir=".outbox", max_inflight=100, qos0_topics=(),
+                 metrics_port=None, interval=3.0, drain_rate=500.0):
         self.device_id = device_id
         self.broker = broker
         self.port = port
+        self.payload_format = payload_format  # per-topic (ThingsBoard), json or binary
         self.client = mqtt.Client(client_id=f"emulator_{device_id}", protocol=mqtt.MQTTv311)
         self.running = False
-        self.interval = 3  # Seconds between readings
-
-        # Connect to MQTT broker
-        try:
-            self.client.connect(self.broker, self.port, 60)
-            print(f"Connected to MQTT broker at {self.broker}:{self.port}")
-        except Exception as e:
-            print(f"Failed to connect to MQTT broker: {e}")
-            exit(1)
-
-    def generate_sensor_data(self):
-        """Generate simulated sensor data"""
-        pm25_trend = random.uniform(-2, 2)
-        pm25 = max(5, min(100, 25 + pm25_trend + random.uniform(-5, 5)))
-        pm10 = pm25 + random.uniform(10, 20)
-        co2_base = 450 if random.random() > 0.7 else 800
-        co2 = max(400, min(2000, co2_base + random.uniform(-50, 100)))
-        temperature = max(18, min(28, 22 + random.uniform(-2, 2)))
-        humidity = max(30, min(70, 50 + random.uniform(-10, 10)))
-        relay_state = pm25 > 50 or pm10 > 63
-        warning = pm25 > 35 or pm10 > 50 or co2 > 1000
-
-        return {
-            "device_id": self.device_id,
-            "timestamp": int(time.time()),
-            "datetime": datetime.now().isoformat(),
-            "pm25": round(pm25, 1),
-            "pm10": round(pm10, 1),
-            "co2": int(co2),
-            "temperature": round(temperature, 1),
-            "humidity": round(humidity, 1),
-            "relay_state": relay_state,
-            "status": "DANGER" if relay_state else "WARNING" if warning else "OK"
-        }
-
-    def display_data(self, data):
-        """Display data in console and publish to MQTT"""
-        print(f"\n{'='*60}")
-        print(f"📊 AIR QUALITY DATA - {data['datetime']}")
-        print(f"{'='*60}")
-        print(f"🆔 Device:      {data['device_id']}")
-        print(f"⏰ Time:        {datetime.fromtimestamp(data['timestamp']).strftime('%H:%M:%S')}")
-        print(f"🌫️ PM2.5:       {data['pm25']} µg/m³ {'⚠️' if data['pm25'] > 35 else ''}")
-        print(f"💨 PM10:        {data['pm10']} µg/m³ {'⚠️' if data['pm10'] > 50 else ''}")
-        print(f"🌡️ CO2:         {data['co2']} ppm {'⚠️' if data['co2'] > 1000 else ''}")
-        print(f"🌡️ Temperature: {data['temperature']}°C")
-        print(f"💧 Humidity:    {data['humidity']}%")
-        print(f"🔌 Relay:       {'🟢 ON' if data['relay_state'] else '🔴 OFF'}")
-        print(f"📈 Status:      {data['status']}")
-
-        # Publish to MQTT topics
-        self.client.publish("v1/devices/me/telemetry/pm25", data['pm25'], qos=1)
-        self.client.publish("v1/devices/me/telemetry/pm10", data['pm10'], qos=1)
-        self.client.publish("v1/devices/me/telemetry/co2", data['co2'], qos=1)
-        self.client.publish("v1/devices/me/telemetry/temperature", data['temperature'], qos=1)
-        self.client.publish("v1/devices/me/telemetry/humidity", data['humidity'], qos=1)
-        self.client.publish("v1/devices/me/telemetry/relay_state", 1 if data['relay_state'] else 0, qos=1)
-        status_json = json.dumps({"timestamp": data['timestamp'], "status": data['status']})
-        self.client.publish("v1/devices/me/attributes", status_json, qos=1)
-        print(f"📡 Published to MQTT topics")
-        print(f"{'='*60}\n")
-
-    def run_simulation(self):
-        """Run simulation loop"""
+        self.interval = interval  # Seconds between readings (grid period of the scheduler)
+        self.scheduler = Scheduler()
+
+        # Readings are queued (and spilled to disk) until the broker is reachable;
+        # the outbox reconnects with backoff instead of giving up
+        self.publisher = Publisher(self.client, max_inflight, qos0_topics)
+        self.outbox = Outbox(self.client, os.path.join(spool_dir, device_id),
+                             max_rate=drain_rate or None, publisher=self.publisher).start(self.broker, self.port)
+        print(f"Connecting to MQTT broker at {self.broker}:{self.port} "
+              f"({self.outbox.depth} message(s) queued from earlier runs)")
+        register_outbox(self.outbox)
+        self.metrics = start_metrics(metrics_port)
+
+        # Where readings go: MQTT plus the full console rendering, unless configure_output() says otherwise
+        self.mqtt_sink = MQTTSink(self.outbox, self.messages)
+        self.sink = MultiSink([self.mqtt_sink, ConsoleSink(self.render)])
+        self.verbose = True  # Per-cycle progress lines
+
+    def configure_output(self, args):
+        """Console/log sinks from add_sink_arguments() options"""
+        self.sink = build_sinks(args, self.render, self.mqtt_sink)
+        self.verbose = args.output == "full"
+
+    def generate_sensor_data(self, ts=None):
+        """Generate simulated sensor data (stamped `ts` epoch ms, default now)"""
+        return generate_sensor_data(self.device_id, ts=ts)
+
+    def messages(self, data):
+        """(topic, payload) pairs for one reading in the configured payload format"""
+        if self.payload_format == "per-topic":
+            return telemetry_messages(data)
+        return packed_messages(data, "me", self.payload_format)
+
+    def render(self, data):
+        """Console block for one reading (only built for readings the console sink shows)"""
+        stats = self.outbox.stats()
+        return (f"\n{'='*60}\n"
+                f"📊 AIR QUALITY DATA - {data['datetime']}\n"
+                f"{'='*60}\n"
+                f"🆔 Device:      {data['device_id']}\n"
+                f"⏰ Time:        {datetime.fromtimestamp(data['timestamp']).strftime('%H:%M:%S')}\n"
+                f"🌫️ PM2.5:       {data['pm25']} µg/m³ {'⚠️' if data['pm25'] > 35 else ''}\n"
+                f"💨 PM10:        {data['pm10']} µg/m³ {'⚠️' if data['pm10'] > 50 else ''}\n"
+                f"🌡️ CO2:         {data['co2']} ppm {'⚠️' if data['co2'] > 1000 else ''}\n"
+                f"🌡️ Temperature: {data['temperature']}°C\n"
+                f"💧 Humidity:    {data['humidity']}%\n"
+                f"🔌 Relay:       {'🟢 ON' if data['relay_state'] else '🔴 OFF'}\n"
+                f"📈 Status:      {data['status']}\n"
+                f"📡 Queued {len(self.messages(data))} MQTT message(s) ({self.payload_format}) | "
+                f"{'🟢 connected' if stats['connected'] else '🔴 offline'} | "
+                f"backlog {stats['depth']} ({stats['spill_bytes']} bytes on disk)\n"
+                f"{'='*60}\n\n")
+
+    def sample(self, tick):
+        """One scheduled reading; the sensor read delay was already applied by the scheduler"""
+        if self.verbose:
+            print(f"\n🔄 Cycle #{tick.index + 1} - Read sensors in {tick.latency:.2f}s"
+                  f"{f' (started {tick.late * 1000:.1f} ms late)' if tick.late > 0.001 else ''}")
+        # Stamped with the grid time, so sub-second intervals give every reading its own ms
+        self.sink.write(self.generate_sensor_data(grid_timestamp(tick.wall_time(), self.interval)))
+        if tick.last:
+            print("✅ Simulation demo completed!")
+        elif self.verbose:
+            print(f"   ⏳ Next reading in {tick.until_next():.2f}s")
+
+    def run_simulation(self, cycles=3, duration=None):
+        """Read every `interval` seconds for `cycles` readings (None: no limit) or `duration` seconds"""
         print(f"🚀 STARTING IoT DEVICE SIMULATION: {self.device_id}")
         print(f"⏱️ Data reading interval: {self.interval} seconds")
-        
+
         self.running = True
-        cycle = 0
-        
-        while self.running:
-            cycle += 1
-            print(f"\n🔄 Cycle #{cycle} - Reading sensor data...")
-            read_time = random.uniform(0.5, 2.0)
-            print(f"   ⏳ Reading sensors... ({read_time:.1f}s)")
-            time.sleep(read_time)
-            
-            data = self.generate_sensor_data()
-            self.display_data(data)
-            
-            process_time = random.uniform(0.2, 0.5)
-            print(f"   ⚙️ Processing and sending data... ({process_time:.1f}s)")
-            time.sleep(process_time)
-            
-            if cycle < 3:  # Run 3 demo cycles
-                print(f"   ⏳ Waiting {self.interval} seconds for next cycle...")
-                time.sleep(self.interval)
-            else:
-                print("✅ Simulation demo completed!")
-                break
-        
+        # Simulated read time: 0.5-2 s, shrunk for short intervals so it stays inside the period
+        self.scheduler.every(self.interval, self.sample, count=cycles,
+                             latency=random_latency(0.5, 2.0, self.interval), name=self.device_id)
+        self.scheduler.run(duration)
         self.running = False
-        self.client.disconnect()
-    
+        self.close()
+
+    def close(self):
+        """Deliver what the broker will take, keep the rest on disk for the next run"""
+        self.scheduler.stop()
+        self.sink.close()
+        self.outbox.close()
+        if self.metrics:
+            self.metrics.stop()
+        stats = self.outbox.stats()
+        print(f"📤 Delivered {stats['drained']} message(s), {stats['depth']} left in {self.outbox.log.directory}")
+        latency = stats["publisher"]["ack_latency_ms"]
+        if latency["count"]:
+            print(f"⏱️ Publish->ack latency: p50 {latency['p50']} ms, p99 {latency['p99']} ms, max {latency['max']} ms")
+        schedule = self.scheduler.stats()
+        if schedule["ticks"]:
+            late = schedule["lateness_ms"]
+            print(f"⏱️ Schedule: {schedule['ticks']} reading(s), {schedule['overruns']} overrun(s), "
+                  f"{schedule['missed']} missed | start jitter p50 {late['p50']} ms, "
+                  f"p99 {late['p99']} ms, max {late['max']} ms")
+
     def stop(self):
         """Stop simulation"""
         self.running = False
-        self.client.disconnect()
+        self.close()
         print("\n🛑 STOPPING IoT DEVICE SIMULATION")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Air quality monitor emulator (MQTT)")
+    parser.add_argument("--device", default="air_monitor_001")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--payload", default="per-topic", choices=PAYLOAD_FORMATS,
+                        help="per-topic: 7 ThingsBoard messages; json/binary: one packed message")
+    parser.add_argument("--spool-dir", default=".outbox",
+                        help="Where unsent messages are kept during broker outages")
+    parser.add_argument("--max-inflight", type=int, default=100, help="Unacked QoS 1 messages allowed")
+    parser.add_argument("--drain-rate", type=float, default=500.0,
+                        help="Messages/s when sending the on-disk backlog after an outage; "
+                             "live readings are not capped (0 for no cap)")
+    parser.add_argument("--qos0-topic", action="append", default=[],
+                        help="Topic filter sent at QoS 0, bypassing the outbox (repeatable)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus /metrics (and /profile) on this port")
+    parser.add_argument("--interval", type=float, default=3.0, help="Seconds between readings (down to 0.01)")
+    parser.add_argument("--cycles", type=int, default=3, help="Readings to send; 0 runs until Ctrl+C or --duration")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    add_sink_arguments(parser)
+    args = parser.parse_args()
+
     try:
-        emulator = AirQualityEmulator("air_monitor_001", "localhost", 1883)
-        emulator.run_simulation()
+        emulator = AirQualityEmulator(args.device, args.broker, args.port, args.payload, args.spool_dir,
+                                      args.max_inflight, args.qos0_topic, args.metrics_port, args.interval,
+                                      args.drain_rate)
+        emulator.configure_output(args)
+        emulator.run_simulation(args.cycles or None, args.duration)
     except KeyboardInterrupt:
         print("\n⚠️  User interrupted program (Ctrl+C)")
         emulator.stop()
@@ -0,0 +1,239 @@
+"""
+IoT Air Quality Fleet Emulator
+Simulates thousands of air quality monitors from one process: every device
+is an asyncio task, devices share a configurable number of MQTT connections,
+and large fleets can be split over several processes (one event loop each)
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+
+from common.payload_codec import PAYLOAD_FORMATS, packed_messages
+from common.sensor_model import PROFILES, grid_timestamp
+from mqtt.async_mqtt import AsyncMQTTClient, FakeTransport
+
+
+def make_transport_factory(broker="localhost", port=1883, fake=False,
+                           username=None, password=None, max_inflight=1000):
+    """Return factory(client_id) -> unconnected transport"""
+    if fake:
+        return lambda client_id: FakeTransport(client_id)
+    return lambda client_id: AsyncMQTTClient(broker, port, client_id, username=username,
+                                             password=password, max_inflight=max_inflight)
+
+
+class FleetRunner:
+    def __init__(self, device_ids, transport_factory, profile="mqtt", interval=3.0,
+                 connections=1, qos=1, duration=None, cycles=None, seed=None,
+                 payload_format="per-topic", precise_timestamps=False, name="fleet", report=True):
+        self.device_ids = list(device_ids)
+        self.transport_factory = transport_factory
+        self.profile = profile
+        self.interval = interval  # Seconds between readings of one device
+        self.connections = connections
+        self.qos = qos
+        self.payload_format = payload_format  # per-topic, or one json/binary message per reading
+        self.precise_timestamps = precise_timestamps  # Epoch-ms publish time (latency benchmarks)
+        self.duration = duration  # Seconds; None = until cancelled or cycles done
+        self.cycles = cycles  # Readings per device; None = unlimited
+        self.rng = random.Random(seed)
+        self.name = name
+        self.report = report  # Print per-second rates (False when a parent aggregates)
+        self.counters = None  # Optional (shared array, slot) updated once per second
+        self.clients = []
+        self.readings = 0
+        self.started = 0.0
+        self.wall_started = 0.0  # time.time() at self.started
+        self.elapsed = 0.0
+
+        if profile == "rightech" and connections != len(self.device_ids):
+            # base/state/<sensor> topics carry no device id: one connection per device
+            print(f"⚠️  Rightech profile needs one connection per device, using {len(self.device_ids)}")
+            self.connections = len(self.device_ids)
+
+    @property
+    def published(self):
+        return sum(client.published for client in self.clients)
+
+    @property
+    def acked(self):
+        return sum(client.acked for client in self.clients)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if self.profile == "rightech":
+            client_ids = [f"emulator_{device_id}" for device_id in self.device_ids]
+        else:
+            client_ids = [f"{self.name}_{os.getpid()}_{i}" for i in range(self.connections)]
+        self.clients = await asyncio.gather(
+            *(self.transport_factory(client_id).connect() for client_id in client_ids))
+
+        self.started, self.wall_started = loop.time(), time.time()
+        devices = [asyncio.create_task(self._device(i, device_id))
+                   for i, device_id in enumerate(self.device_ids)]
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.wait(devices, timeout=self.duration)
+        finally:
+            self.elapsed = loop.time() - self.started
+            for task in devices:
+                task.cancel()
+            reporter.cancel()
+            await asyncio.gather(*devices, reporter, return_exceptions=True)
+            await asyncio.gather(*(client.wait_acked() for client in self.clients))
+            await asyncio.gather(*(client.close() for client in self.clients))
+            self._publish_counters()
+
+    async def _device(self, index, device_id):
+        loop = asyncio.get_running_loop()
+        generate, messages = PROFILES[self.profile]
+        if self.payload_format != "per-topic":
+            messages = lambda data, device: packed_messages(data, device, self.payload_format)
+        client = self.clients[index % len(self.clients)]
+        # Spread first readings over one interval so devices don't publish in lockstep
+        next_time = self.started + self.interval * index / len(self.device_ids)
+        cycle = 0
+        while self.cycles is None or cycle < self.cycles:
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Stamped with the scheduled time: ms below a 1 s interval, so readings keep distinct keys
+            reading = generate(device_id, self.rng,
+                               grid_timestamp(self.wall_started + next_time - self.started, self.interval))
+            if self.precise_timestamps:
+                reading.ts = int(time.time() * 1000)
+            for topic, payload in messages(reading, device_id):
+                await client.publish(topic, payload, self.qos)
+            self.readings += 1
+            cycle += 1
+            next_time += self.interval
+
+    def _publish_counters(self):
+        if self.counters is not None:
+            array, slot = self.counters
+            array[slot] = self.published
+
+    async def _report(self):
+        last_count, last_time = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            self._publish_counters()
+            if self.report:
+                now, count = time.monotonic(), self.published
+                rate = (count - last_count) / (now - last_time)
+                print(f"📡 {rate:10,.0f} msgs/s | {self.readings:,} readings | {count:,} messages")
+                last_count, last_time = count, now
+
+
+def _worker(slot, device_ids, transport_options, runner_options, counters):
+    runner = FleetRunner(device_ids, make_transport_factory(**transport_options),
+                         name=f"fleet{slot}", report=False, **runner_options)
+    runner.counters = (counters, slot)
+    try:
+        asyncio.run(runner.run())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_processes(device_ids, processes, transport_options, runner_options):
+    """Split the fleet over several processes and print the aggregate publish rate"""
+    counters = multiprocessing.Array("q", processes, lock=False)
+    chunks = [device_ids[i::processes] for i in range(processes)]
+    seed = runner_options.get("seed")
+    # One seed per worker: the same seed everywhere would make every process publish the same values
+    workers = [multiprocessing.Process(target=_worker, daemon=True,
+                                       args=(slot, chunk, transport_options,
+                                             dict(runner_options, seed=None if seed is None else seed + slot),
+                                             counters))
+               for slot, chunk in enumerate(chunks) if chunk]
+    for worker in workers:
+        worker.start()
+
+    started = time.monotonic()
+    last_count, last_time = 0, started
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1.0)
+            now, count = time.monotonic(), sum(counters)
+            print(f"📡 {(count - last_count) / (now - last_time):10,.0f} msgs/s "
+                  f"| {count:,} messages | {len(workers)} processes")
+            last_count, last_time = count, now
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    for worker in workers:
+        worker.join()
+    return sum(counters), time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of air quality monitors")
+    devices = parser.add_mutually_exclusive_group()
+    devices.add_argument("--devices", type=int, default=100, help="Number of simulated devices")
+    devices.add_argument("--device-ids", help="Comma-separated device ids")
+    parser.add_argument("--profile", default="mqtt", choices=sorted(PROFILES))
+    parser.add_argument("--interval", type=float, default=3.0, help="Seconds between readings per device")
+    parser.add_argument("--connections", type=int, default=4, help="MQTT connections per process")
+    parser.add_argument("--processes", type=int, default=1, help="Event loops (one per process)")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    parser.add_argument("--cycles", type=int, help="Readings per device before stopping")
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1])
+    parser.add_argument("--payload", default="per-topic", choices=PAYLOAD_FORMATS,
+                        help="per-topic layout, or one packed json/binary message per reading")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="Unacked QoS 1 messages per connection")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--fake", action="store_true", help="Use an in-process fake transport (no broker)")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible data")
+    parser.add_argument("--timestamp-ms", action="store_true",
+                        help="Stamp readings with the epoch-ms publish time (for latency measurement)")
+    parser.add_argument("--stats-json", help="Write publish statistics to this file on exit")
+    args = parser.parse_args()
+
+    if args.device_ids:
+        device_ids = [device_id.strip() for device_id in args.device_ids.split(",") if device_id.strip()]
+    else:
+        device_ids = [f"air_monitor_{i:03d}" for i in range(1, args.devices + 1)]
+
+    transport_options = dict(broker=args.broker, port=args.port, fake=args.fake,
+                             username=args.username, password=args.password,
+                             max_inflight=args.max_inflight)
+    runner_options = dict(profile=args.profile, interval=args.interval,
+                          connections=args.connections, qos=args.qos,
+                          duration=args.duration, cycles=args.cycles, seed=args.seed,
+                          payload_format=args.payload, precise_timestamps=args.timestamp_ms)
+
+    print(f"🚀 STARTING FLEET SIMULATION: {len(device_ids)} devices, profile {args.profile}")
+    print(f"⏱️ Interval {args.interval}s | {args.connections} connections x {args.processes} processes")
+    print(f"📡 Target: {'fake transport' if args.fake else f'{args.broker}:{args.port}'}")
+
+    if args.processes > 1:
+        published, elapsed = run_processes(device_ids, args.processes, transport_options, runner_options)
+    else:
+        runner = FleetRunner(device_ids, make_transport_factory(**transport_options), **runner_options)
+        try:
+            asyncio.run(runner.run())
+        except KeyboardInterrupt:
+            print("\n⚠️  User interrupted program (Ctrl+C)")
+        published, elapsed = runner.published, runner.elapsed
+
+    rate = published / elapsed if elapsed else 0.0
+    print(f"✅ Fleet stopped: {published:,} messages in {elapsed:.1f}s ({rate:,.0f} msgs/s)")
+    if args.stats_json:
+        with open(args.stats_json, "w", encoding="utf-8") as file:
+            json.dump({"devices": len(device_ids), "published": published,
+                       "elapsed": elapsed, "msgs_per_sec": rate}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
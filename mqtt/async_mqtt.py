@@ -0,0 +1,164 @@
+"""
+Minimal asyncio MQTT 3.1.1 publisher
+Just enough of the protocol (CONNECT, PUBLISH QoS 0/1, PUBACK, PINGREQ,
+DISCONNECT) to drive thousands of simulated devices over a handful of
+connections from one event loop, plus an in-process fake transport
+"""
+
+import asyncio
+import struct
+
+
+def encode_remaining_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack("!H", len(value)) + value
+
+
+def packet(header, body=b""):
+    return bytes((header,)) + encode_remaining_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """Read one control packet; returns (header byte, body bytes)"""
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b""
+    return header, body
+
+
+class MQTTError(Exception):
+    pass
+
+
+class AsyncMQTTClient:
+    def __init__(self, host="localhost", port=1883, client_id="", username=None,
+                 password=None, keepalive=60, max_inflight=1000):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.published = 0
+        self.acked = 0
+        self._window = asyncio.Semaphore(max_inflight)  # QoS 1 messages awaiting PUBACK
+        self._inflight = {}
+        self._next_id = 0
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        flags = 0x02  # Clean session
+        payload = encode_string(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += encode_string(self.username)
+            if self.password is not None:
+                flags |= 0x40
+                payload += encode_string(self.password)
+        variable = encode_string("MQTT") + struct.pack("!BBH", 4, flags, self.keepalive)
+        self._writer.write(packet(0x10, variable + payload))
+        await self._writer.drain()
+
+        header, body = await read_packet(self._reader)
+        if header >> 4 != 2 or len(body) < 2 or body[1] != 0:
+            raise MQTTError(f"Connection refused by {self.host}:{self.port} (CONNACK {body.hex()})")
+        self._tasks = [asyncio.create_task(self._read_loop()),
+                       asyncio.create_task(self._ping_loop())]
+        return self
+
+    async def publish(self, topic, payload, qos=1):
+        """Queue one PUBLISH; with QoS 1 waits only for a free in-flight slot"""
+        if qos:
+            await self._window.acquire()
+            self._next_id = self._next_id % 65535 + 1
+            packet_id = self._next_id
+            self._inflight[packet_id] = True
+            body = encode_string(topic) + struct.pack("!H", packet_id) + payload
+            self._writer.write(packet(0x32, body))
+        else:
+            self._writer.write(packet(0x30, encode_string(topic) + payload))
+        self.published += 1
+        await self._writer.drain()
+
+    async def wait_acked(self, timeout=10.0):
+        """Wait until every QoS 1 message has been acknowledged"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._inflight and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        return not self._inflight
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._writer is not None:
+            try:
+                self._writer.write(packet(0xE0))
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+            self._writer.close()
+
+    async def _read_loop(self):
+        while True:
+            header, body = await read_packet(self._reader)
+            if header >> 4 == 4:  # PUBACK
+                packet_id = struct.unpack("!H", body[:2])[0]
+                if self._inflight.pop(packet_id, None):
+                    self.acked += 1
+                    self._window.release()
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self._writer.write(packet(0xC0))
+            await self._writer.drain()
+
+
+class FakeTransport:
+    """In-process stand-in for AsyncMQTTClient: counts what would be sent"""
+
+    def __init__(self, client_id="", on_publish=None, **kwargs):
+        self.client_id = client_id
+        self.on_publish = on_publish  # Optional callback(topic, payload, qos)
+        self.published = 0
+        self.acked = 0
+        self.bytes = 0
+
+    async def connect(self):
+        return self
+
+    async def publish(self, topic, payload, qos=1):
+        self.published += 1
+        self.acked += 1 if qos else 0
+        self.bytes += len(topic) + len(payload)
+        if self.on_publish is not None:
+            self.on_publish(topic, payload, qos)
+
+    async def wait_acked(self, timeout=10.0):
+        return True
+
+    async def close(self):
+        pass
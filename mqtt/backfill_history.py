@@ -0,0 +1,162 @@
+"""
+Historical backfill generator
+Streams vectorized readings (common/sensor_batch.py) for N devices x T
+timesteps straight into the typed SQLite store, an NDJSON file or a
+directory of per-column .npy files, one bounded chunk at a time
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from common.ndjson import format_record
+from common.sensor_batch import COLUMNS, ROWS_PER_CHUNK, iter_batches
+from mqtt.telemetry_store import ReadingStore
+
+NPY_DTYPES = {"device": np.int32, "ts": np.int64, "pm25": np.float32, "pm10": np.float32,
+              "co2": np.int16, "temperature": np.float32, "humidity": np.float32,
+              "relay": np.uint8, "status": np.uint8}
+
+
+def device_name(index):
+    # Same naming as the fleet runner
+    return f"air_monitor_{index + 1:03d}"
+
+
+def _columns(batch):
+    """Flatten a (devices, steps) batch in time-major order"""
+    return {name: np.ascontiguousarray(batch[name].T).ravel() for name in COLUMNS}
+
+
+def _decimal(values):
+    # float32 -> the shortest 0.1-step Python float (19.6, not 19.600000381)
+    return np.round(values.astype(np.float64), 1).tolist()
+
+
+class SQLiteSink:
+    def __init__(self, path, n_devices):
+        self.store = ReadingStore(path).open()
+        self.device_ids = np.array([self.store.device_id(device_name(i)) for i in range(n_devices)])
+        self.store.commit()
+
+    def write(self, columns):
+        self.store.write_ids(zip(
+            self.device_ids[columns["device"]].tolist(),
+            columns["ts"].tolist(),
+            _decimal(columns["pm25"]),
+            _decimal(columns["pm10"]),
+            columns["co2"].tolist(),
+            _decimal(columns["temperature"]),
+            _decimal(columns["humidity"]),
+            columns["relay"].tolist(),
+            columns["status"].tolist(),
+        ))
+        self.store.commit()
+
+    def close(self):
+        self.store.close()
+
+
+class NDJSONSink:
+    # One common/ndjson.py record per line, as air_quality_ndjson.py imports them
+
+    def __init__(self, path, n_devices):
+        self.file = open(path, "w", encoding="utf-8", buffering=1 << 20)
+        self.names = [device_name(i) for i in range(n_devices)]
+
+    def write(self, columns):
+        names = self.names
+        self.file.writelines(map(format_record, zip(
+            [names[device] for device in columns["device"].tolist()],
+            columns["ts"].tolist(),
+            _decimal(columns["pm25"]),
+            _decimal(columns["pm10"]),
+            columns["co2"].tolist(),
+            _decimal(columns["temperature"]),
+            _decimal(columns["humidity"]),
+            columns["relay"].tolist(),
+            columns["status"].tolist(),
+        )))
+
+    def close(self):
+        self.file.close()
+
+
+class NpySink:
+    """One preallocated .npy file per column, filled chunk by chunk"""
+
+    def __init__(self, path, total_rows):
+        os.makedirs(path, exist_ok=True)
+        self.arrays = {name: open_memmap(os.path.join(path, f"{name}.npy"), mode="w+",
+                                         dtype=NPY_DTYPES[name], shape=(total_rows,))
+                       for name in COLUMNS}
+        self.offset = 0
+
+    def write(self, columns):
+        rows = len(columns["ts"])
+        for name, array in self.arrays.items():
+            array[self.offset:self.offset + rows] = columns[name]
+        self.offset += rows
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+
+
+def backfill(sink, n_devices, n_steps, start_ts=None, step=60, profile="mqtt", seed=None,
+             rows_per_chunk=ROWS_PER_CHUNK, progress=True):
+    started = time.perf_counter()
+    total = 0
+    for batch in iter_batches(n_devices, n_steps, start_ts, step, profile, seed, rows_per_chunk):
+        columns = _columns(batch)
+        sink.write(columns)
+        total += len(columns["ts"])
+        if progress:
+            elapsed = time.perf_counter() - started
+            print(f"   📦 {total:,}/{n_devices * n_steps:,} rows ({total / elapsed:,.0f} rows/s)")
+    sink.close()
+    return total, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate historical air quality readings in bulk")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--steps", type=int, help="Timesteps per device")
+    parser.add_argument("--days", type=float, default=1.0, help="History length when --steps is not given")
+    parser.add_argument("--step", type=int, default=60, help="Seconds between readings")
+    parser.add_argument("--start", help="First timestamp (ISO date/time or epoch seconds); default ends now")
+    parser.add_argument("--profile", default="mqtt", choices=["mqtt", "rightech"])
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible output")
+    parser.add_argument("--format", default="sqlite", choices=["sqlite", "ndjson", "npy"])
+    parser.add_argument("--output", default="air_quality.db",
+                        help="SQLite file, NDJSON file or .npy output directory")
+    parser.add_argument("--chunk-rows", type=int, default=ROWS_PER_CHUNK)
+    args = parser.parse_args()
+
+    n_steps = args.steps or int(args.days * 86400 // args.step)
+    start_ts = None
+    if args.start:
+        start_ts = int(args.start) if args.start.isdigit() else int(datetime.fromisoformat(args.start).timestamp())
+
+    if args.format == "sqlite":
+        sink = SQLiteSink(args.output, args.devices)
+    elif args.format == "ndjson":
+        sink = NDJSONSink(args.output, args.devices)
+    else:
+        sink = NpySink(args.output, args.devices * n_steps)
+
+    print(f"🚀 Backfilling {args.devices} devices x {n_steps:,} steps ({args.step}s) -> {args.output}")
+    total, elapsed = backfill(sink, args.devices, n_steps, start_ts, args.step, args.profile,
+                              args.seed, args.chunk_rows)
+    print(f"✅ {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""
+Memory-mapped columnar archive of closed telemetry ranges
+A compaction job copies closed time ranges (whole days or weeks) out of
+the typed store, or the sealed partitions of a partitioned store, into
+segment directories of fixed-width column files:
+
+    archive/manifest.json                 devices, segments, per-device row ranges
+    archive/segment_20240501T000000/ts.i8 device.u4 pm25.f4 ... relay.i1 status.i1
+
+Rows in a segment are ordered by (device, ts), so one device is a
+contiguous slice and a time range inside it is found with searchsorted.
+Readings that arrive after their period was archived are found by
+re-counting recent archived periods (and partitions reopened for late
+data); such a period's segment is rebuilt. Re-counting is skipped where
+nothing can have changed: a database device whose row count over the
+window still matches the manifest, a partition file whose size and mtime
+are those recorded when it was last counted.
+ColumnArchive opens the files with numpy.memmap and hands out array
+views, so full-history scans run at memory/page-cache speed instead of
+stepping through SQLite rows. Missing metrics are NaN, a missing
+relay/status is -1 (as in common/readings.ReadingBatch).
+
+    python mqtt/columnar_archive.py compact air_quality.db
+    python mqtt/columnar_archive.py compact air_quality_parts --every 600
+    python mqtt/columnar_archive.py summary --metrics pm25,co2 --start 2024-05-01
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from mqtt.partitioned_store import CATALOG_NAME, PERIODS, list_partitions, partition_start
+from mqtt.telemetry_query import parse_time
+from mqtt.telemetry_store import METRICS
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+# Column -> file dtype; the dtype code is also the file extension
+COLUMN_DTYPES = {"ts": "<i8", "device": "<u4", "pm25": "<f4", "pm10": "<f4", "co2": "<f4",
+                 "temperature": "<f4", "humidity": "<f4", "relay": "i1", "status": "i1"}
+ARCHIVE_METRICS = METRICS + ("relay", "status")
+FLUSH_ROWS = 262_144  # Rows buffered in memory before they are appended to the column files
+GRACE_MS = 3_600_000  # Late readings accepted this long after a period ends before it counts as closed
+# Archived periods before the watermark re-counted for late rows; None re-counts all of them, 0 none
+RECHECK_PERIODS = 7
+
+_READINGS_SQL = ("SELECT ts, pm25, pm10, co2, temperature, humidity, coalesce(relay, -1), coalesce(status, -1) "
+                 "FROM readings WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts")
+_COUNT_SQL = "SELECT count(*) FROM readings WHERE device_id = ? AND ts >= ? AND ts < ?"
+
+
+def column_filename(column):
+    return f"{column}.{COLUMN_DTYPES[column].lstrip('<')}"
+
+
+def segment_name(start):
+    return "segment_" + time.strftime("%Y%m%dT%H%M%S", time.gmtime(start / 1000))
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class ArchiveWriter:
+    """Appends segments to an archive directory and keeps its manifest"""
+
+    def __init__(self, directory, period="day"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"version": FORMAT_VERSION, "period": period, "watermark": None,
+                             "columns": COLUMN_DTYPES, "devices": [], "segments": [], "reopened": [],
+                             "stamps": {}}
+        self._device_index = {name: i for i, name in enumerate(self.manifest["devices"])}
+
+    @property
+    def period(self):
+        return self.manifest["period"]
+
+    @property
+    def watermark(self):
+        """End (epoch ms) of the newest archived range, None for an empty archive"""
+        return self.manifest["watermark"]
+
+    def _device(self, name):
+        index = self._device_index.get(name)
+        if index is None:
+            index = self._device_index[name] = len(self.manifest["devices"])
+            self.manifest["devices"].append(name)
+        return index
+
+    def segment(self, start):
+        """Manifest entry of the segment archived for the period starting at `start`, or None"""
+        return next((segment for segment in self.manifest["segments"] if segment["start"] == start), None)
+
+    def device_rows(self, low, high):
+        """{device name: rows archived} over the segments with low <= start < high"""
+        rows = {}
+        devices = self.manifest["devices"]
+        for segment in self.manifest["segments"]:
+            if low <= segment["start"] < high:
+                for archive_id, lo, hi in segment["index"]:
+                    rows[devices[archive_id]] = rows.get(devices[archive_id], 0) + hi - lo
+        return rows
+
+    def append_segment(self, conn, device_names, start, end):
+        """Copy readings with start <= ts < end from `conn` (device_id -> name map
+        `device_names`) into a new segment and advance the watermark to `end`;
+        returns the row count (0 writes no segment)"""
+        name = segment_name(start)
+        rows, index = self._write_segment(conn, device_names, start, end, name)
+        self.manifest["watermark"] = end
+        if rows:
+            self.manifest["segments"].append({"name": name, "start": start, "end": end,
+                                              "rows": rows, "index": index})
+            self.save()
+        return rows
+
+    def rebuild_segment(self, conn, device_names, start, end):
+        """Archive an already archived period again (late rows arrived), replacing its
+        segment under a new name; returns how many rows the period gained"""
+        old = self.segment(start)
+        revision = old.get("revision", 0) + 1 if old else 1
+        name = f"{segment_name(start)}_r{revision}"
+        rows, index = self._write_segment(conn, device_names, start, end, name)
+        if not rows:
+            return 0
+        entry = {"name": name, "start": start, "end": end, "rows": rows, "index": index, "revision": revision}
+        segments = [segment for segment in self.manifest["segments"] if segment is not old] + [entry]
+        self.manifest["segments"] = sorted(segments, key=lambda segment: segment["start"])
+        self.save()
+        if old:
+            # Mapped files stay readable for open readers after the unlink
+            shutil.rmtree(os.path.join(self.directory, old["name"]), ignore_errors=True)
+        return rows - (old["rows"] if old else 0)
+
+    def _write_segment(self, conn, device_names, start, end, name):
+        """Write the segment directory `name`; returns (rows, per-device index), no directory for 0 rows"""
+        final_path = os.path.join(self.directory, name)
+        tmp_path = final_path + ".tmp"
+        for path in (tmp_path, final_path):
+            shutil.rmtree(path, ignore_errors=True)  # Leftovers of an interrupted run
+        os.makedirs(tmp_path)
+
+        files = {column: open(os.path.join(tmp_path, column_filename(column)), "wb")
+                 for column in COLUMN_DTYPES}
+        index, pending, rows, flushed = [], [], 0, 0
+        try:
+            for device_id, device in sorted(device_names.items(), key=lambda item: item[1]):
+                readings = conn.execute(_READINGS_SQL, (device_id, start, end)).fetchall()
+                if not readings:
+                    continue
+                archive_id = self._device(device)
+                index.append([archive_id, rows, rows + len(readings)])
+                pending.append((archive_id, readings))
+                rows += len(readings)
+                if rows - flushed >= FLUSH_ROWS:
+                    self._flush(files, pending)
+                    flushed = rows
+            self._flush(files, pending)
+        finally:
+            for f in files.values():
+                f.close()
+
+        if rows == 0:
+            shutil.rmtree(tmp_path)
+        else:
+            os.rename(tmp_path, final_path)
+        return rows, index
+
+    def save(self):
+        """Write the manifest (readers only see segments listed in it)"""
+        _write_json(self.manifest_path, self.manifest)
+
+    @staticmethod
+    def _flush(files, pending):
+        if not pending:
+            return
+        readings = [reading for _, chunk in pending for reading in chunk]
+        files["device"].write(np.repeat(
+            np.array([archive_id for archive_id, _ in pending], dtype=COLUMN_DTYPES["device"]),
+            [len(chunk) for _, chunk in pending]).tobytes())
+        for column, values in zip(("ts",) + ARCHIVE_METRICS, zip(*readings)):
+            # None becomes NaN in the float columns
+            files[column].write(np.array(values, dtype=COLUMN_DTYPES[column]).tobytes())
+        pending.clear()
+
+
+def _closed_before(period, grace_ms, now_ms=None):
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return partition_start(now_ms - grace_ms, period)
+
+
+def _recheck_from(conn, writer, width, recheck):
+    """First period start to re-count: `recheck` periods before the watermark, None for none"""
+    if recheck == 0:
+        return None
+    if recheck is not None:
+        return writer.watermark - recheck * width
+    first = conn.execute("SELECT min(ts) FROM readings").fetchone()[0]
+    return None if first is None else partition_start(first, writer.period)
+
+
+def compact_store(db_path, directory, period="day", grace_ms=GRACE_MS, now_ms=None, recheck=RECHECK_PERIODS):
+    """Archive the closed periods of a typed SQLite store past the archive's
+    watermark, one segment per period, after rebuilding the segments of the
+    last `recheck` archived periods (None: all of them, 0: none) that gained
+    late rows; returns (segments, rows, late rows).
+
+    Late rows are looked for with one count per device over the whole
+    window, compared with the manifest; only a device whose count changed
+    is counted period by period.
+    """
+    writer = ArchiveWriter(directory, period)
+    period = writer.period
+    width = PERIODS[period][0]
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    segments = rows = late = 0
+    try:
+        device_names = dict(conn.execute("SELECT device_id, name FROM devices"))
+        closed = _closed_before(period, grace_ms, now_ms)
+        low = writer.watermark
+        if low is None:
+            first = conn.execute("SELECT min(ts) FROM readings").fetchone()[0]
+            if first is None:
+                return 0, 0, 0
+            low = partition_start(first, period)
+        else:
+            first = _recheck_from(conn, writer, width, recheck)
+            if first is not None and first < writer.watermark:
+                archived = writer.device_rows(first, writer.watermark)
+                changed = set()
+                for device_id, name in device_names.items():
+                    # Counts walk the (device_id, ts) key instead of scanning the table
+                    if conn.execute(_COUNT_SQL, (device_id, first, writer.watermark)).fetchone()[0] \
+                            != archived.get(name, 0):
+                        changed.add(device_id)
+                for start in range(first, writer.watermark, width) if changed else ():
+                    segment = writer.segment(start)
+                    ranges = {} if segment is None else {
+                        writer.manifest["devices"][archive_id]: hi - lo for archive_id, lo, hi in segment["index"]}
+                    if any(conn.execute(_COUNT_SQL, (device_id, start, start + width)).fetchone()[0]
+                           > ranges.get(device_names[device_id], 0) for device_id in changed):
+                        late += writer.rebuild_segment(conn, device_names, start, start + width)
+        while low < closed:
+            added = writer.append_segment(conn, device_names, low, low + width)
+            segments += added > 0
+            rows += added
+            low += width
+    finally:
+        conn.close()
+        writer.save()
+    return segments, rows, late
+
+
+def _file_stamp(path):
+    """[size, mtime_ns] of a database file and of its WAL (None if it has no frames:
+    a read-only connection leaves an empty one behind)"""
+    stamp = []
+    for file_path in (path, path + "-wal"):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            stamp.append(None)
+            continue
+        stamp.append([stat.st_size, stat.st_mtime_ns] if stat.st_size else None)
+    return stamp
+
+
+def compact_partitions(directory, archive_directory, recheck=RECHECK_PERIODS):
+    """Archive sealed (or compacted) partitions past the archive's watermark,
+    oldest first, stopping at the first partition still open. Archived
+    partitions that were reopened for late data, and the last `recheck`
+    (None: all of them, 0: none), are re-counted once closed and rebuilt if
+    they gained rows; a file unchanged since it was last counted is not
+    opened. Returns (segments, rows, late rows)"""
+    catalog = sqlite3.connect(f"file:{os.path.join(directory, CATALOG_NAME)}?mode=ro", uri=True)
+    try:
+        period = catalog.execute("SELECT value FROM meta WHERE key = 'period'").fetchone()[0]
+        device_names = dict(catalog.execute("SELECT device_id, name FROM devices"))
+        partitions = list_partitions(catalog)
+    finally:
+        catalog.close()
+
+    writer = ArchiveWriter(archive_directory, period)
+    if writer.period != period:
+        raise ValueError(f"{archive_directory} archives {writer.period} ranges, {directory} is partitioned by {period}")
+    segments = rows = late = 0
+    reopened = set(writer.manifest.setdefault("reopened", []))
+    stamps = writer.manifest.setdefault("stamps", {})  # Period start -> _file_stamp() when last counted
+    for start, end, path, state in partitions:
+        full_path = os.path.join(directory, path)
+        if writer.watermark is not None and start < writer.watermark:
+            if state == "open":
+                reopened.add(start)  # Late data is being written; re-counted once sealed again
+            elif start in reopened or recheck is None or start >= writer.watermark - recheck * (end - start):
+                stamp = _file_stamp(full_path)
+                if stamps.get(str(start)) != stamp or start in reopened:
+                    conn = sqlite3.connect(f"file:{full_path}?mode=ro", uri=True)
+                    try:
+                        count = conn.execute("SELECT count(*) FROM readings").fetchone()[0]
+                        segment = writer.segment(start)
+                        if count > (segment["rows"] if segment else 0):
+                            late += writer.rebuild_segment(conn, device_names, start, end)
+                    finally:
+                        conn.close()
+                    stamps[str(start)] = stamp
+                reopened.discard(start)
+            continue
+        if state == "open":
+            break  # Keep the watermark monotonic
+        stamp = _file_stamp(full_path)  # Taken first: a write during the copy changes it
+        conn = sqlite3.connect(f"file:{full_path}?mode=ro", uri=True)
+        try:
+            added = writer.append_segment(conn, device_names, start, end)
+        finally:
+            conn.close()
+        stamps[str(start)] = stamp
+        segments += added > 0
+        rows += added
+    writer.manifest["reopened"] = sorted(reopened)
+    writer.save()
+    return segments, rows, late
+
+
+def compact(source, directory, period="day", grace_ms=GRACE_MS, recheck=RECHECK_PERIODS):
+    """compact_partitions() for a partition directory, compact_store() for a database file"""
+    if os.path.isdir(source):
+        return compact_partitions(source, directory, recheck)
+    return compact_store(source, directory, period, grace_ms, recheck=recheck)
+
+
+def _report_late(late):
+    if late:
+        print(f"⚠️ {late:,} late row(s) arrived in already archived periods; their segments were rebuilt")
+
+
+class ArchiveCompactor:
+    """Background thread that archives newly closed ranges every `interval` seconds"""
+
+    def __init__(self, source, directory, interval=600.0, period="day", grace_ms=GRACE_MS,
+                 recheck=RECHECK_PERIODS):
+        self.source = source
+        self.directory = directory
+        self.interval = interval
+        self.period = period
+        self.grace_ms = grace_ms
+        self.recheck = recheck
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="archive-compactor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                _report_late(compact(self.source, self.directory, self.period, self.grace_ms, self.recheck)[2])
+            except Exception as e:
+                print(f"Archive compaction failed: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+
+class ColumnArchive:
+    """Read side: array views over the memory-mapped segments"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported archive version {self.manifest['version']}")
+        self.devices = self.manifest["devices"]
+        self._device_index = {name: i for i, name in enumerate(self.devices)}
+        self.segments = self.manifest["segments"]
+        for segment in self.segments:
+            segment["ranges"] = {device: (lo, hi) for device, lo, hi in segment["index"]}
+        self._maps = {}
+
+    @property
+    def rows(self):
+        return sum(segment["rows"] for segment in self.segments)
+
+    def device_index(self, device):
+        if isinstance(device, int):
+            return device
+        index = self._device_index.get(device)
+        if index is None:
+            raise KeyError(f"Unknown device: {device}")
+        return index
+
+    def column(self, segment, column):
+        """Whole column of one segment as a read-only memmap (opened once)"""
+        key = (segment["name"], column)
+        array = self._maps.get(key)
+        if array is None:
+            path = os.path.join(self.directory, segment["name"], column_filename(column))
+            array = self._maps[key] = np.memmap(path, dtype=COLUMN_DTYPES[column], mode="r",
+                                                shape=(segment["rows"],))
+        return array
+
+    def chunks(self, metrics=METRICS, device=None, start=None, end=None):
+        """Yield {"ts", "device", *metrics: array} per segment for start <= ts < end.
+
+        Device queries and segments wholly inside the range are views into
+        the mapped files; an all-device scan of a segment cut by the range
+        is filtered with a mask, which copies.
+        """
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        unknown = set(metrics) - set(ARCHIVE_METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+        low, high = parse_time(start), parse_time(end)
+        low = -2 ** 62 if low is None else low
+        high = 2 ** 62 if high is None else high
+        device = None if device is None else self.device_index(device)
+        columns = ["ts", "device"] + metrics
+
+        for segment in self.segments:
+            if segment["end"] <= low or segment["start"] >= high:
+                continue
+            inside = low <= segment["start"] and segment["end"] <= high
+            if device is not None:
+                if device not in segment["ranges"]:
+                    continue
+                lo, hi = segment["ranges"][device]
+                if not inside:
+                    ts = self.column(segment, "ts")[lo:hi]
+                    lo, hi = lo + ts.searchsorted(low), lo + ts.searchsorted(high)
+                if lo < hi:
+                    yield {column: self.column(segment, column)[lo:hi] for column in columns}
+            elif inside:
+                yield {column: self.column(segment, column) for column in columns}
+            else:
+                ts = self.column(segment, "ts")
+                mask = (ts >= low) & (ts < high)
+                if mask.any():
+                    yield {column: self.column(segment, column)[mask] for column in columns}
+
+    def read(self, metrics=METRICS, device=None, start=None, end=None):
+        """chunks() concatenated into one array per column"""
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        parts = list(self.chunks(metrics, device, start, end))
+        return {column: np.concatenate([part[column] for part in parts]) if parts
+                else np.empty(0, COLUMN_DTYPES[column]) for column in ["ts", "device"] + metrics}
+
+    def summary(self, metrics=METRICS, device=None, start=None, end=None):
+        """{metric: {"count", "avg", "min", "max"}} in one pass over the columns"""
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        totals = {metric: [0, 0.0, None, None] for metric in metrics}
+        for chunk in self.chunks(metrics, device, start, end):
+            for metric in metrics:
+                values = _present(chunk[metric])
+                if not len(values):
+                    continue
+                total = totals[metric]
+                total[0] += len(values)
+                total[1] += float(values.sum(dtype=np.float64))
+                lo, hi = float(values.min()), float(values.max())
+                total[2] = lo if total[2] is None else min(total[2], lo)
+                total[3] = hi if total[3] is None else max(total[3], hi)
+        return {metric: {"count": n, "avg": s / n if n else None, "min": lo, "max": hi}
+                for metric, (n, s, lo, hi) in totals.items()}
+
+    def device_averages(self, metric, start=None, end=None):
+        """{device: avg(metric)} over every device, grouped with bincount"""
+        sums = np.zeros(len(self.devices))
+        counts = np.zeros(len(self.devices))
+        for chunk in self.chunks([metric], None, start, end):
+            values = chunk[metric]
+            present = values >= 0 if values.dtype.kind == "i" else ~np.isnan(values)
+            devices = chunk["device"][present]
+            sums += np.bincount(devices, weights=values[present], minlength=len(self.devices))
+            counts += np.bincount(devices, minlength=len(self.devices))
+        return {self.devices[i]: sums[i] / counts[i] for i in np.flatnonzero(counts)}
+
+    def correlation(self, metrics, device=None, start=None, end=None):
+        """Pearson correlation matrix over rows where every metric is present; (matrix, rows)"""
+        k = len(metrics)
+        n, sums, products = 0, np.zeros(k), np.zeros((k, k))
+        for chunk in self.chunks(metrics, device, start, end):
+            matrix = np.column_stack([chunk[metric].astype(np.float64) for metric in metrics])
+            present = np.ones(len(matrix), dtype=bool)
+            for j, metric in enumerate(metrics):
+                present &= matrix[:, j] >= 0 if chunk[metric].dtype.kind == "i" else ~np.isnan(matrix[:, j])
+            matrix = matrix[present]
+            n += len(matrix)
+            sums += matrix.sum(axis=0)
+            products += matrix.T @ matrix
+        if n < 2:
+            return np.full((k, k), np.nan), n
+        covariance = products / n - np.outer(sums / n, sums / n)
+        deviation = np.sqrt(np.diag(covariance))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return covariance / np.outer(deviation, deviation), n
+
+
+def _present(values):
+    """Values without the missing markers (NaN, or -1 for relay/status)"""
+    if values.dtype.kind == "i":
+        return values[values >= 0]
+    return values[~np.isnan(values)]
+
+
+def _format_ts(ts):
+    return "-" if ts is None else time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(ts / 1000))
+
+
+def _recheck_periods(text):
+    """--recheck-periods value: a count of periods, or "all" (None)"""
+    if text == "all":
+        return None
+    periods = int(text)
+    if periods < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, or \"all\": {text}")
+    return periods
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar archive of closed telemetry ranges")
+    parser.add_argument("command", choices=["compact", "info", "summary", "devices", "correlate"])
+    parser.add_argument("source", nargs="?", default="air_quality.db",
+                        help="compact: typed database or partition directory")
+    parser.add_argument("--archive", default="air_quality_archive")
+    parser.add_argument("--period", default="day", choices=sorted(PERIODS),
+                        help="compact: range per segment for a new archive of a database")
+    parser.add_argument("--grace-minutes", type=float, default=GRACE_MS / 60_000,
+                        help="compact: wait this long after a range ends before archiving it")
+    parser.add_argument("--every", type=float, help="compact: repeat every N seconds until Ctrl+C")
+    parser.add_argument("--recheck-periods", type=_recheck_periods, default=RECHECK_PERIODS,
+                        help="compact: re-count this many archived periods for late rows "
+                             "(\"all\": every one, 0: none)")
+    parser.add_argument("--metrics", default=",".join(METRICS))
+    parser.add_argument("--device")
+    parser.add_argument("--start", help="ISO date/time or epoch seconds")
+    parser.add_argument("--end")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        while True:
+            started = time.perf_counter()
+            segments, rows, late = compact(args.source, args.archive, args.period,
+                                           int(args.grace_minutes * 60_000), args.recheck_periods)
+            print(f"🗄️ Archived {rows:,} rows into {segments} segment(s) "
+                  f"in {time.perf_counter() - started:.1f}s -> {args.archive}")
+            _report_late(late)
+            if args.every is None:
+                break
+            try:
+                time.sleep(args.every)
+            except KeyboardInterrupt:
+                break
+        return
+
+    archive = ColumnArchive(args.archive)
+    metrics = args.metrics.split(",")
+    if args.command == "info":
+        watermark = archive.manifest["watermark"]
+        print(f"📂 {args.archive}: {archive.rows:,} rows, {len(archive.devices)} devices, "
+              f"{archive.manifest['period']} segments, archived up to {_format_ts(watermark)}")
+        for segment in archive.segments:
+            size = sum(os.path.getsize(os.path.join(args.archive, segment["name"], column_filename(column)))
+                       for column in COLUMN_DTYPES)
+            print(f"   {segment['name']:<26} {segment['rows']:>12,} rows {size / 1e6:10.1f} MB")
+        return
+
+    started = time.perf_counter()
+    if args.command == "summary":
+        result = archive.summary(metrics, args.device, args.start, args.end)
+        for metric, values in result.items():
+            print(f"   {metric:<12} " + "  ".join(
+                f"{key}={round(value, 3) if isinstance(value, float) else value}" for key, value in values.items()))
+    elif args.command == "devices":
+        for metric in metrics:
+            for device, average in sorted(archive.device_averages(metric, args.start, args.end).items()):
+                print(f"   {metric:<12} {device:<24} {average:.2f}")
+    else:
+        matrix, rows = archive.correlation(metrics, args.device, args.start, args.end)
+        print(f"   {'':<12}" + "".join(f"{metric:>12}" for metric in metrics))
+        for metric, line in zip(metrics, matrix):
+            print(f"   {metric:<12}" + "".join(f"{value:12.3f}" for value in line))
+        print(f"   ({rows:,} complete rows)")
+    print(f"⏱️ {time.perf_counter() - started:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
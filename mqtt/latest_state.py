@@ -0,0 +1,203 @@
+"""
+In-memory latest state of every device, served over local HTTP or a Unix socket
+The subscriber updates it from the message path; dashboards read it
+without touching SQLite:
+
+    GET /state              every device's latest values
+    GET /state?since=V      only devices updated after version V
+    GET /state/<device>     one device, with its recent samples
+
+Every update bumps a global version. Devices are kept in update order, so
+a "since" delta walks only the devices that changed. Each device's JSON
+fragment is cached until it changes, and the full response is rebuilt at
+most every max_age seconds (its "version" says how fresh it is; "since"
+deltas are always exact), so polls of 10k devices stay well under a
+millisecond however fast readings arrive.
+
+    curl localhost:8765/state?since=1200
+    curl --unix-socket /tmp/air_quality.sock http://x/state/air_monitor_001
+"""
+
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from common.sensor_model import STATUS_NAMES
+from mqtt.telemetry_store import METRICS
+
+STATE_FIELDS = METRICS + ("relay",)
+HISTORY = 32  # Recent samples kept per device
+MAX_AGE = 0.1  # Seconds an all-devices response may be reused after updates
+
+
+class DeviceState:
+    __slots__ = ("name", "version", "ts", "values", "status", "history", "fragment")
+
+    def __init__(self, name, history):
+        self.name = name
+        self.version = 0
+        self.ts = None
+        self.values = dict.fromkeys(STATE_FIELDS)
+        self.status = None
+        self.history = deque(maxlen=history)  # (ts, pm25, pm10, co2, temperature, humidity, relay)
+        self.fragment = None  # Cached '"name": {...}' bytes, None once stale
+
+    def as_dict(self, history=False):
+        state = {"version": self.version, "ts": self.ts, "status": STATUS_NAMES.get(self.status),
+                 "values": dict(self.values)}
+        if history:
+            state["history"] = [dict(zip(("ts",) + STATE_FIELDS, sample)) for sample in self.history]
+        return state
+
+
+class LatestState:
+    def __init__(self, history=HISTORY, max_age=MAX_AGE):
+        self.history = history
+        self.max_age = max_age
+        self.version = 0
+        self.devices = OrderedDict()  # name -> DeviceState, least recently updated first
+        self.updates = 0
+        self._lock = threading.Lock()
+        self._snapshot = (-1, 0.0, b"")  # (version, monotonic build time, all-devices body)
+
+    def _touch(self, device):
+        state = self.devices.get(device)
+        if state is None:
+            state = self.devices[device] = DeviceState(device, self.history)
+        else:
+            self.devices.move_to_end(device)
+        self.version += 1
+        self.updates += 1
+        state.version = self.version
+        state.fragment = None
+        return state
+
+    def record(self, row):
+        """A complete typed row: (device, ts, pm25, pm10, co2, temperature, humidity, relay, status)"""
+        with self._lock:
+            state = self._touch(row[0])
+            values = state.values
+            for field, value in zip(STATE_FIELDS, row[2:8]):
+                if value is not None:
+                    values[field] = value
+            if row[1] is not None:
+                state.ts = row[1]
+            if row[8] is not None:
+                state.status = row[8]
+            state.history.append(row[1:8])
+
+    def get(self, device):
+        with self._lock:
+            state = self.devices.get(device)
+            return None if state is None else state.as_dict(history=True)
+
+    def _fragment(self, state):
+        if state.fragment is None:
+            state.fragment = f"{json.dumps(state.name)}: {json.dumps(state.as_dict())}".encode()
+        return state.fragment
+
+    def all_json(self):
+        """{"version": V, "devices": {...}} for every device, at most max_age seconds old"""
+        with self._lock:
+            version, built, body = self._snapshot
+            now = time.monotonic()
+            if version != self.version and now - built >= self.max_age:
+                fragments = b", ".join(self._fragment(state) for state in self.devices.values())
+                body = b'{"version": %d, "devices": {%s}}' % (self.version, fragments)
+                self._snapshot = (self.version, now, body)
+            return body
+
+    def since_json(self, version):
+        """Same shape as all_json(), limited to devices updated after version"""
+        with self._lock:
+            changed = []
+            for state in reversed(self.devices.values()):
+                if state.version <= version:
+                    break
+                changed.append(self._fragment(state))
+            return b'{"version": %d, "devices": {%s}}' % (self.version, b", ".join(reversed(changed)))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state = None  # Set on the per-server subclass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/state":
+            since = parse_qs(url.query).get("since")
+            try:
+                body = self.state.all_json() if since is None else self.state.since_json(int(since[0]))
+            except ValueError:
+                return self._reply(400, b'{"error": "since must be an integer version"}')
+            return self._reply(200, body)
+        if url.path.startswith("/state/"):
+            device = self.state.get(unquote(url.path[len("/state/"):]))
+            if device is None:
+                return self._reply(404, b'{"error": "unknown device"}')
+            return self._reply(200, json.dumps(device).encode())
+        self._reply(404, b'{"error": "not found"}')
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass  # Dashboards poll constantly
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+class StateServer:
+    """Serves a LatestState on a TCP port (host, port) or a Unix socket path"""
+
+    def __init__(self, state, host="127.0.0.1", port=None, socket_path=None):
+        if (port is None) == (socket_path is None):
+            raise ValueError("Give exactly one of port and socket_path")
+        self.state = state
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"unix:{self.socket_path}" if self.socket_path else f"http://{self.host}:{self.port}"
+
+    def start(self):
+        handler = type("StateHandler", (_Handler,), {"state": self.state})
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)  # Left over from a previous run
+            self._server = _UnixHTTPServer(self.socket_path, handler)
+        else:
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="state-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
@@ -0,0 +1,83 @@
+"""
+Migrate an air_quality.db from the raw (topic, value, received_at) layout
+to the typed one-row-per-reading layout used by `--schema typed`
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import sqlite3
+from datetime import datetime
+
+from mqtt.reading_assembler import ReadingAssembler
+from mqtt.telemetry_store import ReadingStore
+
+BATCH_SIZE = 5000
+
+
+def migrate(source_path, dest_path, default_device="air_monitor_001", batch_size=BATCH_SIZE):
+    """Stream raw rows through the assembler into a ReadingStore; returns the assembler"""
+    store = ReadingStore(dest_path).open()
+    batch = []
+
+    def emit(row):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            store.write(batch)
+            batch.clear()
+
+    assembler = ReadingAssembler(emit, default_device=default_device)
+    source = sqlite3.connect(source_path)
+    try:
+        # rowid order is arrival order, which is what the assembler relies on
+        for topic, value, received_at in source.execute(
+                "SELECT topic, value, received_at FROM telemetry ORDER BY rowid"):
+            received_ms = int(datetime.fromisoformat(received_at).timestamp() * 1000)
+            assembler.feed(topic, value.encode(), received_ms)
+        assembler.flush()
+        if batch:
+            store.write(batch)
+        store.commit()
+    finally:
+        source.close()
+        store.close()
+    return assembler
+
+
+def drop_raw_table(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE IF EXISTS telemetry")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw telemetry rows to typed readings")
+    parser.add_argument("source", nargs="?", default="air_quality.db")
+    parser.add_argument("--dest", help="Target database (default: same file as source)")
+    parser.add_argument("--device", default="air_monitor_001",
+                        help="Device name for topics published under v1/devices/me")
+    parser.add_argument("--drop-raw", action="store_true",
+                        help="Drop the raw telemetry table and VACUUM afterwards")
+    args = parser.parse_args()
+
+    dest = args.dest or args.source
+    size_before = os.path.getsize(args.source)
+    print(f"🔄 Migrating {args.source} -> {dest}")
+    assembler = migrate(args.source, dest, default_device=args.device)
+    print(f"✅ {assembler.readings} readings written "
+          f"({assembler.incomplete} incomplete, {assembler.rejected} rows skipped)")
+
+    if args.drop_raw:
+        if dest != args.source:
+            print("⚠️  --drop-raw only applies when migrating in place")
+        else:
+            drop_raw_table(dest)
+            print(f"🗑️ Raw table dropped: {size_before} -> {os.path.getsize(dest)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Minimal local MQTT 3.1.1 broker for tests and benchmarks
+Supports CONNECT, PUBLISH (QoS 0/1), SUBSCRIBE/UNSUBSCRIBE with + and #
+wildcards and $share/<group>/<filter> shared subscriptions (round robin
+over the group's members), PINGREQ and DISCONNECT. No retained messages, persistence,
+authentication or retransmission - it is a stand-in, not a production broker.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import struct
+
+from mqtt.async_mqtt import encode_string, packet, read_packet
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = ""
+        self.subscriptions = {}  # topic filter -> granted QoS
+        self.shared = {}  # $share/<group>/<filter> -> (filter, granted QoS)
+        self.next_id = 0
+
+    def deliver(self, topic, payload, qos):
+        if qos:
+            self.next_id = self.next_id % 65535 + 1
+            body = encode_string(topic) + struct.pack("!H", self.next_id) + payload
+            self.writer.write(packet(0x32, body))
+        else:
+            self.writer.write(packet(0x30, encode_string(topic) + payload))
+
+
+class MiniBroker:
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.received = 0
+        self.delivered = 0
+        self._share_turns = {}  # $share/<group>/<filter> -> messages handed to the group
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def publish(self, topic, payload, qos):
+        self.received += 1
+        groups = {}
+        for session in self.sessions:
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    granted = max(granted or 0, sub_qos)
+            if granted is not None:
+                session.deliver(topic, payload, min(qos, granted))
+                self.delivered += 1
+            for shared_filter, (topic_filter, sub_qos) in session.shared.items():
+                if topic_matches(topic_filter, topic):
+                    groups.setdefault(shared_filter, []).append((session.client_id, session, sub_qos))
+        # One member of each matching share group gets the message
+        for shared_filter, members in groups.items():
+            members.sort(key=lambda member: member[0])
+            turn = self._share_turns.get(shared_filter, 0)
+            self._share_turns[shared_filter] = turn + 1
+            _, session, sub_qos = members[turn % len(members)]
+            session.deliver(topic, payload, min(qos, sub_qos))
+            self.delivered += 1
+
+    async def _handle(self, reader, writer):
+        session = Session(writer)
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    length = struct.unpack("!H", body[:2])[0]
+                    offset = 2 + length + 4  # protocol name, level, flags, keepalive
+                    id_length = struct.unpack("!H", body[offset:offset + 2])[0]
+                    session.client_id = body[offset + 2:offset + 2 + id_length].decode()
+                    self.sessions.add(session)
+                    writer.write(packet(0x20, b"\x00\x00"))
+                elif kind == 3:  # PUBLISH
+                    qos = (header >> 1) & 0x03
+                    length = struct.unpack("!H", body[:2])[0]
+                    topic = body[2:2 + length].decode()
+                    offset = 2 + length
+                    if qos:
+                        writer.write(packet(0x40, body[offset:offset + 2]))
+                        offset += 2
+                    self.publish(topic, body[offset:], qos)
+                elif kind == 8:  # SUBSCRIBE
+                    packet_id, offset, granted = body[:2], 2, bytearray()
+                    while offset < len(body):
+                        length = struct.unpack("!H", body[offset:offset + 2])[0]
+                        topic_filter = body[offset + 2:offset + 2 + length].decode()
+                        qos = min(body[offset + 2 + length], 1)
+                        if topic_filter.startswith("$share/"):
+                            session.shared[topic_filter] = (topic_filter.split("/", 2)[2], qos)
+                        else:
+                            session.subscriptions[topic_filter] = qos
+                        granted.append(qos)
+                        offset += 3 + length
+                    writer.write(packet(0x90, packet_id + bytes(granted)))
+                elif kind == 10:  # UNSUBSCRIBE
+                    offset = 2
+                    while offset < len(body):
+                        length = struct.unpack("!H", body[offset:offset + 2])[0]
+                        topic_filter = body[offset + 2:offset + 2 + length].decode()
+                        session.subscriptions.pop(topic_filter, None)
+                        session.shared.pop(topic_filter, None)
+                        offset += 2 + length
+                    writer.write(packet(0xB0, body[:2]))
+                elif kind == 12:  # PINGREQ
+                    writer.write(packet(0xD0))
+                elif kind == 14:  # DISCONNECT
+                    break
+                # PUBACK (4) from subscribers needs no action: nothing is retransmitted
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+
+async def serve(host, port):
+    broker = await MiniBroker(host, port).start()
+    print(f"🚀 Mini MQTT broker listening on {broker.host}:{broker.port}", flush=True)
+    await broker.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal local MQTT broker for tests and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n🛑 Broker stopped")
+
+
+if __name__ == "__main__":
+    main()
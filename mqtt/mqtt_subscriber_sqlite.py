@@ -1,33 +1,372 @@
-import paho.mqtt.client as mqtt
-import sqlite3
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
 import json
+import multiprocessing
+import time
+import zlib
+import paho.mqtt.client as mqtt
 from datetime import datetime
 
-# Initialize SQLite database
-conn = sqlite3.connect('air_quality.db')
-cursor = conn.cursor()
-cursor.execute('''CREATE TABLE IF NOT EXISTS telemetry 
-                 (topic TEXT, value TEXT, received_at TEXT)''')
-conn.commit()
+from common.metrics import REGISTRY, register_writer, start_metrics
+from common.payload_codec import PayloadError, decode_binary, decode_json
+from common.readings import Reading
+from common.rules import RULE_SETS, load_rule_sets
+from common.sensor_model import RIGHTECH_METRICS, telemetry_messages
+from mqtt.latest_state import HISTORY, LatestState, StateServer
+from mqtt.partitioned_store import PERIODS, PartitionCompactor, PartitionedStore
+from mqtt.reading_assembler import ReadingAssembler, parse_topic
+from mqtt.rollups import RollupReadingStore
+from mqtt.sqlite_writer import BatchedWriter
+from mqtt.telemetry_store import RawTelemetryStore, ReadingStore, shard_path
+
+VERBOSE = True  # Per-message console output (--quiet turns it off)
+TOPIC_FILTERS = ["v1/devices/+/telemetry/#", "v1/devices/+/attributes", "v1/devices/+/packed"]
+SUBSCRIPTIONS = TOPIC_FILTERS  # What on_connect subscribes to; narrowed per shard
+SUBSCRIBE_CHUNK = 100  # Topic filters per SUBSCRIBE packet
+STATE_ASSEMBLER = None  # Raw schema: assembles readings for the latest-state cache only
+
+# Hot-path metrics, allocated once; everything else is read from the writer at scrape time
+RECEIVED = REGISTRY.counter("mqtt_messages_received_total", "Messages received, by last topic level",
+                            labels=("topic",))
+MALFORMED = REGISTRY.counter("mqtt_payloads_malformed_total", "Payloads that could not be decoded")
+IGNORED = REGISTRY.counter("mqtt_messages_ignored_total", "Messages that are not readings or were rejected")
+CONNECTS = REGISTRY.counter("mqtt_connects_total", "Connections to the broker, reconnects included")
+DISCONNECTS = REGISTRY.counter("mqtt_disconnects_total", "Lost or closed broker connections")
+ON_MESSAGE = REGISTRY.histogram("mqtt_on_message_seconds", "Time spent in on_message")
+# RECEIVED children bound up front, one per topic kind (last topic level) the devices publish
+_received_by_level = {level: RECEIVED.labels(level)
+                      for level in RIGHTECH_METRICS + ("attributes", "telemetry", "packed")}
+_received_by_topic = {}  # Full topic -> its child, so a known topic is one dict lookup
+TOPIC_CACHE_SIZE = 100_000  # Topics remembered (a few per device) before the cache starts over
+
+def count_received(topic):
+    counter = _received_by_topic.get(topic)
+    if counter is None:
+        level = topic[topic.rfind("/") + 1:]
+        counter = _received_by_level.get(level)
+        if counter is None:
+            counter = _received_by_level[level] = RECEIVED.labels(level)
+        if len(_received_by_topic) >= TOPIC_CACHE_SIZE:
+            _received_by_topic.clear()
+        _received_by_topic[topic] = counter
+    counter.inc()
 
 def on_connect(client, userdata, flags, rc):
     print(f"Connected to MQTT broker with code {rc}")
-    client.subscribe("v1/devices/me/telemetry/#", qos=1)
-    client.subscribe("v1/devices/me/attributes", qos=1)
+    CONNECTS.inc()
+    for i in range(0, len(SUBSCRIPTIONS), SUBSCRIBE_CHUNK):
+        client.subscribe([(topic_filter, 1) for topic_filter in SUBSCRIPTIONS[i:i + SUBSCRIBE_CHUNK]])
+
+def shard_of(device, shards):
+    return zlib.crc32(device.encode()) % shards
+
+def shard_subscriptions(shard, shards, mode, group="ingest", device_ids=(), default_device=None):
+    """Topic filters for one shard.
+
+    share: every shard joins the same $share group and the broker spreads
+    messages over the group's members. hash: each shard subscribes to its
+    own devices' topics, so a device always lands on the same shard.
+    """
+    if mode == "share":
+        return [f"$share/{group}/{topic_filter}" for topic_filter in TOPIC_FILTERS]
+    filters = []
+    for device in device_ids:
+        if shard_of(device, shards) == shard:
+            filters += [topic_filter.replace("+", device) for topic_filter in TOPIC_FILTERS]
+    if default_device is not None and shard_of(default_device, shards) == shard:
+        # Topics under v1/devices/me belong to the --device device
+        filters += [topic_filter.replace("+", "me") for topic_filter in TOPIC_FILTERS]
+    return filters
+
+def on_disconnect(client, userdata, rc):
+    DISCONNECTS.inc()
+    if rc:
+        print(f"Disconnected from MQTT broker (code {rc}), reconnecting...")
+
+def expand_packed(topic, payload):
+    """Packed reading -> the per-topic (topic, value) pairs it replaces, or None"""
+    parsed = parse_topic(topic)
+    if parsed is None or parsed[2] is not None or parsed[1] not in ("telemetry", "packed"):
+        return None
+    decode = decode_json if parsed[1] == "telemetry" else decode_binary
+    reading = Reading.from_decoded(parsed[0], decode(payload))
+    return [(t, p.decode()) for t, p in telemetry_messages(reading, parsed[0])]
 
 def on_message(client, userdata, msg):
+    started = time.perf_counter()
+    topic = msg.topic  # paho decodes the topic on every access
+    count_received(topic)
+    received_at = time.time()  # The store formats it on the writer thread
+    try:
+        messages = expand_packed(topic, msg.payload) or [(topic, msg.payload.decode())]
+    except (PayloadError, UnicodeDecodeError) as e:
+        MALFORMED.inc()
+        print(f"Malformed payload on {topic}: {e}")
+        return
+
+    if STATE_ASSEMBLER:
+        STATE_ASSEMBLER.feed(topic, msg.payload, int(time.time() * 1000))
+
+    # Hand off to the writer thread; never touch the database here
+    for topic, value in messages:
+        if not userdata.put((topic, value, received_at)):
+            print(f"Dropped (writer queue full or stopped): {topic}")
+            continue
+        if VERBOSE:
+            print(f"Received: {topic} = {value} at {datetime.fromtimestamp(received_at).isoformat()}")
+    ON_MESSAGE.record(time.perf_counter() - started)
+
+def on_message_typed(client, userdata, msg):
+    # userdata is a ReadingAssembler that emits complete rows to the writer
+    started = time.perf_counter()
     topic = msg.topic
-    value = msg.payload.decode()
-    received_at = datetime.now().isoformat()
-    
-    # Store in database
-    cursor.execute("INSERT INTO telemetry VALUES (?, ?, ?)", 
-                  (topic, value, received_at))
-    conn.commit()
-    print(f"Received: {topic} = {value} at {received_at}")
-
-client = mqtt.Client(client_id="subscriber_001", protocol=mqtt.MQTTv311)
-client.on_connect = on_connect
-client.on_message = on_message
-client.connect("localhost", 1883, 60)
-client.loop_forever()
+    count_received(topic)
+    if userdata.feed(topic, msg.payload, int(time.time() * 1000)):
+        if VERBOSE:
+            print(f"Received: {topic} ({len(msg.payload)} bytes)")
+    else:
+        IGNORED.inc()  # Counted always; printed only without --quiet
+        if VERBOSE:
+            print(f"Ignored: {topic}")
+    ON_MESSAGE.record(time.perf_counter() - started)
+
+def state_emit(emit, state):
+    """Wrap a row consumer so every complete reading also updates the latest-state cache"""
+    def emit_with_state(row):
+        state.record(row)
+        return emit(row)
+    return emit_with_state
+
+def alerting_emit(emit, engine):
+    """Wrap a row consumer so every complete reading also goes through the windowed rules"""
+    def emit_with_alerts(row):
+        for device, rule, raised, value, ts in engine.update(row[0], row[1], row[2:7]):
+            state = "🚨 RAISED" if raised else "✅ cleared"
+            print(f"{state} {rule} on {device}: {value:.1f} at {ts}")
+        return emit(row)
+    return emit_with_alerts
+
+def main():
+    parser = argparse.ArgumentParser(description="Store MQTT telemetry in SQLite")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--db", default="air_quality.db")
+    parser.add_argument("--schema", default="raw", choices=["raw", "typed"],
+                        help="raw: one text row per message; typed: one row per reading")
+    parser.add_argument("--device", default="air_monitor_001",
+                        help="Device name for topics published under v1/devices/me")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Maintain 1m/1h/1d rollup tables at ingest (typed schema only)")
+    parser.add_argument("--alerts",
+                        help=f"Evaluate this rule set's windowed alerts at ingest (typed schema only): "
+                             f"{', '.join(sorted(RULE_SETS))} or a set defined in --rules")
+    parser.add_argument("--rules", help="Rule file to use instead of common/alert_rules.json")
+    parser.add_argument("--partition", choices=sorted(PERIODS),
+                        help="Store one SQLite file per day/week under --partition-dir (typed schema only)")
+    parser.add_argument("--partition-dir", default="air_quality_parts")
+    parser.add_argument("--retention-days", type=float, default=None,
+                        help="Drop partitions older than this many days (with --partition)")
+    parser.add_argument("--compact-closed", action="store_true",
+                        help="VACUUM sealed partitions on a background thread (with --partition)")
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="Commit after this many rows")
+    parser.add_argument("--flush-ms", type=int, default=200,
+                        help="Commit at least this often (milliseconds)")
+    parser.add_argument("--queue-size", type=int, default=100000,
+                        help="Max rows waiting for the writer")
+    parser.add_argument("--synchronous", default="NORMAL",
+                        choices=["OFF", "NORMAL", "FULL", "EXTRA"])
+    parser.add_argument("--drop-after", type=float, default=None,
+                        help="Seconds to wait on a full queue before dropping (default: block)")
+    parser.add_argument("--quiet", action="store_true", help="No per-message console output")
+    parser.add_argument("--stats-json", help="Write writer statistics to this file on exit")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus /metrics (and /profile) on this port; shard K uses port + K")
+    state_api = parser.add_mutually_exclusive_group()
+    state_api.add_argument("--state-port", type=int,
+                           help="Serve the latest state of every device over HTTP on this port (shard K: port + K)")
+    state_api.add_argument("--state-socket", help="Serve the latest state over HTTP on this Unix socket instead")
+    parser.add_argument("--state-history", type=int, default=HISTORY, help="Recent samples kept per device")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Ingest in this many worker processes, each with its own client and database shard")
+    parser.add_argument("--shard-mode", default="hash", choices=["hash", "share"],
+                        help="hash: per-device topic filters by crc32(device); share: MQTT $share subscriptions")
+    parser.add_argument("--share-group", default="ingest", help="Shared subscription group (--shard-mode share)")
+    devices = parser.add_mutually_exclusive_group()
+    devices.add_argument("--devices", type=int, help="--shard-mode hash: fleet devices air_monitor_001..N")
+    devices.add_argument("--device-ids", help="--shard-mode hash: comma-separated device ids")
+    args = parser.parse_args()
+
+    if args.rollups and args.schema != "typed":
+        parser.error("--rollups requires --schema typed")
+    if args.alerts and args.schema != "typed":
+        parser.error("--alerts requires --schema typed")
+    if args.alerts:
+        try:
+            rule_sets = load_rule_sets(args.rules) if args.rules else RULE_SETS
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.error(f"--rules {args.rules}: {e}")
+        if args.alerts not in rule_sets:
+            parser.error(f"--alerts: unknown rule set {args.alerts!r} "
+                         f"(choose from {', '.join(sorted(rule_sets))})")
+    if args.partition and args.schema != "typed":
+        parser.error("--partition requires --schema typed")
+    if args.shards > 1 and args.shard_mode == "hash" and not (args.devices or args.device_ids):
+        parser.error("--shard-mode hash needs the device list: --devices N or --device-ids")
+    if args.shards > 1:
+        run_shards(args)
+    else:
+        run(args)
+
+def run_shards(args):
+    """One subscriber process per shard; returns when all of them have stopped"""
+    if args.device_ids:
+        device_ids = args.device_ids.split(",")
+    else:
+        device_ids = [f"air_monitor_{i:03d}" for i in range(1, (args.devices or 0) + 1)]
+    if args.shard_mode == "share" and args.schema == "typed":
+        print("⚠️ Shared subscriptions split a per-topic reading across shards; "
+              "publish packed payloads (--payload json/binary) or use --schema raw")
+
+    workers = []
+    for shard in range(args.shards):
+        subscriptions = shard_subscriptions(shard, args.shards, args.shard_mode, args.share_group,
+                                            device_ids, args.device)
+        if not subscriptions:
+            print(f"Shard {shard}: no devices hash to it, not started")
+            continue
+        worker = multiprocessing.Process(target=run, args=(args, shard, subscriptions), name=f"shard{shard:02d}")
+        worker.start()
+        workers.append((shard, worker))
+    print(f"Started {len(workers)} shard processes ({args.shard_mode} mode)")
+
+    try:
+        for _, worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group; let every shard flush its writer
+        for _, worker in workers:
+            worker.join()
+
+    if args.stats_json:
+        totals = {"shards": [], "rows_written": 0, "commits": 0, "dropped": 0, "errors": 0, "elapsed": 0.0}
+        for shard, _ in workers:
+            path = shard_path(args.stats_json, shard)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as file:
+                stats = json.load(file)
+            totals["shards"].append(stats)
+            for key in ("rows_written", "commits", "dropped", "errors"):
+                totals[key] += stats[key]
+            totals["elapsed"] = max(totals["elapsed"], stats["elapsed"])
+        with open(args.stats_json, "w", encoding="utf-8") as file:
+            json.dump(totals, file, indent=4)
+    print("All shards stopped")
+
+def run(args, shard=None, subscriptions=None):
+    """Single subscriber: one client, one writer thread, one database (or one shard of them)"""
+    global VERBOSE, SUBSCRIPTIONS, STATE_ASSEMBLER
+    VERBOSE = not args.quiet
+    client_id = "subscriber_001"
+    db_path, partition_dir, stats_json = args.db, args.partition_dir, args.stats_json
+    state_port, state_socket = args.state_port, args.state_socket
+    if shard is not None:
+        SUBSCRIPTIONS = subscriptions
+        client_id = f"subscriber_001_shard{shard:02d}"
+        db_path, partition_dir = shard_path(db_path, shard), shard_path(partition_dir, shard)
+        stats_json = stats_json and shard_path(stats_json, shard)
+        state_port = None if state_port is None else state_port + shard
+        state_socket = state_socket and shard_path(state_socket, shard)
+
+    compactor = None
+    if args.partition:
+        store = PartitionedStore(partition_dir, args.partition, rollups=args.rollups,
+                                 retention_days=args.retention_days, synchronous=args.synchronous)
+        if args.compact_closed:
+            compactor = PartitionCompactor(partition_dir).start()
+        REGISTRY.callback("partition_rows_expired_total", "Late rows older than the retention horizon, not stored",
+                          "counter", lambda: store.expired_rows)
+    else:
+        store_class = ReadingStore if args.schema == "typed" else RawTelemetryStore
+        if args.rollups:
+            store_class = RollupReadingStore
+        store = store_class(db_path, args.synchronous)
+    writer = BatchedWriter(store,
+                           batch_size=args.batch_size,
+                           flush_interval=args.flush_ms / 1000,
+                           queue_size=args.queue_size,
+                           put_timeout=args.drop_after,
+                           latency_column=1 if args.schema == "typed" else None).start()
+
+    state = state_server = None
+    if state_port is not None or state_socket:
+        state = LatestState(args.state_history)
+        state_server = StateServer(state, port=state_port, socket_path=state_socket).start()
+        print(f"Latest state served on {state_server.address} (GET /state, /state?since=V, /state/<device>)")
+        REGISTRY.callback("state_devices", "Devices in the latest-state cache", "gauge", lambda: len(state.devices))
+        REGISTRY.callback("state_version", "Latest-state cache version (updates so far)", "counter",
+                          lambda: state.version)
+        if args.schema == "raw":
+            STATE_ASSEMBLER = ReadingAssembler(state.record, default_device=args.device)
+
+    assembler = engine = None
+    if args.schema == "typed":
+        emit = writer.put
+        if state:
+            emit = state_emit(emit, state)
+        if args.alerts:
+            rule_sets = load_rule_sets(args.rules) if args.rules else RULE_SETS
+            engine = rule_sets[args.alerts].alert_engine()
+            emit = alerting_emit(emit, engine)
+            REGISTRY.callback("alerts_raised_total", "Windowed alerts raised", "counter", lambda: engine.raised)
+        assembler = ReadingAssembler(emit, default_device=args.device)
+        REGISTRY.callback("readings_assembled_total", "Readings emitted by the assembler", "counter",
+                          lambda: assembler.readings)
+        REGISTRY.callback("readings_incomplete_total", "Readings flushed without their attributes message",
+                          "counter", lambda: assembler.incomplete)
+
+    register_writer(writer)
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = start_metrics(args.metrics_port + (shard or 0))
+
+    client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311,
+                         userdata=assembler or writer)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message_typed if assembler else on_message
+    started = time.monotonic()
+    try:
+        client.connect(args.broker, args.port, 60)
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print("\nStopping subscriber...")
+    finally:
+        client.disconnect()
+        if assembler:
+            assembler.flush()
+        writer.close()
+        if compactor:
+            compactor.stop()
+        if metrics:
+            metrics.stop()
+        if state_server:
+            state_server.stop()
+        print(f"{'' if shard is None else f'Shard {shard}: '}Writer flushed: "
+              f"{writer.rows_written} rows in {writer.commits} commits, {writer.dropped} dropped")
+        if args.partition and store.expired_rows:
+            print(f"⚠️ {store.expired_rows} late row(s) were older than --retention-days and not stored")
+        if stats_json:
+            stats = writer.stats()
+            stats["elapsed"] = time.monotonic() - started
+            if engine:
+                stats["alerts_raised"] = engine.raised
+            with open(stats_json, "w", encoding="utf-8") as file:
+                json.dump(stats, file, indent=4)
+
+if __name__ == "__main__":
+    main()
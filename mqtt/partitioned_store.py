@@ -0,0 +1,336 @@
+"""
+Time-partitioned telemetry storage
+Readings go to one SQLite file per day (or week) under a directory,
+tracked by catalog.db, which also owns the device registry so device ids
+are the same in every partition. Retention is "unlink the old file", so
+it never stalls ingestion (late rows older than the retention horizon are
+counted and not stored); closed partitions can be VACUUMed in the
+background. telemetry_query.PartitionedHistory reads across partitions.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+
+from mqtt.rollups import RollupReadingStore
+from mqtt.telemetry_store import READING_SCHEMA_SQL, ReadingStore, connect
+
+DAY_MS = 86_400_000
+# period -> (width, offset) in ms; weeks start on Monday (the epoch was a Thursday)
+PERIODS = {"day": (DAY_MS, 0), "week": (7 * DAY_MS, 4 * DAY_MS)}
+
+CATALOG_NAME = "catalog.db"
+CATALOG_BUSY_TIMEOUT_MS = 10_000
+CATALOG_SCHEMA_SQL = [
+    READING_SCHEMA_SQL[0],  # devices
+    '''CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)''',
+    # state: open -> sealed (no longer written) -> compacting -> compacted (VACUUMed);
+    # late data sets any of them back to open
+    '''CREATE TABLE IF NOT EXISTS partitions
+       (start INTEGER PRIMARY KEY, end INTEGER NOT NULL, path TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'open')''',
+]
+
+
+def partition_start(ts, period):
+    width, offset = PERIODS[period]
+    return (ts - offset) // width * width + offset
+
+
+def partition_filename(start, period):
+    day = datetime.fromtimestamp(start / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+    return f"readings_{period}_{day}.db"
+
+
+def remove_database(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def open_catalog(directory, period=None, synchronous="NORMAL"):
+    """Open (creating if needed) a catalog; returns (connection, period)"""
+    os.makedirs(directory, exist_ok=True)
+    conn = connect(os.path.join(directory, CATALOG_NAME), synchronous)
+    # The writer and compact_sealed() only hold the catalog write lock for short updates
+    conn.execute(f"PRAGMA busy_timeout = {CATALOG_BUSY_TIMEOUT_MS}")
+    for statement in CATALOG_SCHEMA_SQL:
+        conn.execute(statement)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'period'").fetchone()
+    if row is None:
+        period = period or "day"
+        conn.execute("INSERT INTO meta VALUES ('period', ?)", (period,))
+    elif period is not None and row[0] != period:
+        raise ValueError(f"{directory} is partitioned by {row[0]}, not {period}")
+    else:
+        period = row[0]
+    conn.commit()
+    return conn, period
+
+
+def list_partitions(catalog, low=None, high=None, states=None):
+    """(start, end, path, state) for partitions overlapping [low, high), oldest first"""
+    rows = catalog.execute("SELECT start, end, path, state FROM partitions ORDER BY start").fetchall()
+    return [row for row in rows
+            if (low is None or row[1] > low) and (high is None or row[0] < high)
+            and (states is None or row[3] in states)]
+
+
+class PartitionedStore:
+    """Drop-in store for BatchedWriter that routes rows to per-period files.
+
+    Rows are (device_name, ts_ms, ...) like ReadingStore. Only the writer
+    thread touches this object; open() must run on that thread.
+    """
+
+    def __init__(self, directory, period="day", rollups=False, retention_days=None,
+                 synchronous="NORMAL", max_open=4, seal_after=3_600_000, maintenance_interval=60.0):
+        self.directory = directory
+        self.period = period
+        self.store_class = RollupReadingStore if rollups else ReadingStore
+        self.retention_ms = None if retention_days is None else int(retention_days * DAY_MS)
+        self.synchronous = synchronous
+        self.max_open = max_open  # Partition files kept open for late data
+        self.seal_after = seal_after  # ms after a partition's end before it is sealed
+        self.maintenance_interval = maintenance_interval
+        self.catalog = None
+        self.stores = OrderedDict()  # partition start -> open store, LRU order
+        self._dirty = set()
+        self._device_ids = {}
+        self._next_maintenance = 0.0
+        self.dropped_partitions = 0
+        self.expired_rows = 0  # Late rows for partitions retention has already dropped
+
+    def open(self):
+        self.catalog, self.period = open_catalog(self.directory, self.period, self.synchronous)
+        self._device_ids = dict(self.catalog.execute("SELECT name, device_id FROM devices"))
+        return self
+
+    def device_id(self, name):
+        device_id = self._device_ids.get(name)
+        if device_id is None:
+            self.catalog.execute("INSERT OR IGNORE INTO devices (name) VALUES (?)", (name,))
+            device_id = self.catalog.execute(
+                "SELECT device_id FROM devices WHERE name = ?", (name,)).fetchone()[0]
+            self._device_ids[name] = device_id
+        return device_id
+
+    def oldest_start(self, now_ms=None):
+        """Start of the oldest partition retention keeps (None without retention)"""
+        if self.retention_ms is None:
+            return None
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        return partition_start(now_ms - self.retention_ms, self.period)
+
+    def write(self, rows):
+        ids, period = self._device_ids, self.period
+        oldest = self.oldest_start()
+        by_partition = defaultdict(list)
+        for row in rows:
+            start = partition_start(row[1], period)
+            if oldest is not None and start < oldest:
+                # Would recreate a partition retention dropped (and drop it again next pass)
+                self.expired_rows += 1
+                continue
+            device_id = ids.get(row[0]) or self.device_id(row[0])
+            by_partition[start].append((device_id,) + tuple(row[1:]))
+        for start, partition_rows in by_partition.items():
+            self._store(start).write_ids(partition_rows)
+            self._dirty.add(start)
+
+    def commit(self):
+        # Devices first, so every committed reading has a registered device
+        self.catalog.commit()
+        for start in self._dirty:
+            self.stores[start].commit()
+        self._dirty.clear()
+        if time.monotonic() >= self._next_maintenance:
+            self._next_maintenance = time.monotonic() + self.maintenance_interval
+            self.maintain()
+
+    def rollback(self):
+        self.catalog.rollback()
+        for start in self._dirty:
+            self.stores[start].rollback()
+        self._dirty.clear()
+        self._device_ids = dict(self.catalog.execute("SELECT name, device_id FROM devices"))
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
+        self.stores.clear()
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
+
+    def _store(self, start):
+        store = self.stores.get(start)
+        if store is not None:
+            self.stores.move_to_end(start)
+            return store
+
+        # Evict the least recently used clean partition handle
+        while len(self.stores) >= self.max_open:
+            clean = next((key for key in self.stores if key not in self._dirty), None)
+            if clean is None:
+                break
+            self.stores.pop(clean).close()
+
+        width = PERIODS[self.period][0]
+        path = partition_filename(start, self.period)
+        self.catalog.execute("INSERT OR IGNORE INTO partitions (start, end, path) VALUES (?, ?, ?)",
+                             (start, start + width, path))
+        # Late data reopens a sealed partition; it is sealed again on a later pass
+        self.catalog.execute("UPDATE partitions SET state = 'open' WHERE start = ? AND state != 'open'",
+                             (start,))
+        store = self.store_class(os.path.join(self.directory, path), self.synchronous).open()
+        self.stores[start] = store
+        return store
+
+    def maintain(self, now_ms=None):
+        """Seal partitions past their end and drop those past retention"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        oldest = self.oldest_start(now_ms)
+        for start, end, path, state in list_partitions(self.catalog):
+            expired = oldest is not None and start < oldest
+            if expired:
+                store = self.stores.pop(start, None)
+                if store is not None:
+                    store.close()
+                self.catalog.execute("DELETE FROM partitions WHERE start = ?", (start,))
+                self.catalog.commit()
+                remove_database(os.path.join(self.directory, path))
+                self.dropped_partitions += 1
+            elif state == "open" and end + self.seal_after <= now_ms and start not in self._dirty:
+                store = self.stores.pop(start, None)
+                if store is not None:
+                    store.close()
+                self.catalog.execute("UPDATE partitions SET state = 'sealed' WHERE start = ?", (start,))
+        self.catalog.commit()
+
+
+def _set_state(catalog, start, expected, state):
+    """Move a partition from `expected` to `state` under the catalog write lock, leaving the
+    transaction for the caller to commit; False if it is no longer in `expected` (late data
+    reopened it)"""
+    catalog.execute("BEGIN IMMEDIATE")
+    try:
+        row = catalog.execute("SELECT state FROM partitions WHERE start = ?", (start,)).fetchone()
+        if row is None or row[0] != expected:
+            catalog.rollback()
+            return False
+        catalog.execute("UPDATE partitions SET state = ? WHERE start = ?", (state, start))
+        return True
+    except BaseException:
+        catalog.rollback()
+        raise
+
+
+def compact_sealed(directory):
+    """VACUUM sealed partitions into fresh non-WAL files; returns how many were compacted.
+
+    The copy is made with VACUUM INTO, which only reads the partition, so
+    late rows can keep arriving meanwhile; the catalog write lock is held
+    just to flip the state and to swap the copy in. A partition reopened
+    while it was copied keeps its file and is compacted once sealed again.
+    """
+    catalog, _ = open_catalog(directory)
+    compacted = 0
+    try:
+        # "compacting" is left behind by an interrupted run
+        for start, _, path, state in list_partitions(catalog, states={"sealed", "compacting"}):
+            if state == "sealed":
+                if not _set_state(catalog, start, "sealed", "compacting"):
+                    continue
+                catalog.commit()
+            full_path = os.path.join(directory, path)
+            copy_path = full_path + ".compact"
+            remove_database(copy_path)
+            conn = sqlite3.connect(full_path)
+            try:
+                conn.execute("VACUUM INTO ?", (copy_path,))
+            finally:
+                conn.close()
+            if not _set_state(catalog, start, "compacting", "compacted"):
+                remove_database(copy_path)
+                continue
+            try:
+                # No writer has the file open: reopening it needs the lock held here. The copy
+                # already has whatever the old WAL held
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(full_path + suffix):
+                        os.remove(full_path + suffix)
+                os.replace(copy_path, full_path)
+                catalog.commit()
+            except BaseException:
+                catalog.rollback()
+                raise
+            compacted += 1
+    finally:
+        catalog.close()
+    return compacted
+
+
+class PartitionCompactor:
+    """Background thread that compacts sealed partitions every `interval` seconds"""
+
+    def __init__(self, directory, interval=300.0):
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="partition-compactor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                compact_sealed(self.directory)
+            except Exception as e:
+                print(f"Partition compaction failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain time-partitioned telemetry storage")
+    parser.add_argument("command", choices=["list", "retention", "compact"])
+    parser.add_argument("directory", nargs="?", default="air_quality_parts")
+    parser.add_argument("--keep-days", type=float, help="retention: drop partitions older than this")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        catalog, period = open_catalog(args.directory)
+        print(f"📂 {args.directory} (partitioned by {period})")
+        for start, end, path, state in list_partitions(catalog):
+            full_path = os.path.join(args.directory, path)
+            size = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+            print(f"   {path:<32} {state:<10} {size / 1e6:10.1f} MB")
+        catalog.close()
+    elif args.command == "retention":
+        if args.keep_days is None:
+            parser.error("retention needs --keep-days")
+        # Offline use; a running subscriber applies --retention-days itself
+        store = PartitionedStore(args.directory, period=None, retention_days=args.keep_days).open()
+        store.maintain()
+        store.close()
+        print(f"🗑️ Dropped {store.dropped_partitions} partition(s)")
+    else:
+        print(f"🧹 Compacted {compact_sealed(args.directory)} partition(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Reassembles per-topic MQTT messages into one typed row per reading
+
+The emulators publish each metric to v1/devices/<device>/telemetry/<metric>
+and finish a reading with v1/devices/<device>/attributes, which carries the
+reading's timestamp and status. "me" in the device position maps to a
+configurable default device name. Packed readings (v1/devices/<device>/telemetry
+JSON objects and v1/devices/<device>/packed binary records) are already complete
+and are emitted directly.
+"""
+
+import json
+
+from common.payload_codec import decode_binary, decode_json
+from common.sensor_model import STATUS_CODES, to_epoch_ms
+from mqtt.telemetry_store import METRICS
+
+TELEMETRY_FIELDS = METRICS + ("relay_state",)
+
+
+def parse_topic(topic):
+    """Split a ThingsBoard-style topic into (device, kind, metric) or None"""
+    parts = topic.split("/")
+    if len(parts) < 4 or parts[0] != "v1" or parts[1] != "devices":
+        return None
+    metric = parts[4] if len(parts) == 5 else None
+    return parts[2], parts[3], metric
+
+
+class ReadingAssembler:
+    def __init__(self, emit, default_device="air_monitor_001"):
+        self.emit = emit  # Called with one reading row tuple
+        self.default_device = default_device
+        self.pending = {}  # device -> {"_first": ts_ms, metric: value}
+        self.readings = 0
+        self.incomplete = 0
+        self.rejected = 0
+
+    def feed(self, topic, payload, received_ms):
+        """Consume one message; returns False when it is not a reading topic"""
+        parsed = parse_topic(topic)
+        if parsed is None:
+            self.rejected += 1
+            return False
+        device, kind, metric = parsed
+        if device == "me":
+            device = self.default_device
+
+        try:
+            if kind == "telemetry" and metric in TELEMETRY_FIELDS:
+                self._add_metric(device, metric, float(payload), received_ms)
+                return True
+            if kind == "telemetry" and metric is None:
+                self._emit_packed(device, decode_json(payload))
+                return True
+            if kind == "packed" and metric is None:
+                self._emit_packed(device, decode_binary(payload))
+                return True
+            if kind == "attributes" and metric is None:
+                attributes = json.loads(payload)
+                self._complete(device, attributes, received_ms)
+                return True
+        except (ValueError, TypeError, AttributeError):
+            pass
+        self.rejected += 1
+        return False
+
+    def flush(self):
+        """Emit every partial reading still waiting for its attributes message"""
+        for device in list(self.pending):
+            self._emit(device, self.pending.pop(device), None, None)
+            self.incomplete += 1
+
+    def _add_metric(self, device, metric, value, received_ms):
+        partial = self.pending.get(device)
+        if partial is not None and metric in partial:
+            # The previous reading never got its attributes message
+            self._emit(device, self.pending.pop(device), None, None)
+            self.incomplete += 1
+            partial = None
+        if partial is None:
+            partial = self.pending[device] = {"_first": received_ms}
+        partial[metric] = value
+
+    def _complete(self, device, attributes, received_ms):
+        partial = self.pending.pop(device, None)
+        if partial is None:
+            return  # Status without any telemetry is not a reading
+        timestamp = attributes.get("timestamp")
+        ts = to_epoch_ms(timestamp) if timestamp is not None else partial["_first"]
+        self._emit(device, partial, ts, STATUS_CODES.get(attributes.get("status")))
+
+    def _emit_packed(self, device, decoded):
+        self.readings += 1
+        self.emit((device,) + decoded)
+
+    def _emit(self, device, partial, ts, status):
+        relay = partial.get("relay_state")
+        self.readings += 1
+        self.emit((
+            device,
+            ts if ts is not None else partial["_first"],
+            partial.get("pm25"),
+            partial.get("pm10"),
+            partial.get("co2"),
+            partial.get("temperature"),
+            partial.get("humidity"),
+            None if relay is None else int(relay),
+            status,
+        ))
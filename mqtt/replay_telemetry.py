@@ -0,0 +1,355 @@
+"""
+Telemetry replay
+Re-publishes stored readings onto MQTT with their original topic layout and
+inter-arrival timing, at N x real time or as fast as possible. Sources: the
+typed store (single file or partition directory), the raw per-topic store
+or an NDJSON dump. A reader thread keeps a bounded read-ahead buffer; the
+publisher paces every reading against an absolute deadline on the event
+loop's monotonic clock (so sleep overshoot never accumulates) and shards
+devices over several connections.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import heapq
+import json
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from common.histogram import Histogram
+from common.payload_codec import PAYLOAD_FORMATS, packed_messages
+from common.readings import Reading
+from common.sensor_model import TELEMETRY_METRICS, telemetry_messages
+from data_structure.air_quality_ndjson import decode_lines, read_chunks
+from mqtt.air_quality_fleet import make_transport_factory
+from mqtt.partitioned_store import CATALOG_NAME, list_partitions
+from mqtt.reading_assembler import parse_topic
+from mqtt.telemetry_query import parse_time
+
+EVENTS_PER_CHUNK = 1000  # Readings handed from the reader thread at a time
+_END = object()
+
+_READINGS_SQL = '''SELECT ts, pm25, pm10, co2, temperature, humidity, relay, status
+                   FROM readings WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts'''
+
+
+def _typed_rows(conn, names, low, high):
+    """(device, ts, ...) rows of one typed database in time order.
+
+    Merges one primary-key-ordered cursor per device instead of sorting
+    the whole range by ts.
+    """
+    def device_rows(device_id, name):
+        for row in conn.execute(_READINGS_SQL, (device_id, low, high)):
+            yield (name,) + row
+    return heapq.merge(*(device_rows(device_id, name) for device_id, name in names.items()),
+                       key=lambda row: row[1])
+
+
+def typed_source(db_path, low, high, devices=None):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        names = _device_names(conn, devices)
+        yield from _typed_rows(conn, names, low, high)
+    finally:
+        conn.close()
+
+
+def partitioned_source(directory, low, high, devices=None):
+    catalog = sqlite3.connect(f"file:{os.path.join(directory, CATALOG_NAME)}?mode=ro", uri=True)
+    names = _device_names(catalog, devices)
+    partitions = list_partitions(catalog, low, high)
+    catalog.close()
+    for _, _, path, _ in partitions:
+        conn = sqlite3.connect(f"file:{os.path.join(directory, path)}?mode=ro", uri=True)
+        try:
+            yield from _typed_rows(conn, names, low, high)
+        finally:
+            conn.close()
+
+
+def ndjson_source(path, low, high, devices=None):
+    """Rows of an NDJSON dump in file order (replay expects it roughly time-ordered)"""
+    for first, lines in read_chunks(path):
+        rows, errors = decode_lines(first, lines)
+        for number, message, _ in errors:
+            print(f"⚠️ Line {number}: {message}")
+        for row in rows:
+            if low <= row[1] < high and (devices is None or row[0] in devices):
+                yield row
+
+
+def raw_source(db_path, low, high, devices=None):
+    """(device, ts, [(topic, payload)]) per stored message of the raw per-topic store"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for topic, value, received_at in conn.execute(
+                "SELECT topic, value, received_at FROM telemetry ORDER BY rowid"):
+            ts = int(datetime.fromisoformat(received_at).timestamp() * 1000)
+            parsed = parse_topic(topic)
+            device = parsed[0] if parsed else topic
+            if low <= ts < high and (devices is None or device in devices):
+                yield device, ts, [(topic, value.encode())]
+    finally:
+        conn.close()
+
+
+def _device_names(conn, devices):
+    names = dict(conn.execute("SELECT device_id, name FROM devices"))
+    if devices is not None:
+        names = {device_id: name for device_id, name in names.items() if name in devices}
+    return names
+
+
+def reading_messages(row, payload_format="per-topic", retime_ms=None):
+    """(topic, payload) pairs re-creating the original publish of one stored reading.
+
+    Metrics missing from an incomplete reading are left out; such readings
+    cannot be packed and return an empty list for json/binary.
+    """
+    device = row[0]
+    reading = Reading.from_row(row)
+    if retime_ms is not None:
+        reading.ts = retime_ms
+    if None in row[2:8]:
+        if payload_format != "per-topic":
+            return []
+        missing = {metric for metric in TELEMETRY_METRICS if reading[metric] is None}
+        return [(topic, payload) for topic, payload in telemetry_messages(reading, device)
+                if parse_topic(topic)[2] not in missing]
+    if payload_format == "per-topic":
+        return telemetry_messages(reading, device)
+    return packed_messages(reading, device, payload_format)
+
+
+class ReadAhead:
+    """Reader thread filling a bounded queue with chunks of source events"""
+
+    def __init__(self, events, chunks=64):
+        self.events = events
+        self.queue = queue.Queue(maxsize=chunks)
+        self.thread = threading.Thread(target=self._run, name="replay-reader", daemon=True)
+        self.stopped = False
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            chunk = []
+            for event in self.events:
+                if self.stopped:
+                    return
+                chunk.append(event)
+                if len(chunk) >= EVENTS_PER_CHUNK:
+                    self.queue.put(chunk)
+                    chunk = []
+            if chunk:
+                self.queue.put(chunk)
+            self.queue.put(_END)
+        except Exception as e:
+            self.queue.put(e)
+
+    def stop(self):
+        self.stopped = True
+        try:
+            while True:
+                self.queue.get_nowait()  # Unblock a reader waiting on a full queue
+        except queue.Empty:
+            pass
+
+
+class Replayer:
+    def __init__(self, events, transport_factory, speed=1.0, connections=4, qos=1,
+                 payload_format="per-topic", retime=False, read_ahead=64, report=True):
+        self.events = events  # Iterable of (device, ts_ms, ...) rows or (device, ts_ms, messages)
+        self.transport_factory = transport_factory
+        self.speed = speed  # None = as fast as possible
+        self.connections = connections
+        self.qos = qos
+        self.payload_format = payload_format
+        self.retime = retime  # Stamp readings with their replay time instead of the original
+        self._retimed = {}  # device -> last replay stamp (ms), kept strictly increasing
+        self.read_ahead = read_ahead
+        self.report = report
+        self.clients = []
+        self.timing_error = Histogram()  # Seconds past each reading's deadline
+        self.readings = 0
+        self.skipped = 0
+        self.out_of_order = 0
+        self.first_ts = self.last_ts = None
+        self.elapsed = 0.0
+
+    @property
+    def published(self):
+        return sum(client.published for client in self.clients)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.clients = await asyncio.gather(
+            *(self.transport_factory(f"replay_{os.getpid()}_{i}").connect() for i in range(self.connections)))
+        reader = ReadAhead(self.events, self.read_ahead).start()
+        reporter = asyncio.create_task(self._report()) if self.report else None
+        started = loop.time()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, reader.queue.get)
+                if chunk is _END:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                for event in chunk:
+                    await self._replay(event, loop, started)
+        finally:
+            reader.stop()
+            self.elapsed = loop.time() - started
+            if reporter:
+                reporter.cancel()
+            await asyncio.gather(*(client.wait_acked() for client in self.clients))
+            await asyncio.gather(*(client.close() for client in self.clients))
+
+    async def _replay(self, event, loop, started):
+        device, ts = event[0], event[1]
+        if self.first_ts is None:
+            self.first_ts = self.last_ts = ts
+        if ts < self.last_ts:
+            self.out_of_order += 1  # Its deadline has passed: sent immediately
+        self.last_ts = max(self.last_ts, ts)
+
+        if self.speed:
+            deadline = started + (ts - self.first_ts) / 1000 / self.speed
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.timing_error.record(max(0.0, loop.time() - deadline))
+
+        if len(event) == 3:
+            messages = event[2]  # Raw store: already one (topic, payload)
+        else:
+            retime_ms = self._retime(device) if self.retime else None
+            messages = reading_messages(event, self.payload_format, retime_ms)
+            if not messages:
+                self.skipped += 1
+                return
+        client = self.clients[zlib.crc32(device.encode()) % len(self.clients)]
+        for topic, payload in messages:
+            await client.publish(topic, payload, self.qos)
+        self.readings += 1
+
+    def _retime(self, device):
+        # Wall clock at publish time; bumped by 1 ms when a device publishes twice in the
+        # same millisecond (--speed max, high speeds) so (device_id, ts) stays unique
+        stamp = max(int(time.time() * 1000), self._retimed.get(device, -1) + 1)
+        self._retimed[device] = stamp
+        return stamp
+
+    async def _report(self):
+        last_count, last_time = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            now, count = time.monotonic(), self.published
+            rate = (count - last_count) / (now - last_time)
+            lag = self.timing_error.percentile(99)
+            print(f"📡 {rate:10,.0f} msgs/s | {self.readings:,} readings | "
+                  f"p99 timing error {1000 * (lag or 0):.1f} ms")
+            last_count, last_time = count, now
+
+    def stats(self):
+        span = (self.last_ts - self.first_ts) / 1000 if self.first_ts is not None else 0.0
+        target_seconds = span / self.speed if self.speed else None
+        published = self.published
+        return {
+            "readings": self.readings,
+            "messages": published,
+            "skipped": self.skipped,
+            "out_of_order": self.out_of_order,
+            "source_span_seconds": span,
+            "speed": self.speed,
+            "elapsed": self.elapsed,
+            "requested_msgs_per_sec": published / target_seconds if target_seconds else None,
+            "achieved_msgs_per_sec": published / self.elapsed if self.elapsed else None,
+            "timing_error_ms": self.timing_error.summary(scale=1000) if self.speed else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored telemetry onto MQTT")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="Typed SQLite store (mqtt_subscriber_sqlite.py --schema typed)")
+    source.add_argument("--raw-db", help="Raw per-topic SQLite store (--schema raw)")
+    source.add_argument("--partition-dir", help="Partitioned typed store directory")
+    source.add_argument("--ndjson", help="NDJSON dump (time-ordered, .gz allowed)")
+    parser.add_argument("--speed", default="1", help="Replay speed multiplier, or 'max' for no pacing")
+    parser.add_argument("--start", help="Only readings from this time (ISO or epoch s/ms)")
+    parser.add_argument("--end", help="Only readings before this time (ISO or epoch s/ms)")
+    parser.add_argument("--device", action="append", help="Only this device (repeatable)")
+    parser.add_argument("--payload", default="per-topic", choices=PAYLOAD_FORMATS,
+                        help="Layout for typed/NDJSON sources; raw messages are replayed as stored")
+    parser.add_argument("--retime", action="store_true",
+                        help="Stamp readings with the wall-clock time (epoch ms) they are published at, "
+                             "unique per device, instead of the original")
+    parser.add_argument("--connections", type=int, default=4, help="MQTT connections (devices are sharded)")
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1])
+    parser.add_argument("--read-ahead", type=int, default=64, help=f"Chunks of {EVENTS_PER_CHUNK} readings buffered")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="Unacked QoS 1 messages per connection")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--fake", action="store_true", help="Use an in-process fake transport (no broker)")
+    parser.add_argument("--stats-json", help="Write replay statistics to this file on exit")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        parser.error("--speed must be positive or 'max'")
+    low, high = parse_time(args.start), parse_time(args.end)
+    low = low if low is not None else -2 ** 62
+    high = high if high is not None else 2 ** 62
+    devices = set(args.device) if args.device else None
+
+    if args.db:
+        events = typed_source(args.db, low, high, devices)
+    elif args.partition_dir:
+        events = partitioned_source(args.partition_dir, low, high, devices)
+    elif args.ndjson:
+        events = ndjson_source(args.ndjson, low, high, devices)
+    else:
+        events = raw_source(args.raw_db, low, high, devices)
+
+    transport_factory = make_transport_factory(args.broker, args.port, args.fake, args.username,
+                                               args.password, args.max_inflight)
+    replayer = Replayer(events, transport_factory, speed, args.connections, args.qos,
+                        args.payload, args.retime, args.read_ahead)
+    print(f"▶️ REPLAY at {'max speed' if speed is None else f'{speed:g}x'} "
+          f"over {args.connections} connection(s) to {'fake transport' if args.fake else f'{args.broker}:{args.port}'}")
+    try:
+        asyncio.run(replayer.run())
+    except KeyboardInterrupt:
+        print("\n⚠️  User interrupted program (Ctrl+C)")
+
+    stats = replayer.stats()
+    print(f"✅ Replayed {stats['readings']:,} readings / {stats['messages']:,} messages "
+          f"in {stats['elapsed']:.1f}s ({stats['achieved_msgs_per_sec'] or 0:,.0f} msgs/s)")
+    if stats["requested_msgs_per_sec"]:
+        print(f"🎯 Requested {stats['requested_msgs_per_sec']:,.0f} msgs/s; timing error "
+              f"p50 {stats['timing_error_ms']['p50']} ms, p99 {stats['timing_error_ms']['p99']} ms, "
+              f"max {stats['timing_error_ms']['max']} ms")
+    if stats["out_of_order"]:
+        print(f"⚠️ {stats['out_of_order']:,} readings were older than their predecessor (sent late)")
+    if args.stats_json:
+        with open(args.stats_json, "w", encoding="utf-8") as file:
+            json.dump(stats, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
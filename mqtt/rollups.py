@@ -0,0 +1,160 @@
+"""
+Incremental rollups of the typed readings table
+rollup_1m / rollup_1h / rollup_1d hold, per device and bucket:
+  n, <metric>_min/_max/_sum/_n for every metric (avg = sum / n),
+  n_ok / n_warning / n_danger (status share) and relay_on / relay_n (duty cycle)
+
+Rollups are keyed by the bucket of each reading's own timestamp (UTC), so
+late and out-of-order readings simply merge into the right bucket. Each
+writer batch is staged first, duplicates of stored readings are dropped,
+and the batch is folded into every rollup with one set-based UPSERT per
+resolution, in the same transaction as the raw insert.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+
+from mqtt.telemetry_store import METRICS, READING_COLUMNS, ReadingStore, connect
+
+RESOLUTIONS = {"1m": 60_000, "1h": 3_600_000, "1d": 86_400_000}  # Bucket width in ms
+
+_METRIC_COLUMNS = [f"{metric}_{part}" for metric in METRICS for part in ("min", "max", "sum", "n")]
+_STATUS_COLUMNS = ["n_ok", "n_warning", "n_danger", "relay_on", "relay_n"]
+ROLLUP_COLUMNS = ["device_id", "bucket", "n"] + _METRIC_COLUMNS + _STATUS_COLUMNS
+
+
+def rollup_table(resolution):
+    return f"rollup_{resolution}"
+
+
+def rollup_schema_sql():
+    metric_defs = ", ".join(
+        f"{metric}_min REAL, {metric}_max REAL, {metric}_sum REAL, {metric}_n INTEGER"
+        for metric in METRICS)
+    return [f'''CREATE TABLE IF NOT EXISTS {rollup_table(resolution)}
+                (device_id INTEGER NOT NULL,
+                 bucket INTEGER NOT NULL,
+                 n INTEGER NOT NULL,
+                 {metric_defs},
+                 n_ok INTEGER, n_warning INTEGER, n_danger INTEGER,
+                 relay_on INTEGER, relay_n INTEGER,
+                 PRIMARY KEY (device_id, bucket)) WITHOUT ROWID'''
+            for resolution in RESOLUTIONS]
+
+
+def _aggregate_select(resolution, source, where="true"):
+    width = RESOLUTIONS[resolution]
+    metric_aggs = ", ".join(
+        f"min({metric}), max({metric}), total({metric}), count({metric})" for metric in METRICS)
+    return f'''SELECT device_id, ts / {width} * {width}, count(*), {metric_aggs},
+                      count(CASE WHEN status = 0 THEN 1 END),
+                      count(CASE WHEN status = 1 THEN 1 END),
+                      count(CASE WHEN status = 2 THEN 1 END),
+                      count(CASE WHEN relay = 1 THEN 1 END),
+                      count(relay)
+               FROM {source} WHERE {where}
+               GROUP BY 1, 2'''
+
+
+def _merge_sql(resolution, source):
+    """Fold aggregates of `source` rows into an existing rollup table"""
+    updates = ["n = n + excluded.n"]
+    for metric in METRICS:
+        for part, func in (("min", "min"), ("max", "max")):
+            column = f"{metric}_{part}"
+            updates.append(f"{column} = {func}(coalesce({column}, excluded.{column}), "
+                           f"coalesce(excluded.{column}, {column}))")
+        updates += [f"{metric}_sum = {metric}_sum + excluded.{metric}_sum",
+                    f"{metric}_n = {metric}_n + excluded.{metric}_n"]
+    updates += [f"{column} = {column} + excluded.{column}" for column in _STATUS_COLUMNS]
+    return (f"INSERT INTO {rollup_table(resolution)} ({', '.join(ROLLUP_COLUMNS)}) "
+            f"{_aggregate_select(resolution, source)} "
+            f"ON CONFLICT (device_id, bucket) DO UPDATE SET {', '.join(updates)}")
+
+
+class RollupReadingStore(ReadingStore):
+    """ReadingStore that keeps the 1m/1h/1d rollups current in every commit"""
+
+    schema_sql = ReadingStore.schema_sql + rollup_schema_sql()
+
+    def open(self):
+        super().open()
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute(f'''CREATE TEMP TABLE IF NOT EXISTS staging
+                              ({", ".join(READING_COLUMNS)})''')
+        self._stage_sql = f"INSERT INTO temp.staging VALUES ({', '.join('?' * len(READING_COLUMNS))})"
+        self._merge_sql = [_merge_sql(resolution, "temp.staging") for resolution in RESOLUTIONS]
+        return self
+
+    def write_ids(self, rows):
+        conn = self.conn
+        conn.executemany(self._stage_sql, rows)
+        # QoS 1 redeliveries and replays must not be counted twice
+        conn.execute('''DELETE FROM temp.staging
+                        WHERE rowid NOT IN (SELECT min(rowid) FROM temp.staging GROUP BY device_id, ts)
+                           OR EXISTS (SELECT 1 FROM readings r
+                                      WHERE r.device_id = staging.device_id AND r.ts = staging.ts)''')
+        for statement in self._merge_sql:
+            conn.execute(statement)
+        conn.execute("INSERT OR IGNORE INTO readings SELECT * FROM temp.staging")
+        conn.execute("DELETE FROM temp.staging")
+
+    def rollback(self):
+        super().rollback()
+        self.conn.execute("DELETE FROM temp.staging")
+
+
+def rebuild(conn, resolutions=tuple(RESOLUTIONS), start=None, end=None):
+    """Recompute rollups from readings in bulk, optionally only for [start, end) ms.
+
+    The range is widened to whole days so partially covered buckets are
+    recomputed completely. Returns {resolution: buckets written}.
+    """
+    day = RESOLUTIONS["1d"]
+    bounds = []
+    if start is not None:
+        bounds.append((">=", int(start) // day * day))
+    if end is not None:
+        bounds.append(("<", -(-int(end) // day) * day))
+
+    def where(column):
+        return " AND ".join(f"{column} {op} {value}" for op, value in bounds) or "true"
+
+    written = {}
+    for resolution in resolutions:
+        table = rollup_table(resolution)
+        conn.execute(f"DELETE FROM {table} WHERE {where('bucket')}")
+        cursor = conn.execute(f"INSERT INTO {table} ({', '.join(ROLLUP_COLUMNS)}) "
+                              f"{_aggregate_select(resolution, 'readings', where('ts'))}")
+        written[resolution] = cursor.rowcount
+    conn.commit()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain rollup tables of the typed readings store")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("db", nargs="?", default="air_quality.db")
+    parser.add_argument("--resolution", action="append", choices=sorted(RESOLUTIONS),
+                        help="Only these resolutions (repeatable; default all)")
+    parser.add_argument("--start", type=int, help="Only readings from this epoch-ms timestamp")
+    parser.add_argument("--end", type=int, help="Only readings before this epoch-ms timestamp")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    for statement in RollupReadingStore.schema_sql:
+        conn.execute(statement)
+    started = time.perf_counter()
+    written = rebuild(conn, args.resolution or tuple(RESOLUTIONS), args.start, args.end)
+    conn.close()
+    for resolution, buckets in written.items():
+        print(f"✅ {rollup_table(resolution)}: {buckets:,} buckets")
+    print(f"⏱️ Rebuilt in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Batched SQLite writer
+Moves inserts off the MQTT network thread and group-commits them
+from a dedicated writer thread (by row count or elapsed time)
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+from common.histogram import Histogram
+
+_STOP = object()
+PUT_POLL = 0.5  # Seconds a blocked put() waits before checking the writer thread is still running
+
+
+class BatchedWriter:
+    def __init__(self, store, batch_size=5000, flush_interval=0.2,
+                 queue_size=100000, put_timeout=None, latency_column=None):
+        self.store = store  # A telemetry_store.SQLiteStore, opened on the writer thread
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # Seconds a row may wait before commit
+        self.put_timeout = put_timeout  # None = block until there is room
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Index of an epoch-ms column; when set, publish->commit latency is recorded per row
+        self.latency_column = latency_column
+        self.latency = Histogram()
+        self.commit_time = Histogram()  # Seconds spent in write + commit per batch
+
+        # Counters (only the writer thread updates rows_written/commits)
+        self.rows_written = 0
+        self.commits = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._ready = threading.Event()
+        self._stopped = threading.Event()  # Set when the writer thread exits, for whatever reason
+        self._error = None
+
+    def start(self):
+        """Start the writer thread and wait until the database is ready"""
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def put(self, row):
+        """Queue one row; blocks while the queue is full (backpressure).
+
+        With put_timeout set, the row is dropped once the timeout expires
+        so the caller never stalls longer than that. Rows are also dropped
+        once the writer thread has stopped, instead of blocking forever on a
+        queue nobody drains. Returns False on drop.
+        """
+        if not self._stopped.is_set():
+            try:
+                self.queue.put_nowait(row)
+                return True
+            except queue.Full:
+                pass
+            deadline = None if self.put_timeout is None else time.monotonic() + self.put_timeout
+            while not self._stopped.is_set():
+                wait = PUT_POLL if deadline is None else min(PUT_POLL, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+                try:
+                    self.queue.put(row, timeout=wait)
+                    return True
+                except queue.Full:
+                    pass
+        self.dropped += 1
+        return False
+
+    def close(self):
+        """Flush everything still queued and stop the writer thread"""
+        while self._thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=PUT_POLL)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self.store.write(batch)
+            self.store.commit()
+            self.commit_time.record(time.perf_counter() - started)
+            self.rows_written += len(batch)
+            self.commits += 1
+            if self.latency_column is not None:
+                self._record_latency(batch)
+        except Exception as e:  # A malformed row must not end the writer thread
+            try:
+                self.store.rollback()
+            except sqlite3.Error:
+                pass
+            self.errors += 1
+            print(f"SQLite writer error, {len(batch)} rows lost: {type(e).__name__}: {e}")
+        batch.clear()
+
+    def _record_latency(self, batch):
+        now_ms = time.time() * 1000
+        column, record = self.latency_column, self.latency.record
+        for row in batch:
+            record(max(0.0, now_ms - row[column]) / 1000)
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "commits": self.commits,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "commit_latency_ms": self.latency.summary(1000) if self.latency.count else None,
+            "commit_time_ms": self.commit_time.summary(1000),
+        }
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            self.errors += 1
+            print(f"SQLite writer stopped, queued rows are dropped: {type(e).__name__}: {e}")
+        finally:
+            self._stopped.set()
+            self._ready.set()
+
+    def _loop(self):
+        # The store's connection lives and dies on this thread
+        try:
+            self.store.open()
+        except Exception as e:
+            self._error = e
+            return
+        self._ready.set()
+
+        batch = []
+        deadline = 0.0
+        stopping = False
+
+        while not stopping:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(batch)
+                continue
+
+            if item is _STOP:
+                break
+            if not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(item)
+
+            # Drain whatever is already waiting without blocking
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+
+        if batch:
+            self._flush(batch)
+        self.store.close()
@@ -0,0 +1,451 @@
+"""
+Historical queries over the typed telemetry store
+query(device, metrics, start, end, bucket=None, agg="avg") streams rows
+straight off a cursor. Raw ranges are served from the (device_id, ts)
+primary key; bucketed ranges are aggregated in SQL and read from the
+widest rollup table whose resolution divides the bucket, with only the
+unaligned edges of the range taken from raw readings.
+PartitionedHistory and ShardedHistory answer the same queries over a
+partitioned store and over the shards of a sharded subscriber; explain()
+shows the SQLite plan of every statement a query runs.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import heapq
+import json
+import sqlite3
+import time
+from datetime import datetime
+from operator import itemgetter
+
+from common.sensor_model import to_epoch_ms
+from mqtt.partitioned_store import CATALOG_NAME, list_partitions
+from mqtt.rollups import RESOLUTIONS, rollup_table
+from mqtt.telemetry_store import METRICS, shard_paths
+
+QUERY_METRICS = METRICS + ("relay",)  # avg(relay) is the relay duty cycle
+AGGREGATES = ("avg", "min", "max", "sum", "count")
+BUCKET_UNITS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+# Partial aggregates (sum, count, min, max) combined by the outer query
+_FINAL = {
+    "avg": "total({s}) / nullif(sum({n}), 0)",
+    "sum": "total({s})",
+    "count": "sum({n})",
+    "min": "min({lo})",
+    "max": "max({hi})",
+}
+
+
+def parse_time(value):
+    """Epoch ms from an int (seconds or ms), a datetime or an ISO string; None passes through"""
+    if value is None or isinstance(value, int):
+        return None if value is None else to_epoch_ms(value)
+    if isinstance(value, str):
+        if value.isdigit():
+            return to_epoch_ms(int(value))
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
+
+
+def parse_bucket(bucket):
+    """Bucket width in ms from ms (int) or '30s', '5m', '1h', '1d'"""
+    if bucket is None or isinstance(bucket, int):
+        return bucket
+    return int(float(bucket[:-1]) * BUCKET_UNITS[bucket[-1]])
+
+
+def _raw_partials(metric):
+    return [f"total({metric})", f"count({metric})", f"min({metric})", f"max({metric})"]
+
+
+def _rollup_partials(metric):
+    if metric == "relay":
+        return ["total(relay_on)", "sum(relay_n)",
+                "min(CASE WHEN relay_n = 0 THEN NULL WHEN relay_on < relay_n THEN 0 ELSE 1 END)",
+                "max(CASE WHEN relay_n = 0 THEN NULL WHEN relay_on > 0 THEN 1 ELSE 0 END)"]
+    return [f"total({metric}_sum)", f"sum({metric}_n)", f"min({metric}_min)", f"max({metric}_max)"]
+
+
+def _partial_select(width, partials, metrics, source, time_column):
+    expressions = [expression for metric in metrics for expression in partials(metric)]
+    columns = ", ".join(f"{expression} AS c{k}" for k, expression in enumerate(expressions))
+    return (f"SELECT {time_column} / {width} * {width} AS b, {columns} FROM {source} "
+            f"WHERE device_id = ? AND {time_column} >= ? AND {time_column} < ? GROUP BY 1")
+
+
+def _merged_columns(metrics):
+    """Outer-query columns that combine partials c0, c1, ... into partials again"""
+    return ", ".join(f"{('total', 'sum', 'min', 'max')[k % 4]}(c{k})" for k in range(4 * len(metrics)))
+
+
+def _raw_sql(schema, metrics):
+    return (f"SELECT ts, {', '.join(metrics)} FROM {schema}.readings "
+            f"WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts")
+
+
+def _partials_sql(parts, metrics):
+    return f"SELECT b, {_merged_columns(metrics)} FROM ({' UNION ALL '.join(parts)}) GROUP BY b ORDER BY b"
+
+
+def pick_resolution(width):
+    """Widest rollup resolution that divides the bucket width, or None"""
+    usable = [name for name, size in RESOLUTIONS.items() if width % size == 0]
+    return max(usable, key=RESOLUTIONS.get) if usable else None
+
+
+class TelemetryHistory:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.rollups = {name for name in RESOLUTIONS if rollup_table(name) in tables}
+        self._device_ids = {}
+
+    def close(self):
+        self.conn.close()
+
+    def device_id(self, device):
+        if isinstance(device, int):
+            return device
+        if device not in self._device_ids:
+            row = self.conn.execute("SELECT device_id FROM devices WHERE name = ?", (device,)).fetchone()
+            if row is None:
+                raise KeyError(f"Unknown device: {device}")
+            self._device_ids[device] = row[0]
+        return self._device_ids[device]
+
+    def _normalize(self, device, metrics, start, end, bucket, agg):
+        metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+        unknown = set(metrics) - set(QUERY_METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {agg}")
+        start, end = parse_time(start), parse_time(end)
+        low = start if start is not None else -2 ** 62
+        high = end if end is not None else 2 ** 62
+        return self.device_id(device), metrics, low, high, parse_bucket(bucket)
+
+    @staticmethod
+    def _partial_parts(schema, rollups, device_id, metrics, low, high, width):
+        """Partial-aggregate selects over one database; returns (parts, params)"""
+        resolution = pick_resolution(width)
+        if resolution not in rollups:
+            resolution = None
+
+        parts, params = [], []
+        edges = [(low, high)]
+        if resolution is not None:
+            size = RESOLUTIONS[resolution]
+            aligned_low = -(-low // size) * size
+            aligned_high = high // size * size
+            if aligned_low < aligned_high:
+                parts.append(_partial_select(width, _rollup_partials, metrics,
+                                             f"{schema}.{rollup_table(resolution)}", "bucket"))
+                params += [device_id, aligned_low, aligned_high]
+                # Unaligned edges of the range come from raw readings
+                edges = [(low, aligned_low), (aligned_high, high)]
+
+        for edge_low, edge_high in edges:
+            if edge_low < edge_high:
+                parts.append(_partial_select(width, _raw_partials, metrics, f"{schema}.readings", "ts"))
+                params += [device_id, edge_low, edge_high]
+        return parts, params
+
+    def _plan(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        """(sql, params) of the one statement query() runs; see query() for the arguments"""
+        device_id, metrics, low, high, width = self._normalize(device, metrics, start, end, bucket, agg)
+        if width is None:
+            return _raw_sql("main", metrics), (device_id, low, high)
+
+        parts, params = self._partial_parts("main", self.rollups, device_id, metrics, low, high, width)
+        if not parts:
+            return None, ()
+        columns = [_FINAL[agg].format(s=f"c{4 * i}", n=f"c{4 * i + 1}", lo=f"c{4 * i + 2}", hi=f"c{4 * i + 3}")
+                   for i in range(len(metrics))]
+        sql = f"SELECT b, {', '.join(columns)} FROM ({' UNION ALL '.join(parts)}) GROUP BY b ORDER BY b"
+        return sql, tuple(params)
+
+    def query(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        """Stream (ts_ms, value per metric) tuples for one device.
+
+        start/end: epoch ms/seconds, datetime or ISO string; end is exclusive.
+        bucket: None for raw readings, or a width ('5m', '1h', '1d' or ms),
+        aggregated with agg (avg/min/max/sum/count) in SQL. Bucket
+        timestamps are UTC-aligned bucket starts.
+        """
+        sql, params = self._plan(device, metrics, start, end, bucket, agg)
+        if sql is None:
+            return
+        yield from self.conn.execute(sql, params)
+
+    def explain(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        """[(sql, query plan lines)] for the statements query() runs"""
+        sql, params = self._plan(device, metrics, start, end, bucket, agg)
+        return [] if sql is None else self._explained([(sql, params)])
+
+    def _explained(self, statements):
+        return [(sql, [row[-1] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)])
+                for sql, params in statements]
+
+    def _statements(self, device_id, metrics, low, high, width):
+        """(sql, params) of the raw rows (width None) or bucket partials, for merging with other databases"""
+        if width is None:
+            yield _raw_sql("main", metrics), (device_id, low, high)
+            return
+        parts, params = self._partial_parts("main", self.rollups, device_id, metrics, low, high, width)
+        if parts:
+            yield _partials_sql(parts, metrics), params
+
+    def _raw_rows(self, device_id, metrics, low, high):
+        """(ts, values...) rows in ts order"""
+        for sql, params in self._statements(device_id, metrics, low, high, None):
+            yield from self.conn.execute(sql, params)
+
+    def _bucket_partials(self, device_id, metrics, low, high, width):
+        """(bucket, partials...) rows in bucket order"""
+        for sql, params in self._statements(device_id, metrics, low, high, width):
+            yield from self.conn.execute(sql, params)
+
+
+def _merge_partials(into, partials):
+    for i in range(0, len(partials), 4):
+        s, n, lo, hi = partials[i:i + 4]
+        into[i] += s or 0.0
+        into[i + 1] += n or 0
+        if lo is not None and (into[i + 2] is None or lo < into[i + 2]):
+            into[i + 2] = lo
+        if hi is not None and (into[i + 3] is None or hi > into[i + 3]):
+            into[i + 3] = hi
+
+
+def _finalize(bucket, partials, agg):
+    values = []
+    for i in range(0, len(partials), 4):
+        s, n, lo, hi = partials[i:i + 4]
+        values.append({"avg": s / n if n else None, "sum": s, "count": n, "min": lo, "max": hi}[agg])
+    return (bucket,) + tuple(values)
+
+
+def _finalized(rows, agg, metric_count):
+    """Final rows from (bucket, partials...) rows in bucket order; equal buckets are merged"""
+    pending = None  # [bucket, partials] not yet known to be complete
+    for row in rows:
+        if pending is not None and pending[0] == row[0]:
+            _merge_partials(pending[1], row[1:])
+            continue
+        if pending is not None:
+            yield _finalize(pending[0], pending[1], agg)
+        pending = [row[0], [0.0, 0, None, None] * metric_count]
+        _merge_partials(pending[1], row[1:])
+    if pending is not None:
+        yield _finalize(pending[0], pending[1], agg)
+
+
+class PartitionedHistory(TelemetryHistory):
+    """Queries over a partitioned_store directory.
+
+    Partitions overlapping the range are ATTACHed a group at a time; each
+    group is aggregated to partials in SQL and adjacent groups are merged
+    while streaming, since a bucket may span partitions.
+    """
+
+    ATTACH_GROUP = 8  # Below SQLite's default limit of 10 attached databases
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.conn = sqlite3.connect(f"file:{os.path.join(directory, CATALOG_NAME)}?mode=ro", uri=True)
+        self.period = self.conn.execute("SELECT value FROM meta WHERE key = 'period'").fetchone()[0]
+        self._device_ids = {}
+
+    def _attach(self, partitions):
+        """Attach partitions as p0, p1, ...; returns [(schema, rollups, start, end)]"""
+        attached = []
+        for i, (start, end, path, _) in enumerate(partitions):
+            schema = f"p{i}"
+            self.conn.execute(f"ATTACH DATABASE ? AS {schema}",
+                              (f"file:{os.path.join(self.directory, path)}?mode=ro",))
+            tables = {row[0] for row in self.conn.execute(
+                f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+            rollups = {name for name in RESOLUTIONS if rollup_table(name) in tables}
+            attached.append((schema, rollups, start, end))
+        return attached
+
+    def _detach(self, attached):
+        for schema, *_ in attached:
+            self.conn.execute(f"DETACH DATABASE {schema}")
+
+    def query(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        device_id, metrics, low, high, width = self._normalize(device, metrics, start, end, bucket, agg)
+        if width is None:
+            yield from self._raw_rows(device_id, metrics, low, high)
+        else:
+            yield from _finalized(self._bucket_partials(device_id, metrics, low, high, width), agg, len(metrics))
+
+    def explain(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        """[(sql, query plan lines)] per partition (raw) or group of partitions (buckets)"""
+        device_id, metrics, low, high, width = self._normalize(device, metrics, start, end, bucket, agg)
+        return self._explained(self._statements(device_id, metrics, low, high, width))
+
+    def _statements(self, device_id, metrics, low, high, width):
+        """(sql, params) per partition (raw rows) or group of partitions (bucket partials),
+        yielded while those partitions are attached"""
+        partitions = list_partitions(self.conn, low, high)
+        group = 1 if width is None else self.ATTACH_GROUP
+        for first in range(0, len(partitions), group):
+            attached = self._attach(partitions[first:first + group])
+            try:
+                if width is None:
+                    yield _raw_sql("p0", metrics), (device_id, low, high)
+                    continue
+                parts, params = [], []
+                for schema, rollups, part_start, part_end in attached:
+                    schema_parts, schema_params = self._partial_parts(
+                        schema, rollups, device_id, metrics, max(low, part_start), min(high, part_end), width)
+                    parts += schema_parts
+                    params += schema_params
+                if parts:
+                    yield _partials_sql(parts, metrics), params
+            finally:
+                self._detach(attached)
+
+    def _raw_rows(self, device_id, metrics, low, high):
+        # Partitions are disjoint in time, so per-partition order is global order
+        for sql, params in self._statements(device_id, metrics, low, high, None):
+            cursor = self.conn.execute(sql, params)
+            try:
+                yield from cursor
+            finally:
+                cursor.close()  # Before the partition is detached
+
+    def _bucket_partials(self, device_id, metrics, low, high, width):
+        # A bucket may span groups; _finalized() merges the repeated bucket
+        for sql, params in self._statements(device_id, metrics, low, high, width):
+            cursor = self.conn.execute(sql, params)
+            try:
+                yield from cursor
+            finally:
+                cursor.close()
+
+
+class ShardedHistory(TelemetryHistory):
+    """Merged read view over the shards of a sharded subscriber.
+
+    Each shard is a single database or a partitioned directory with its
+    own device ids. Raw rows are merged by timestamp; bucketed queries
+    merge every shard's partial aggregates, so a device whose readings
+    were spread over several shards (shared subscriptions) still gets
+    exact averages.
+    """
+
+    def __init__(self, paths):
+        self.histories = [PartitionedHistory(path) if os.path.isdir(path) else TelemetryHistory(path)
+                          for path in paths]
+        if not self.histories:
+            raise ValueError("No shards to query")
+
+    @classmethod
+    def discover(cls, path):
+        """Open every shard written for a --db path or --partition-dir"""
+        return cls(shard_paths(path))
+
+    def close(self):
+        for history in self.histories:
+            history.close()
+
+    def device_id(self, device):
+        return device  # Resolved per shard in query()
+
+    def _shards(self, device):
+        """(history, device id) of every shard that knows the device"""
+        shards = []
+        for history in self.histories:
+            try:
+                shards.append((history, history.device_id(device)))
+            except KeyError:
+                continue
+        if not shards:
+            raise KeyError(f"Unknown device: {device}")
+        return shards
+
+    def explain(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        """[(sql, query plan lines)] of every shard's statements, labelled with the shard"""
+        device, metrics, low, high, width = self._normalize(device, metrics, start, end, bucket, agg)
+        plans = []
+        for history, device_id in self._shards(device):
+            label = getattr(history, "directory", None) or history.db_path
+            plans += [(f"-- shard {label}\n{sql}", lines) for sql, lines in
+                      history._explained(history._statements(device_id, metrics, low, high, width))]
+        return plans
+
+    def query(self, device, metrics=QUERY_METRICS, start=None, end=None, bucket=None, agg="avg"):
+        device, metrics, low, high, width = self._normalize(device, metrics, start, end, bucket, agg)
+        streams = [history._raw_rows(device_id, metrics, low, high) if width is None
+                   else history._bucket_partials(device_id, metrics, low, high, width)
+                   for history, device_id in self._shards(device)]
+        merged = heapq.merge(*streams, key=itemgetter(0))
+        if width is None:
+            yield from merged
+        else:
+            yield from _finalized(merged, agg, len(metrics))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query stored air quality history")
+    parser.add_argument("--db", default="air_quality.db")
+    parser.add_argument("--partition-dir", help="Query a partitioned store directory instead of --db")
+    parser.add_argument("--sharded", action="store_true",
+                        help="Query every shard written by a sharded subscriber for --db/--partition-dir")
+    parser.add_argument("--device", required=True, help="Device name or numeric id")
+    parser.add_argument("--metrics", default=",".join(QUERY_METRICS),
+                        help=f"Comma-separated subset of {','.join(QUERY_METRICS)}")
+    parser.add_argument("--start", help="ISO date/time or epoch seconds/ms (inclusive)")
+    parser.add_argument("--end", help="ISO date/time or epoch seconds/ms (exclusive)")
+    parser.add_argument("--bucket", help="Aggregate into buckets: 30s, 5m, 1h, 1d ...")
+    parser.add_argument("--agg", default="avg", choices=AGGREGATES)
+    parser.add_argument("--format", default="csv", choices=["csv", "json"])
+    parser.add_argument("--explain", action="store_true",
+                        help="Print the SQLite query plan of every statement instead (per partition group/shard)")
+    args = parser.parse_args()
+
+    if args.sharded:
+        history = ShardedHistory.discover(args.partition_dir or args.db)
+    elif args.partition_dir:
+        history = PartitionedHistory(args.partition_dir)
+    else:
+        history = TelemetryHistory(args.db)
+    device = int(args.device) if args.device.isdigit() else args.device
+    metrics = args.metrics.split(",")
+
+    if args.explain:
+        plans = history.explain(device, metrics, args.start, args.end, args.bucket, args.agg)
+        for sql, lines in plans:
+            print(sql)
+            for line in lines:
+                print(f"  {line}")
+        if not plans:
+            print("No statements: nothing stored in the range")
+        history.close()
+        return
+
+    started = time.perf_counter()
+    rows = 0
+    if args.format == "csv":
+        print(",".join(["ts"] + metrics))
+    for row in history.query(device, metrics, args.start, args.end, args.bucket, args.agg):
+        rows += 1
+        if args.format == "csv":
+            print(",".join("" if value is None else str(value) for value in row))
+        else:
+            print(json.dumps(dict(zip(["ts"] + metrics, row))))
+    history.close()
+    print(f"{rows} rows in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+SQLite telemetry stores used by the batched writer
+- RawTelemetryStore: legacy (topic, value, received_at) text rows
+- ReadingStore: one typed row per reading, keyed by (device_id, ts)
+"""
+
+import glob
+import os
+import sqlite3
+from datetime import datetime
+
+METRICS = ("pm25", "pm10", "co2", "temperature", "humidity")
+READING_COLUMNS = ("device_id", "ts") + METRICS + ("relay", "status")
+
+RAW_SCHEMA_SQL = ['''CREATE TABLE IF NOT EXISTS telemetry
+                     (topic TEXT, value TEXT, received_at TEXT)''']
+
+READING_SCHEMA_SQL = [
+    '''CREATE TABLE IF NOT EXISTS devices
+       (device_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)''',
+    # ts is epoch milliseconds; the primary key doubles as the (device, time) index
+    '''CREATE TABLE IF NOT EXISTS readings
+       (device_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        pm25 REAL, pm10 REAL, co2 REAL, temperature REAL, humidity REAL,
+        relay INTEGER,
+        status INTEGER,
+        PRIMARY KEY (device_id, ts)) WITHOUT ROWID''',
+]
+
+
+def shard_path(path, shard):
+    """Database file (or partition directory) of one ingest shard: air_quality.db -> air_quality.shard03.db"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard:02d}{ext}"
+
+
+def shard_paths(path):
+    """Existing shard files/directories of a sharded store, in shard order"""
+    root, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.shard[0-9][0-9]{glob.escape(ext)}"))
+
+
+def connect(db_path, synchronous="NORMAL"):
+    """Open a connection tuned for append-heavy ingestion"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return conn
+
+
+class SQLiteStore:
+    """Base store: owns one connection, created on the thread that calls open()"""
+
+    schema_sql = []
+
+    def __init__(self, db_path, synchronous="NORMAL"):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.conn = None
+
+    def open(self):
+        self.conn = connect(self.db_path, self.synchronous)
+        for statement in self.schema_sql:
+            self.conn.execute(statement)
+        self.conn.commit()
+        return self
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class RawTelemetryStore(SQLiteStore):
+    """Rows: (topic, value, received_at); received_at is an ISO string or epoch
+    seconds, formatted here on the writer thread rather than per message"""
+
+    schema_sql = RAW_SCHEMA_SQL
+
+    def write(self, rows):
+        self.conn.executemany("INSERT INTO telemetry VALUES (?, ?, ?)", (
+            row if isinstance(row[2], str) else (row[0], row[1], datetime.fromtimestamp(row[2]).isoformat())
+            for row in rows))
+
+
+class ReadingStore(SQLiteStore):
+    """Rows: (device_name, ts_ms, pm25, pm10, co2, temperature, humidity, relay, status)"""
+
+    schema_sql = READING_SCHEMA_SQL
+    insert_sql = f"INSERT OR IGNORE INTO readings VALUES ({', '.join('?' * len(READING_COLUMNS))})"
+
+    def __init__(self, db_path, synchronous="NORMAL"):
+        super().__init__(db_path, synchronous)
+        self._device_ids = {}
+
+    def open(self):
+        super().open()
+        self._device_ids = dict(self.conn.execute("SELECT name, device_id FROM devices"))
+        return self
+
+    def device_id(self, name):
+        """Return the integer id for a device name, registering it if new"""
+        device_id = self._device_ids.get(name)
+        if device_id is None:
+            self.conn.execute("INSERT OR IGNORE INTO devices (name) VALUES (?)", (name,))
+            device_id = self.conn.execute(
+                "SELECT device_id FROM devices WHERE name = ?", (name,)).fetchone()[0]
+            self._device_ids[name] = device_id
+        return device_id
+
+    def write(self, rows):
+        ids = self._device_ids
+        self.write_ids([
+            (ids.get(row[0]) or self.device_id(row[0]),) + tuple(row[1:]) for row in rows
+        ])
+
+    def write_ids(self, rows):
+        """Insert rows whose first column is already an integer device_id"""
+        self.conn.executemany(self.insert_sql, rows)
+
+    def rollback(self):
+        super().rollback()
+        # Ids registered in the rolled-back transaction no longer exist
+        self._device_ids = dict(self.conn.execute("SELECT name, device_id FROM devices"))
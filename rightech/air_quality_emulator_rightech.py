@@ -3,17 +3,36 @@ Air Quality Emulator for Rightech IoT Cloud (RIC)
 Publishes random data to RIC via MQTT - UPDATED VERSION
 """
 
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
 import time
-import random
 import paho.mqtt.client as mqtt
 from datetime import datetime
 
+from common.metrics import register_outbox, start_metrics
+from common.outbox import Outbox
+from common.payload_codec import PAYLOAD_FORMATS, encode_binary, encode_json
+from common.publisher import Publisher
+from common.scheduler import Scheduler, random_latency
+from common.sinks import ConsoleSink, MQTTSink, MultiSink, add_sink_arguments, build_sinks
+from common.sensor_model import generate_rightech_data, rightech_messages
+
 class AirQualityEmulatorRIC:
     def __init__(self, device_id="mqtt-duczuyvu12-9qx79c",
                  broker="dev.rightech.io", port=1883,
                  username="livingroom-username",
                  password="living",
-                 object_id="69032e296dffe6c39bbb2cd0"):
+                 object_id="69032e296dffe6c39bbb2cd0",
+                 payload_format="per-topic",
+                 spool_dir=".outbox",
+                 metrics_port=None,
+                 interval=30.0,
+                 drain_rate=500.0,
+                 max_inflight=100,
+                 qos0_topics=()):
         
         self.device_id = device_id
         self.broker = broker
@@ -21,6 +40,8 @@ class AirQualityEmulatorRIC:
         self.username = username
         self.password = password
         self.object_id = object_id
+        # Định dạng payload: per-topic (mặc định), json hoặc binary (1 message/lần đọc)
+        self.payload_format = payload_format
         
         # Dựa trên state data từ API response, có vẻ Rightech dùng topic dạng "base/state/<sensor>"
         self.topic_base = "base/state"
@@ -28,147 +49,161 @@ class AirQualityEmulatorRIC:
         # Tạo MQTT client với client_id duy nhất
         self.client = mqtt.Client(client_id=f"emulator_{device_id}", protocol=mqtt.MQTTv311)
         self.client.username_pw_set(username, password)
-        self.interval = 30
+        # Chu kỳ đọc cố định theo đồng hồ monotonic (không trôi dù gửi/in chậm)
+        self.interval = interval
+        self.scheduler = Scheduler()
 
-        # Kết nối tới Rightech
-        try:
-            self.client.connect(self.broker, self.port, keepalive=60)
-            print(f"✅ Kết nối thành công tới Rightech IoT Cloud: {self.broker}:{self.port}")
-            print(f"📡 Device ID: {self.device_id}")
-            print(f"📦 Object ID: {self.object_id}")
-            print(f"📊 Topic base: {self.topic_base}/<sensor>")
-        except Exception as e:
-            print(f"❌ Lỗi kết nối tới Rightech: {e}")
-            exit(1)
+        # Kết nối tới Rightech qua hàng đợi outbox: khi mất kết nối, dữ liệu được
+        # lưu xuống đĩa và tự kết nối lại (backoff) thay vì thoát chương trình.
+        # Publisher giới hạn số message QoS 1 chưa được ack; topic trong qos0_topics gửi QoS 0
+        self.publisher = Publisher(self.client, max_inflight, qos0_topics)
+        self.outbox = Outbox(self.client, os.path.join(spool_dir, device_id),
+                             max_rate=drain_rate or None, publisher=self.publisher).start(
+            self.broker, self.port, keepalive=60)
+        print(f"🔄 Đang kết nối tới Rightech IoT Cloud: {self.broker}:{self.port}")
+        print(f"📡 Device ID: {self.device_id}")
+        print(f"📦 Object ID: {self.object_id}")
+        print(f"📊 Topic base: {self.topic_base}/<sensor>")
+        print(f"📥 Hàng đợi từ lần chạy trước: {self.outbox.depth} message")
 
-    def generate_sensor_data(self):
-        """Tạo dữ liệu cảm biến ngẫu nhiên với logic thực tế"""
-        # PM2.5: 5-100 µg/m³, thường 15-35, nguy hiểm >35
-        pm25 = max(5, min(100, random.gauss(25, 10)))
-        
-        # PM10: thường cao hơn PM2.5 10-30 µg/m³
-        pm10 = max(10, pm25 + random.uniform(5, 25))
-        
-        # CO2: 400-2000 ppm, thường 400-800, nguy hiểm >1000
-        co2 = max(400, min(2000, random.gauss(600, 150)))
-        
-        # Nhiệt độ: 18-32°C, comfort: 22-26°C
-        temperature = max(18, min(32, random.gauss(24, 3)))
-        
-        # Độ ẩm: 30-80%, comfort: 40-60%
-        humidity = max(30, min(80, random.gauss(50, 10)))
-        
-        # Logic điều khiển relay (máy lọc không khí)
-        relay_state = pm25 > 35 or pm10 > 50 or co2 > 1000
-        
-        # Trạng thái cảnh báo
-        if pm25 > 35 or pm10 > 50 or co2 > 1000:
-            status = "DANGER"
-        elif pm25 > 25 or pm10 > 35 or co2 > 800:
-            status = "WARNING"
-        else:
-            status = "GOOD"
-
-        return {
-            "pm25": round(pm25, 1),
-            "pm10": round(pm10, 1),
-            "co2": int(co2),
-            "temperature": round(temperature, 1),
-            "humidity": round(humidity, 1),
-            "relay_state": 1 if relay_state else 0,
-            "status": status,
-            "online": True,  # Quan trọng: thiết bị online
-            "timestamp": int(time.time() * 1000)  # Rightech dùng timestamp milliseconds
+        # Số liệu Prometheus (/metrics): hàng đợi, độ trễ ack, số lần kết nối lại
+        register_outbox(self.outbox)
+        self.metrics = start_metrics(metrics_port)
+
+        # Đầu ra của mỗi lần đọc: MQTT + in đầy đủ ra console (đổi bằng configure_output)
+        self.mqtt_sink = MQTTSink(self.outbox, self.messages)
+        self.sink = MultiSink([self.mqtt_sink, ConsoleSink(self.render)])
+        self.verbose = True  # In dòng tiến trình của từng chu kỳ
+
+    def configure_output(self, args):
+        """Chọn sink console/file theo các tùy chọn của add_sink_arguments()"""
+        self.sink = build_sinks(args, self.render, self.mqtt_sink)
+        self.verbose = args.output == "full"
+
+    def generate_sensor_data(self, ts=None):
+        """Tạo dữ liệu cảm biến ngẫu nhiên với logic thực tế (mốc thời gian `ts` ms, mặc định là hiện tại)"""
+        data = generate_rightech_data(ts=ts)
+        data.device_id = self.device_id  # Để file log NDJSON ghi đúng thiết bị
+        return data
+
+    def messages(self, data):
+        """Danh sách (topic, payload) cho một lần đọc theo định dạng đã chọn"""
+        if self.payload_format == "json":
+            return [(self.topic_base, encode_json(data))]
+        if self.payload_format == "binary":
+            return [(f"{self.topic_base}/packed", encode_binary(data))]
+        return rightech_messages(data, self.topic_base)
+
+    def render(self, data):
+        """Khối hiển thị của một lần đọc (chỉ tạo cho các lần đọc được in ra console)"""
+        # Các giá trị của object state trên Rightech
+        state_data = {
+            "temperature": data['temperature'],
+            "humidity": data['humidity'],
+            "pm25": data['pm25'],
+            "pm10": data['pm10'],
+            "co2": data['co2'],
+            "online": data['online'],
+            "timestamp": data['timestamp']
         }
+        stats = self.outbox.stats()
+        return (f"\n{'='*60}\n"
+                f"🌫️ AIR QUALITY DATA - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"{'='*60}\n"
+                f"📟 Device:      {self.device_id}\n"
+                f"🔴 PM2.5:       {data['pm25']} µg/m³ {'🚨 Warning' if data['pm25'] > 35 else ''}\n"
+                f"🟠 PM10:        {data['pm10']} µg/m³ {'🚨 Warning' if data['pm10'] > 50 else ''}\n"
+                f"💨 CO2:         {data['co2']} ppm {'🚨 Warning' if data['co2'] > 1000 else ''}\n"
+                f"🌡️  Temp:        {data['temperature']}°C\n"
+                f"💧 Humidity:    {data['humidity']}%\n"
+                f"🔌 Relay:       {'🔴 ON' if data['relay_state'] else '🟢 OFF'}\n"
+                f"📊 Status:      {data['status']}\n"
+                f"🟢 Online:      {data['online']}\n"
+                f"✅ Đã đưa {len(state_data)} sensors vào hàng đợi gửi lên Rightech "
+                f"({'🟢 online' if stats['connected'] else '🔴 offline'}, "
+                f"tồn {stats['depth']} message, {stats['spill_bytes']} bytes trên đĩa)\n"
+                f"📡 Topic pattern: {self.topic_base}/<sensor_name>\n"
+                f"{'='*60}\n")
 
-    def display_and_publish(self, data):
-        """Hiển thị và gửi dữ liệu lên RIC"""
-        print(f"\n{'='*60}")
-        print(f"🌫️ AIR QUALITY DATA - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"{'='*60}")
-        print(f"📟 Device:      {self.device_id}")
-        print(f"🔴 PM2.5:       {data['pm25']} µg/m³ {'🚨 Warning' if data['pm25'] > 35 else ''}")
-        print(f"🟠 PM10:        {data['pm10']} µg/m³ {'🚨 Warning' if data['pm10'] > 50 else ''}")
-        print(f"💨 CO2:         {data['co2']} ppm {'🚨 Warning' if data['co2'] > 1000 else ''}")
-        print(f"🌡️  Temp:        {data['temperature']}°C")
-        print(f"💧 Humidity:    {data['humidity']}%")
-        print(f"🔌 Relay:       {'🔴 ON' if data['relay_state'] else '🟢 OFF'}")
-        print(f"📊 Status:      {data['status']}")
-        print(f"🟢 Online:      {data['online']}")
+    def sample(self, tick):
+        """Một lần đọc theo lịch; độ trễ đọc cảm biến đã được scheduler áp dụng"""
+        if self.verbose:
+            total = f"/{tick.task.count}" if tick.task.count else ""
+            print(f"\n📦 Chu kỳ #{tick.index + 1}{total} (đọc cảm biến {tick.latency:.2f}s)")
 
+        # Tạo dữ liệu và chuyển cho các sink (MQTT, console, file log)
         try:
-            # Gửi từng giá trị sensor theo topic structure từ API response
-            self.client.publish(f"{self.topic_base}/pm25", data['pm25'], qos=1)
-            self.client.publish(f"{self.topic_base}/pm10", data['pm10'], qos=1)
-            self.client.publish(f"{self.topic_base}/co2", data['co2'], qos=1)
-            self.client.publish(f"{self.topic_base}/temperature", data['temperature'], qos=1)
-            self.client.publish(f"{self.topic_base}/humidity", data['humidity'], qos=1)
-            self.client.publish(f"{self.topic_base}/relay_state", data['relay_state'], qos=1)
-            self.client.publish(f"{self.topic_base}/status", data['status'], qos=1)
-            self.client.publish(f"{self.topic_base}/online", data['online'], qos=1)
-            
-            # Có thể publish cả object state nếu cần
-            state_data = {
-                "temperature": data['temperature'],
-                "humidity": data['humidity'],
-                "pm25": data['pm25'],
-                "pm10": data['pm10'],
-                "co2": data['co2'],
-                "online": data['online'],
-                "timestamp": data['timestamp']
-            }
-            
-            print(f"✅ Gửi thành công {len(state_data)} sensors lên Rightech")
-            print(f"📡 Topic pattern: {self.topic_base}/<sensor_name>")
-            
+            # Mốc thời gian lấy theo lưới của scheduler: interval < 1s vẫn không trùng ms
+            self.sink.write(self.generate_sensor_data(int(tick.wall_time() * 1000)))
         except Exception as e:
             print(f"❌ Lỗi gửi dữ liệu: {e}")
 
-        print(f"{'='*60}")
-
-    def run(self):
-        """Chạy emulator"""
-        max_cycles = 3
+        # Chu kỳ sau bắt đầu đúng mốc lưới, không cộng dồn thời gian đọc/gửi
+        if self.verbose and not tick.last:
+            print(f"⏳ Chờ {tick.until_next():.2f}s đến chu kỳ tiếp theo...")
 
+    def run(self, cycles=3, duration=None):
+        """Chạy emulator: `cycles` lần đọc (None: không giới hạn) hoặc trong `duration` giây"""
         print(f"\n🚀 BẮT ĐẦU GỬI DỮ LIỆU LÊN RIGHTECH IOT CLOUD")
-        print(f"⏰ Interval: {self.interval}s | Số chu kỳ: {max_cycles}")
+        print(f"⏰ Interval: {self.interval}s | Số chu kỳ: {cycles or 'không giới hạn'}"
+              f"{f' | Thời gian: {duration}s' if duration else ''}")
         print(f"🔧 Broker: {self.broker}:{self.port}")
-        
-        cycle = 0        
-        
+
         try:
-            while cycle < max_cycles:
-                cycle += 1
-                print(f"\n📦 Chu kỳ #{cycle}/{max_cycles}")
-                
-                # Mô phỏng thời gian đọc cảm biến
-                time.sleep(random.uniform(1.0, 2.0))
-                
-                # Tạo và gửi dữ liệu
-                data = self.generate_sensor_data()
-                self.display_and_publish(data)
-                
-                # Chờ giữa các chu kỳ (trừ chu kỳ cuối)
-                if cycle < max_cycles:
-                    print(f"⏳ Chờ {self.interval}s đến chu kỳ tiếp theo...")
-                    time.sleep(self.interval)
-                    
+            # Mô phỏng thời gian đọc cảm biến 1-2s (thu nhỏ nếu interval ngắn)
+            self.scheduler.every(self.interval, self.sample, count=cycles,
+                                 latency=random_latency(1.0, 2.0, self.interval), name=self.device_id)
+            self.scheduler.run(duration)
         except KeyboardInterrupt:
             print("\n⏹️ Dừng bởi người dùng.")
         finally:
             # Gửi trạng thái offline trước khi disconnect
             try:
                 offline_data = {"online": False, "timestamp": int(time.time() * 1000)}
-                self.client.publish(f"{self.topic_base}/online", False, qos=1)
+                self.outbox.publish(f"{self.topic_base}/online", False, qos=1)
                 print("📴 Đã gửi trạng thái offline")
             except:
                 pass
-                
-            self.client.disconnect()
+
+            # Gửi nốt hàng đợi; phần còn lại giữ trên đĩa cho lần chạy sau
+            self.sink.close()
+            self.outbox.close()
+            if self.metrics:
+                self.metrics.stop()
+            stats = self.outbox.stats()
+            print(f"📤 Đã gửi {stats['drained']} message, còn {stats['depth']} message trên đĩa")
+            latency = stats["publisher"]["ack_latency_ms"]
+            if latency["count"]:
+                print(f"⏱️ Độ trễ publish->ack: p50 {latency['p50']} ms, p99 {latency['p99']} ms")
+            schedule = self.scheduler.stats()
+            if schedule["ticks"]:
+                late = schedule["lateness_ms"]
+                print(f"⏱️ Lịch đọc: {schedule['ticks']} lần, {schedule['overruns']} lần quá hạn, "
+                      f"bỏ lỡ {schedule['missed']} | jitter p50 {late['p50']} ms, "
+                      f"p99 {late['p99']} ms, max {late['max']} ms")
             print("🔌 Đã ngắt kết nối khỏi Rightech IoT Cloud.")
 
 # === MAIN ===
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Air Quality Emulator for Rightech IoT Cloud")
+    parser.add_argument("--payload", default="per-topic", choices=PAYLOAD_FORMATS,
+                        help="per-topic: 8 message base/state/<sensor>; json/binary: 1 message")
+    parser.add_argument("--spool-dir", default=".outbox",
+                        help="Thư mục lưu message chưa gửi khi mất kết nối")
+    parser.add_argument("--drain-rate", type=float, default=500.0,
+                        help="Số message/s khi gửi lại hàng đợi trên đĩa sau khi mất kết nối; "
+                             "dữ liệu mới không bị giới hạn (0 = không giới hạn)")
+    parser.add_argument("--max-inflight", type=int, default=100, help="Số message QoS 1 chưa được ack tối đa")
+    parser.add_argument("--qos0-topic", action="append", default=[],
+                        help="Topic filter gửi QoS 0, không qua hàng đợi outbox (dùng nhiều lần được)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Cổng HTTP cho Prometheus /metrics (và /profile)")
+    parser.add_argument("--interval", type=float, default=30.0, help="Số giây giữa hai lần đọc (tối thiểu 0.01)")
+    parser.add_argument("--cycles", type=int, default=3, help="Số lần đọc; 0 = chạy đến khi Ctrl+C hoặc hết --duration")
+    parser.add_argument("--duration", type=float, help="Dừng sau số giây này")
+    add_sink_arguments(parser)
+    args = parser.parse_args()
+
     print("🌐 Air Quality Emulator for Rightech IoT Cloud")
     print("=" * 50)
     
@@ -177,6 +212,14 @@ if __name__ == "__main__":
         device_id="mqtt-duczuyvu12-9qx79c",      # Khớp với field "id" trong API
         username="livingroom-username",          # Giữ nguyên
         password="living",                       # Giữ nguyên  
-        object_id="69032e296dffe6c39bbb2cd0"    # Object ID thực từ API _id field
+        object_id="69032e296dffe6c39bbb2cd0",   # Object ID thực từ API _id field
+        payload_format=args.payload,
+        spool_dir=args.spool_dir,
+        metrics_port=args.metrics_port,
+        interval=args.interval,
+        drain_rate=args.drain_rate,
+        max_inflight=args.max_inflight,
+        qos0_topics=args.qos0_topic
     )
-    emulator.run()
+    emulator.configure_output(args)
+    emulator.run(args.cycles or None, args.duration)
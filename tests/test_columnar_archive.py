@@ -0,0 +1,83 @@
+"""Columnar archive: late rows are found by the recheck, unchanged partitions are not re-counted"""
+
+import sqlite3
+
+import pytest
+
+from mqtt import columnar_archive
+from mqtt.columnar_archive import ColumnArchive, _recheck_periods, compact_partitions, compact_store
+from mqtt.partitioned_store import DAY_MS, PartitionedStore
+from mqtt.telemetry_store import READING_SCHEMA_SQL
+
+NOW = 1_714_521_600_000 + 12 * 3_600_000  # Noon
+
+
+def reading(ts, device="air_monitor_001"):
+    return (device, ts, 12.3, 25.8, 415, 22.4, 48.1, 0, 0)
+
+
+def archived_store(directory):
+    """A store whose sealed yesterday partition is already archived"""
+    store = PartitionedStore(str(directory / "store"), maintenance_interval=1e9).open()
+    store.write([reading(NOW - DAY_MS + i) for i in range(10)])
+    store.commit()
+    store.maintain(NOW)
+    assert compact_partitions(str(directory / "store"), str(directory / "archive")) == (1, 10, 0)
+    return store
+
+
+def add_late_row(store):
+    """Late row written and the partition sealed again between two compaction passes"""
+    store.write([reading(NOW - DAY_MS + 100)])
+    store.commit()
+    store.maintain(NOW)
+
+
+def test_unchanged_partition_is_not_recounted(tmp_path, monkeypatch):
+    store = archived_store(tmp_path)
+    opened = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(columnar_archive.sqlite3, "connect",
+                        lambda path, *args, **kwargs: opened.append(path) or connect(path, *args, **kwargs))
+    assert compact_partitions(str(tmp_path / "store"), str(tmp_path / "archive"), recheck=None) == (0, 0, 0)
+    assert not [path for path in opened if "readings_" in path]
+    store.close()
+
+
+@pytest.mark.parametrize("recheck, late", [(None, 1), (1, 1), (0, 0)])
+def test_recheck_periods(tmp_path, recheck, late):
+    store = archived_store(tmp_path)
+    add_late_row(store)
+    assert compact_partitions(str(tmp_path / "store"), str(tmp_path / "archive"), recheck)[2] == late
+    assert ColumnArchive(str(tmp_path / "archive")).rows == 10 + late
+    store.close()
+
+
+def test_recheck_periods_option():
+    assert _recheck_periods("all") is None
+    assert _recheck_periods("0") == 0
+    assert _recheck_periods("3") == 3
+    with pytest.raises(Exception):
+        _recheck_periods("-1")
+
+
+def test_store_recheck_rebuilds_only_changed_periods(tmp_path):
+    db_path = str(tmp_path / "air_quality.db")
+    conn = sqlite3.connect(db_path)
+    for statement in READING_SCHEMA_SQL:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO devices VALUES (?, ?)", [(1, "air_monitor_001"), (2, "air_monitor_002")])
+    conn.executemany("INSERT INTO readings VALUES (?, ?, 12.3, 25.8, 415, 22.4, 48.1, 0, 0)",
+                     [(device_id, NOW - days * DAY_MS + i) for device_id in (1, 2) for days in (1, 2) for i in (0, 5)])
+    conn.commit()
+    archive = str(tmp_path / "archive")
+    assert compact_store(db_path, archive, now_ms=NOW, grace_ms=0) == (2, 8, 0)
+    assert compact_store(db_path, archive, now_ms=NOW, grace_ms=0) == (0, 0, 0)
+
+    conn.execute("INSERT INTO readings VALUES (2, ?, 1, 1, 1, 1, 1, 0, 0)", (NOW - 2 * DAY_MS + 1,))
+    conn.commit()
+    conn.close()
+    assert compact_store(db_path, archive, now_ms=NOW, grace_ms=0, recheck=0) == (0, 0, 0)
+    assert compact_store(db_path, archive, now_ms=NOW, grace_ms=0, recheck=1) == (0, 0, 0)
+    assert compact_store(db_path, archive, now_ms=NOW, grace_ms=0, recheck=2) == (0, 0, 1)
+    assert ColumnArchive(archive).rows == 9
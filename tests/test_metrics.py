@@ -0,0 +1,59 @@
+"""Registry and profiler endpoint: repeat registration, bad intervals"""
+
+import urllib.error
+import urllib.request
+
+import pytest
+
+from common.metrics import MetricsServer, Registry, SamplingProfiler, register_writer
+from mqtt.sqlite_writer import BatchedWriter
+
+
+def test_same_metric_registered_twice_is_shared():
+    registry = Registry()
+    first = registry.counter("received_total", "Messages", labels=("topic",))
+    second = registry.counter("received_total", "Messages", labels=("topic",))
+    assert first is second
+    first.labels("pm25").inc()
+    second.labels("pm25").inc()
+    assert 'received_total{topic="pm25"} 2' in registry.render()
+
+
+def test_callback_registered_again_reads_the_newest_component():
+    registry = Registry()
+    register_writer(BatchedWriter(None), registry)
+    writer = BatchedWriter(None)
+    writer.rows_written = 7
+    register_writer(writer, registry)
+    assert "sqlite_writer_rows_written_total 7" in registry.render()
+
+
+def test_name_reused_for_another_kind_raises():
+    registry = Registry()
+    registry.counter("depth", "Depth")
+    with pytest.raises(ValueError):
+        registry.gauge("depth", "Depth")
+    with pytest.raises(ValueError):
+        registry.counter("depth", "Depth", labels=("topic",))
+
+
+@pytest.mark.parametrize("interval", [0, -0.005, float("nan"), float("inf")])
+def test_profiler_rejects_bad_interval(interval):
+    with pytest.raises(ValueError):
+        SamplingProfiler(interval)
+    with pytest.raises(ValueError):
+        SamplingProfiler().start(interval)
+
+
+@pytest.mark.parametrize("interval_ms", ["0", "-5", "nan", "fast"])
+def test_profile_endpoint_rejects_bad_interval(interval_ms):
+    profiler = SamplingProfiler()
+    server = MetricsServer(Registry(), port=0, profiler=profiler).start()
+    try:
+        url = f"http://127.0.0.1:{server.port}/profile?action=start&interval_ms={interval_ms}"
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url, timeout=5)
+        assert error.value.code == 400
+        assert not profiler.running
+    finally:
+        server.stop()
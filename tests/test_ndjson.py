@@ -0,0 +1,67 @@
+"""NDJSON export -> import: every stored reading comes back, sub-second ones included"""
+
+import sqlite3
+
+import pytest
+
+from common.ndjson import format_record
+from data_structure.air_quality_ndjson import _single_source, export_ndjson, import_ndjson
+from mqtt.telemetry_store import ReadingStore
+
+ROWS = [
+    ("air_monitor_001", 1_714_521_600_000, 12.3, 25.8, 415, 22.4, 48.1, 0, 0),
+    ("air_monitor_001", 1_714_521_600_250, 12.4, 25.9, 416, 22.4, 48.2, 0, 0),  # Same second
+    ("air_monitor_001", 1_714_521_600_500, 12.5, 26.0, 417, 22.5, 48.2, 1, 1),
+    ("air_monitor_002", 1_714_521_601_999, 57.0, 71.5, 1830, 27.9, 69.9, 1, 2),
+    ("air_monitor_002", 1_714_521_602_000, None, 71.0, 1820, None, 69.0, None, None),
+]
+
+
+def stored(path):
+    conn = sqlite3.connect(path)
+    names = dict(conn.execute("SELECT device_id, name FROM devices"))
+    rows = [(names[row[0]],) + row[1:] for row in conn.execute("SELECT * FROM readings ORDER BY device_id, ts")]
+    conn.close()
+    return rows
+
+
+def write_store(path, rows):
+    store = ReadingStore(str(path)).open()
+    store.write(rows)
+    store.commit()
+    store.close()
+
+
+@pytest.mark.parametrize("timestamp_ms", [False, True])
+def test_export_import_round_trip(tmp_path, timestamp_ms):
+    source, dump, target = tmp_path / "source.db", str(tmp_path / "dump.ndjson.gz"), tmp_path / "target.db"
+    write_store(source, ROWS)
+    assert export_ndjson(dump, _single_source(str(source)), -2 ** 62, 2 ** 62, timestamp_ms=timestamp_ms) == len(ROWS)
+
+    store = ReadingStore(str(target)).open()
+    try:
+        assert import_ndjson(dump, store) == (len(ROWS), 0)
+    finally:
+        store.close()
+    assert stored(str(target)) == stored(str(source)) == ROWS
+
+
+def test_timestamps_in_seconds_only_when_whole():
+    assert '"timestamp": 1714521600,' in format_record(ROWS[0])
+    assert '"timestamp": 1714521600250,' in format_record(ROWS[1])
+    assert '"timestamp": 1714521600000,' in format_record(ROWS[0], timestamp_ms=True)
+
+
+def test_backfill_file_imports(tmp_path):
+    from mqtt.backfill_history import NDJSONSink, backfill
+
+    dump, target = str(tmp_path / "backfill.ndjson"), str(tmp_path / "target.db")
+    sink = NDJSONSink(dump, 3)
+    backfill(sink, 3, 40, start_ts=1_714_521_600, step=1, seed=1, progress=False)
+
+    store = ReadingStore(target).open()
+    try:
+        assert import_ndjson(dump, store) == (120, 0)
+    finally:
+        store.close()
+    assert len(stored(target)) == 120
@@ -0,0 +1,171 @@
+"""SegmentLog durability: what was appended or prepended comes back in order after a restart,
+and the Outbox in front of it shuts down even when the broker stops acking"""
+
+import os
+import time
+
+from common.outbox import Outbox, SegmentLog
+from common.publisher import Publisher
+
+
+def messages(prefix, count):
+    return [(f"v1/devices/{prefix}/telemetry", f"{prefix}-{i}".encode(), 1) for i in range(count)]
+
+
+def drain(log, commit=True):
+    """Every record in order, following read positions like the drain thread does"""
+    records, position = [], None
+    while True:
+        batch, next_position = log.read(7, position)
+        if not batch:
+            return records
+        records += batch
+        position = next_position
+        if commit:
+            log.commit(position)
+            position = None
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("seg_"))
+
+
+def test_append_read_commit_across_restart(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=256)
+    for i in range(0, 20, 4):
+        log.append(messages("a", 20)[i:i + 4])  # A new segment is started once one is full
+    assert len(segment_files(tmp_path)) > 1
+    batch, position = log.read(5)
+    assert batch == messages("a", 20)[:5]
+    log.commit(position)
+
+    reopened = SegmentLog(str(tmp_path), segment_bytes=256)
+    assert reopened.records == 15
+    assert reopened.bytes == log.bytes
+    assert drain(reopened) == messages("a", 20)[5:]
+    assert reopened.records == 0 and reopened.bytes == 0
+    assert SegmentLog(str(tmp_path)).records == 0
+
+
+def test_uncommitted_reads_are_read_again_after_restart(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=256)
+    for i in range(0, 12, 3):
+        log.append(messages("a", 12)[i:i + 3])
+    assert drain(log, commit=False) == messages("a", 12)
+    assert drain(SegmentLog(str(tmp_path), segment_bytes=256)) == messages("a", 12)
+
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append(messages("a", 3))
+    (name,) = segment_files(tmp_path)
+    path = os.path.join(tmp_path, name)
+    intact = os.path.getsize(path)
+    # Crash mid-append: only part of the fourth record reached the disk
+    with open(path, "ab") as file:
+        file.write(SegmentLog._encode(*messages("b", 1)[0])[:-3])
+
+    reopened = SegmentLog(str(tmp_path))
+    assert reopened.records == 3
+    assert os.path.getsize(path) == intact
+    reopened.append(messages("c", 2))
+    assert drain(reopened) == messages("a", 3) + messages("c", 2)
+
+
+def test_corrupt_record_ends_its_segment(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append(messages("a", 3))
+    (name,) = segment_files(tmp_path)
+    path = os.path.join(tmp_path, name)
+    with open(path, "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        file.write(b"\xff")  # Last payload byte no longer matches its crc
+    assert drain(SegmentLog(str(tmp_path))) == messages("a", 2)
+
+
+def test_prepend_goes_first_and_survives_restart(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=256)
+    log.append(messages("live", 10)[:5])
+    log.append(messages("live", 10)[5:])
+    batch, position = log.read(4)
+    log.commit(position)
+    log.prepend(messages("ring", 3))
+    log.prepend(messages("older", 2))
+
+    reopened = SegmentLog(str(tmp_path), segment_bytes=256)
+    assert reopened.records == 11
+    assert all(seq >= 0 for seq in reopened.segments)
+    assert drain(reopened) == messages("older", 2) + messages("ring", 3) + messages("live", 10)[4:]
+
+
+def test_prepend_into_empty_log(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.prepend(messages("ring", 3))
+    log.append(messages("live", 2))
+    assert drain(SegmentLog(str(tmp_path))) == messages("ring", 3) + messages("live", 2)
+
+
+def test_negative_segment_numbers_are_renumbered(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append(messages("b", 2))
+    log._write(os.path.join(tmp_path, "seg_-000000001.log"),
+               b"".join(SegmentLog._encode(*message) for message in messages("a", 2)), "wb")
+    with open(os.path.join(tmp_path, "cursor"), "w", encoding="ascii") as file:
+        file.write("-1 0")
+
+    reopened = SegmentLog(str(tmp_path))
+    assert reopened.segments[0] >= 0
+    assert not any("-" in name for name in segment_files(tmp_path))
+    assert drain(reopened) == messages("a", 2) + messages("b", 2)
+
+
+class StalledInfo:
+    rc = 0
+
+    def __init__(self, mid):
+        self.mid = mid
+
+    def is_published(self):
+        return False
+
+
+class StalledClient:
+    """paho stand-in that connects but never gets an ack back"""
+
+    def __init__(self):
+        self.published = 0
+
+    def max_inflight_messages_set(self, count):
+        pass
+
+    def reconnect_delay_set(self, min_delay, max_delay):
+        pass
+
+    def connect_async(self, host, port, keepalive):
+        pass
+
+    def loop_start(self):
+        self.on_connect(self, None, {}, 0)
+
+    def publish(self, topic, payload, qos):
+        self.published += 1
+        return StalledInfo(self.published)
+
+    def disconnect(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+def test_close_with_full_window_keeps_messages(tmp_path):
+    client = StalledClient()
+    outbox = Outbox(client, str(tmp_path), ack_timeout=0.05,
+                    publisher=Publisher(client, max_inflight=5)).start("localhost")
+    outbox.publish_many(messages("a", 20)[i][:2] for i in range(20))
+    time.sleep(0.3)  # Acks time out: the batch is abandoned while paho still holds its window slots
+    started = time.monotonic()
+    outbox.close(timeout=0.2)
+    assert time.monotonic() - started < 5
+    assert client.published == 5  # The window filled up and nothing was acked
+    assert drain(SegmentLog(str(tmp_path))) == messages("a", 20)
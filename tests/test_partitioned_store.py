@@ -0,0 +1,94 @@
+"""Partitioned store: retention keeps late rows out, compaction never loses late rows"""
+
+import os
+import sqlite3
+
+from mqtt.partitioned_store import DAY_MS, PartitionedStore, compact_sealed, open_catalog
+
+NOW = 1_714_521_600_000 + 12 * 3_600_000  # Noon
+
+
+def reading(ts, device="air_monitor_001"):
+    return (device, ts, 12.3, 25.8, 415, 22.4, 48.1, 0, 0)
+
+
+def states(directory):
+    catalog, _ = open_catalog(str(directory))
+    rows = dict(catalog.execute("SELECT start, state FROM partitions"))
+    catalog.close()
+    return rows
+
+
+def count(directory, start):
+    catalog, _ = open_catalog(str(directory))
+    (path,) = catalog.execute("SELECT path FROM partitions WHERE start = ?", (start,)).fetchone()
+    catalog.close()
+    conn = sqlite3.connect(os.path.join(directory, path))
+    try:
+        return conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0], \
+            conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def write(store, rows):
+    store.write(rows)
+    store.commit()
+
+
+def test_rows_past_retention_are_not_stored(tmp_path, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: NOW / 1000)
+    store = PartitionedStore(str(tmp_path), retention_days=2, maintenance_interval=1e9).open()
+    write(store, [reading(NOW), reading(NOW - 2 * DAY_MS), reading(NOW - 3 * DAY_MS), reading(NOW - 30 * DAY_MS)])
+    store.close()
+    assert store.expired_rows == 2
+    assert sorted(states(tmp_path)) == [NOW - 2 * DAY_MS - 12 * 3_600_000, NOW - 12 * 3_600_000]
+
+
+def sealed_store(directory):
+    """A store with yesterday's partition sealed and closed"""
+    store = PartitionedStore(str(directory), maintenance_interval=1e9).open()
+    write(store, [reading(NOW - DAY_MS + i) for i in range(10)])
+    store.maintain(NOW)
+    yesterday = NOW - DAY_MS - 12 * 3_600_000
+    assert states(directory)[yesterday] == "sealed"
+    return store, yesterday
+
+
+def test_compaction_rewrites_sealed_partitions(tmp_path):
+    store, yesterday = sealed_store(tmp_path)
+    assert compact_sealed(str(tmp_path)) == 1
+    assert states(tmp_path)[yesterday] == "compacted"
+    assert count(tmp_path, yesterday) == (10, "delete")
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".compact")]
+
+    write(store, [reading(NOW - DAY_MS + 100)])  # Late data after compaction reopens it
+    store.close()
+    assert states(tmp_path)[yesterday] == "open"
+    assert count(tmp_path, yesterday)[0] == 11
+
+
+def test_partition_reopened_mid_compaction_keeps_its_late_rows(tmp_path):
+    store, yesterday = sealed_store(tmp_path)
+    catalog, _ = open_catalog(str(tmp_path))
+    catalog.execute("UPDATE partitions SET state = 'compacting' WHERE start = ?", (yesterday,))
+    catalog.commit()
+    catalog.close()
+
+    write(store, [reading(NOW - DAY_MS + 100)])  # The writer is not kept waiting
+    assert states(tmp_path)[yesterday] == "open"
+    assert compact_sealed(str(tmp_path)) == 0
+    store.close()
+    assert count(tmp_path, yesterday)[0] == 11
+
+
+def test_interrupted_compaction_is_finished(tmp_path):
+    store, yesterday = sealed_store(tmp_path)
+    store.close()
+    catalog, _ = open_catalog(str(tmp_path))
+    catalog.execute("UPDATE partitions SET state = 'compacting' WHERE start = ?", (yesterday,))
+    catalog.commit()
+    catalog.close()
+    assert compact_sealed(str(tmp_path)) == 1
+    assert states(tmp_path)[yesterday] == "compacted"
+    assert count(tmp_path, yesterday) == (10, "delete")
@@ -0,0 +1,82 @@
+"""Round trips through every payload format: what the emulators publish is what the subscriber stores"""
+
+import pytest
+
+from common.payload_codec import (PAYLOAD_FORMATS, PayloadError, RECORD, decode_binary, decode_json,
+                                  encode_binary, encode_json, packed_messages)
+from common.readings import Reading
+from common.sensor_model import telemetry_messages
+from mqtt.reading_assembler import ReadingAssembler
+
+READINGS = [
+    Reading("air_monitor_001", 1_714_521_600_000, 12.3, 25.8, 415, 22.4, 48.1, 0, 0),  # Whole second
+    Reading("air_monitor_002", 1_714_521_600_250, 57.0, 71.5, 1830, 27.9, 69.9, 1, 2),  # Sub-second
+    Reading("air_monitor_003", 1_714_521_601_999, 5.0, 10.0, 400, 18.0, 30.0, 1, 1),
+]
+
+
+def assemble(messages, device):
+    rows = []
+    assembler = ReadingAssembler(rows.append, default_device=device)
+    for topic, payload in messages:
+        assert assembler.feed(topic, payload, 0)
+    assert not assembler.pending
+    return rows
+
+
+@pytest.mark.parametrize("reading", READINGS)
+def test_per_topic_round_trip(reading):
+    assert assemble(telemetry_messages(reading), reading.device_id) == [reading.as_row()]
+
+
+@pytest.mark.parametrize("reading", READINGS)
+def test_json_round_trip(reading):
+    assert decode_json(encode_json(reading)) == reading.as_row()[1:]
+
+
+@pytest.mark.parametrize("reading", READINGS)
+def test_binary_round_trip(reading):
+    payload = encode_binary(reading)
+    assert len(payload) == RECORD.size
+    assert decode_binary(payload) == pytest.approx(reading.as_row()[1:])
+
+
+@pytest.mark.parametrize("payload_format", [name for name in PAYLOAD_FORMATS if name != "per-topic"])
+def test_packed_messages_through_assembler(payload_format):
+    reading = READINGS[1]
+    (row,) = assemble(packed_messages(reading, reading.device_id, payload_format), "unused")
+    assert row == pytest.approx(reading.as_row())
+
+
+PARTIAL = [
+    Reading("air_monitor_001", 1_714_521_600_000, None, 25.8, 415, None, 48.1, None, None),
+    Reading("air_monitor_001", 1_714_521_600_500, 12.3, None, None, 22.4, None, 0, 1),
+    Reading("air_monitor_001", 1_714_521_601_000, None, None, None, None, None, 1, None),
+]
+
+
+@pytest.mark.parametrize("reading", PARTIAL)
+def test_json_missing_values(reading):
+    assert decode_json(encode_json(reading)) == reading.as_row()[1:]
+
+
+@pytest.mark.parametrize("reading", PARTIAL)
+def test_binary_missing_values(reading):
+    assert decode_binary(encode_binary(reading)) == reading.as_row()[1:]
+
+
+def test_binary_unknown_status():
+    reading = Reading("air_monitor_001", 1_714_521_600_000, 12.3, 25.8, 415, 22.4, 48.1, 1, None)
+    assert decode_binary(encode_binary(reading))[-2:] == (1, None)
+
+
+@pytest.mark.parametrize("payload", [b"", b"not json", b"[1, 2]", b'{"v": 1}', b'{"v": 99, "ts": 1}'])
+def test_json_rejects_malformed(payload):
+    with pytest.raises(PayloadError):
+        decode_json(payload)
+
+
+@pytest.mark.parametrize("payload", [b"", b"\x01" * (RECORD.size - 1), b"\x09" + b"\x00" * (RECORD.size - 1)])
+def test_binary_rejects_malformed(payload):
+    with pytest.raises(PayloadError):
+        decode_binary(payload)
@@ -0,0 +1,55 @@
+"""Rule files are checked when they are loaded, not when a reading hits them"""
+
+import json
+
+import pytest
+
+from common.payload_codec import decode_binary, encode_binary
+from common.readings import Reading
+from common.rules import MAX_STATUS_CODE, RuleError, RuleSet, load_rule_sets
+
+LEVELS = [{"status": "DANGER", "any": [["pm25", ">", 50]]}, {"status": "WARNING", "any": [["pm25", ">", 35]]}]
+
+
+def window(**fields):
+    return dict({"name": "pm25_mean", "metric": "pm25", "op": ">", "value": 35}, **fields)
+
+
+@pytest.mark.parametrize("mean_ms", [0, -1000, 0.5, "900000", None, True, float("nan")])
+def test_invalid_mean_window_is_rejected(mean_ms):
+    with pytest.raises(RuleError):
+        RuleSet("test", {"levels": LEVELS, "windows": [window(mean_ms=mean_ms)]})
+
+
+@pytest.mark.parametrize("count", [0, -3, 2.5, "5"])
+def test_invalid_consecutive_count_is_rejected(count):
+    with pytest.raises(RuleError):
+        RuleSet("test", {"levels": LEVELS, "windows": [window(consecutive=count)]})
+
+
+def test_non_numeric_window_threshold_is_rejected():
+    with pytest.raises(RuleError):
+        RuleSet("test", {"levels": LEVELS, "windows": [window(mean_ms=1000, value="35")]})
+
+
+def test_more_levels_than_status_codes_is_rejected(tmp_path):
+    extra = [{"status": "HAZARD", "any": [["pm25", ">", 150]]}] + LEVELS
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"test": {"levels": extra}}))
+    with pytest.raises(RuleError):
+        load_rule_sets(str(path))
+
+
+def test_every_status_code_survives_the_binary_record():
+    rule_set = RuleSet("test", {"levels": LEVELS})
+    assert max(rule_set.names) == MAX_STATUS_CODE
+    for code in rule_set.names:
+        reading = Reading("air_monitor_001", 1_714_521_600_000, 12.3, 25.8, 415, 22.4, 48.1, 1, code)
+        assert decode_binary(encode_binary(reading))[-1] == code
+
+
+def test_mean_window():
+    engine = RuleSet("test", {"levels": LEVELS, "windows": [window(mean_ms=1000)]}).alert_engine()
+    assert engine.update("a", 0, (40.0, None, None, None, None)) == [("a", "pm25_mean", True, 40.0, 0)]
+    assert engine.update("a", 500, (20.0, None, None, None, None)) == [("a", "pm25_mean", False, 30.0, 500)]
+    assert engine.update("a", 1500, (36.0, None, None, None, None)) == [("a", "pm25_mean", True, 36.0, 1500)]
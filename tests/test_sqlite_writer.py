@@ -0,0 +1,69 @@
+"""BatchedWriter keeps going past bad rows and never blocks a caller once it has stopped"""
+
+import sqlite3
+import time
+
+from mqtt.sqlite_writer import BatchedWriter
+
+
+class ListStore:
+    """Store that accepts rows of ints and raises like a real store on anything else"""
+
+    def __init__(self, fail=None):
+        self.rows = []
+        self.fail = fail
+
+    def open(self):
+        pass
+
+    def write(self, rows):
+        if self.fail is not None:
+            raise self.fail
+        for row in rows:
+            if not isinstance(row, int):
+                raise TypeError(f"bad row {row!r}")
+        self.rows += rows
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_bad_row_is_counted_and_writer_continues():
+    store = ListStore()
+    writer = BatchedWriter(store, flush_interval=0.01).start()
+    writer.put("not a row")
+    wait_for(lambda: writer.errors)
+    writer.put(1)
+    writer.put(2)
+    writer.close()
+    assert store.rows == [1, 2]
+    assert writer.errors == 1 and writer.rows_written == 2
+
+
+def test_store_errors_are_counted():
+    writer = BatchedWriter(ListStore(sqlite3.OperationalError("disk I/O error")), flush_interval=0.01).start()
+    writer.put(1)
+    writer.close()
+    assert writer.errors == 1 and writer.rows_written == 0
+
+
+def test_put_drops_once_writer_has_stopped():
+    writer = BatchedWriter(ListStore(), queue_size=2).start()
+    writer.close()
+    started = time.monotonic()
+    assert [writer.put(i) for i in range(5)] == [False] * 5
+    assert time.monotonic() - started < 1
+    assert writer.dropped == 5